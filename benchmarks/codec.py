@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Compares telebot.codec with json for storing updates: size and encode/decode time of a batch of updates, with the
+msgpack package (if installed) and with the pure Python implementation.
+
+    python benchmarks/codec.py [number of updates]
+"""
+import sys
+
+from updates import realistic_update, best_of
+
+from telebot import codec
+from telebot import types
+
+
+def main(count=1000):
+    updates = [types.Update.de_json(realistic_update(i)) for i in range(count)]
+    json_encoded = [update.to_json() for update in updates]
+    print('{0} updates, best of 5 runs'.format(count))
+    print('{0:<16} {1:>10} {2:>12} {3:>12}'.format('', 'bytes', 'encode ms', 'decode ms'))
+    print('{0:<16} {1:>10} {2:>12.1f} {3:>12.1f}'.format(
+        'json', sum(len(data.encode('utf-8')) for data in json_encoded),
+        best_of(lambda: [update.to_json() for update in updates]) * 1000,
+        best_of(lambda: [types.Update.de_json(data) for data in json_encoded]) * 1000))
+
+    msgpack = codec.msgpack
+    backends = [('msgpack', msgpack)] if msgpack is not None else []
+    backends.append(('pure', None))
+    for name, module in backends:
+        codec.msgpack = module
+        encoded = [codec.encode(update) for update in updates]
+        print('{0:<16} {1:>10} {2:>12.1f} {3:>12.1f}'.format(
+            'codec ({0})'.format(name), sum(map(len, encoded)),
+            best_of(lambda: [codec.encode(update) for update in updates]) * 1000,
+            best_of(lambda: [codec.decode(data) for data in encoded]) * 1000))
+    codec.msgpack = msgpack
+    if msgpack is None:
+        print('msgpack is not installed, pip install pyTelegramBotAPI[msgpack] to compare it')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Measures parsing a batch of realistic updates with and without types.LAZY_PARSING, for handlers that only read
+message.text and for handlers that read all nested objects.
+
+    python benchmarks/lazy_parsing.py [number of updates]
+"""
+import sys
+
+from updates import realistic_update, best_of
+
+from telebot import types
+
+
+def read_text(update):
+    return update.message.text
+
+
+def read_all(update):
+    message = update.message
+    reply = message.reply_to_message
+    return (message.text, message.from_user.id, message.chat.id, message.entities[0].type, reply.photo[0].file_id,
+            reply.caption_entities[0].type)
+
+
+def main(count=2000):
+    updates = [realistic_update(i) for i in range(count)]
+    print('{0} updates, best of 5 runs'.format(count))
+    print('{0:<12} {1:>10} {2:>10} {3:>8}'.format('handler', 'eager ms', 'lazy ms', 'speedup'))
+    for read in (read_text, read_all):
+        times = []
+        for lazy in (False, True):
+            types.LAZY_PARSING = lazy
+            times.append(best_of(lambda: [read(types.Update.de_json(update)) for update in updates]))
+        types.LAZY_PARSING = False
+        print('{0:<12} {1:>10.1f} {2:>10.1f} {3:>7.1f}x'.format(
+            read.__name__, times[0] * 1000, times[1] * 1000, times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the memory of types objects with __slots__ against the same classes with an instance __dict__, using
+tracemalloc. Run with CPython, tracemalloc is not available on PyPy.
+
+    python benchmarks/slots_memory.py [number of objects]
+"""
+import sys
+import tracemalloc
+
+from updates import realistic_update
+
+from telebot import types
+
+
+def allocated(factory, count):
+    tracemalloc.start()
+    objects = [factory(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def with_dict(cls):
+    # Subclasses without __slots__ get an instance __dict__
+    return type(cls.__name__ + 'WithDict', (cls,), {})
+
+
+def main(count=10000):
+    payload = realistic_update(1)['message']
+    factories = [
+        ('User', lambda cls: lambda i: cls.de_json(dict(payload['from'], id=i))),
+        ('Chat', lambda cls: lambda i: cls.de_json(dict(payload['chat'], id=i))),
+        ('MessageEntity', lambda cls: lambda i: cls.de_json(payload['entities'][0])),
+        ('PhotoSize', lambda cls: lambda i: cls.de_json(payload['reply_to_message']['photo'][0])),
+    ]
+    print('{0} objects each, bytes per object'.format(count))
+    print('{0:<14} {1:>8} {2:>8} {3:>8}'.format('type', 'slots', '__dict__', 'saved'))
+    for name, factory in factories:
+        cls = getattr(types, name)
+        slotted = allocated(factory(cls), count) / count
+        dicted = allocated(factory(with_dict(cls)), count) / count
+        print('{0:<14} {1:>8.0f} {2:>8.0f} {3:>7.0f}%'.format(name, slotted, dicted, 100 - slotted * 100 / dicted))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Realistic update payloads shared by the benchmarks
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def realistic_update(update_id):
+    """
+    Returns the json dict of a group message with entities, replying to a photo with a caption
+    """
+    user = {'id': 383324787, 'is_bot': False, 'first_name': 'Some', 'last_name': 'User', 'username': 'someuser',
+            'language_code': 'en'}
+    chat = {'id': -1001234567890, 'title': 'Group', 'type': 'supergroup', 'username': 'group'}
+    entities = [{'offset': 0, 'length': 6, 'type': 'bot_command'}, {'offset': 7, 'length': 4, 'type': 'bold'}]
+    photo = [{'file_id': 'AgADBAAD' + str(i), 'file_unique_id': 'AQAD' + str(i), 'file_size': 1000 * i,
+              'width': 90 * i, 'height': 60 * i} for i in range(1, 4)]
+    reply = {'message_id': 10, 'from': user, 'chat': chat, 'date': 1600000000, 'photo': photo, 'caption': 'photo',
+             'caption_entities': entities}
+    return {'update_id': update_id,
+            'message': {'message_id': 11, 'from': user, 'chat': chat, 'date': 1600000001, 'text': '/start text',
+                        'entities': entities, 'reply_to_message': reply}}
+
+
+def best_of(func, repeat=5):
+    """
+    Returns the shortest of `repeat` run times of func() in seconds
+    """
+    import time
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
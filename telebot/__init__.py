@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import functools
+import inspect
 import logging
-import re
 import sys
 import threading
 import time
@@ -19,8 +20,8 @@ logger.addHandler(console_output_handler)
 
 logger.setLevel(logging.ERROR)
 
-from telebot import apihelper, types, util
-from telebot.handler_backends import MemoryHandlerBackend, FileHandlerBackend
+from telebot import apihelper, types, util, handler_filters, callback_data
+from telebot.handler_backends import MemoryHandlerBackend, FileHandlerBackend, MemoryStateStorage, SkipHandler
 
 """
 Module : telebot
@@ -95,11 +96,14 @@ class TeleBot:
 
     def __init__(
             self, token, parse_mode=None, threaded=True, skip_pending=False, num_threads=2,
-            next_step_backend=None, reply_backend=None, exception_handler=None, last_update_id=0
+            next_step_backend=None, reply_backend=None, exception_handler=None, last_update_id=0,
+            worker_pool=None
     ):
         """
         :param token: bot API token
         :param parse_mode: default parse_mode
+        :param worker_pool: Optional pool used to run handlers when threaded is True, e.g.
+            util.ShardedThreadPool to run the handlers of one chat in order. Defaults to util.ThreadPool(num_threads).
         :return: Telebot object.
         """
 
@@ -123,6 +127,15 @@ class TeleBot:
         self.exception_handler = exception_handler
 
         self.message_handlers = []
+        self.media_group_handlers = []
+        self.state_handlers = {}
+        self.callback_data_handlers = []
+        self.callback_data_router = callback_data.CallbackDataRouter()
+        self.inline_query_coalescer = None
+        self.inline_results_cache = util.InlineResultsCache()
+        self._coalesced_wrappers = {}
+        self.state_storage = MemoryStateStorage()
+        self.batch_handlers = []
         self.edited_message_handlers = []
         self.channel_post_handlers = []
         self.edited_channel_post_handlers = []
@@ -134,7 +147,22 @@ class TeleBot:
         self.poll_handlers = []
         self.poll_answer_handlers = []
 
+        self.custom_filters = {}
+
+        self.process_pool = None
+        self.process_handlers = set()
+        self.watchdog = None
+        self.media_group_debounce = 1.0
+        self.media_group_collector = None
+
+        self.middlewares = []
+        self.middleware_chains = {}
+        self.middleware_timings = {}
+        self._middleware_wrappers = {}
+        self._middleware_lock = threading.Lock()
+
         if apihelper.ENABLE_MIDDLEWARE:
+            self.typed_middleware_update_types = ()
             self.typed_middleware_handlers = {
                 'message': [],
                 'edited_message': [],
@@ -151,7 +179,7 @@ class TeleBot:
 
         self.threaded = threaded
         if self.threaded:
-            self.worker_pool = util.ThreadPool(num_threads=num_threads)
+            self.worker_pool = worker_pool if worker_pool else util.ThreadPool(num_threads=num_threads)
 
     def enable_save_next_step_handlers(self, delay=120, filename="./.handler-saves/step.save"):
         """
@@ -290,10 +318,7 @@ class TeleBot:
         :return: array of Updates
         """
         json_updates = apihelper.get_updates(self.token, offset, limit, timeout, allowed_updates, long_polling_timeout)
-        ret = []
-        for ju in json_updates:
-            ret.append(types.Update.de_json(ju))
-        return ret
+        return types.Update.de_json_many(json_updates)
 
     def __skip_updates(self):
         """
@@ -319,9 +344,31 @@ class TeleBot:
         if self.skip_pending:
             logger.debug('Skipped {0} pending messages'.format(self.__skip_updates()))
             self.skip_pending = False
-        updates = self.get_updates(offset=(self.last_update_id + 1), timeout=timeout, long_polling_timeout = long_polling_timeout)
+        limit = None
+        if self.threaded:
+            if not self.__wait_for_worker_capacity():
+                return
+            free_slots = getattr(self.worker_pool, 'free_slots', None)
+            limit = free_slots() if free_slots is not None else None
+            if limit is not None:
+                limit = min(max(limit, 1), 100)
+        updates = self.get_updates(offset=(self.last_update_id + 1), limit=limit, timeout=timeout, long_polling_timeout = long_polling_timeout)
         self.process_new_updates(updates)
 
+    def __wait_for_worker_capacity(self):
+        """
+        Pauses polling while the worker pool is full (see the max_tasks and max_bytes arguments of util.ThreadPool).
+        Pools without wait_for_capacity are never considered full.
+        :return: False if polling was stopped while waiting
+        """
+        wait_for_capacity = getattr(self.worker_pool, 'wait_for_capacity', None)
+        if wait_for_capacity is None:
+            return True
+        while not wait_for_capacity(timeout=0.5):
+            if self.__stop_polling.is_set():
+                return False
+        return True
+
     def process_new_updates(self, updates):
         upd_count = len(updates)
         logger.debug('Received {0} new updates'.format(upd_count))
@@ -405,45 +452,152 @@ class TeleBot:
 
     def process_new_messages(self, new_messages):
         self._notify_next_handlers(new_messages)
+        self._notify_state_handlers(new_messages)
         self._notify_reply_handlers(new_messages)
         self.__notify_update(new_messages)
-        self._notify_command_handlers(self.message_handlers, new_messages)
+        self._notify_batch_handlers('message', new_messages)
+        if self.media_group_collector is not None:
+            self.media_group_collector.debounce = self.media_group_debounce
+            new_messages = self.media_group_collector.collect(new_messages)
+        self._notify_command_handlers(self.message_handlers, new_messages, 'message')
+
+    def _notify_batch_handlers(self, update_type, messages):
+        """
+        Passes the messages matching each batch handler as one list, or to the handler's collector if it batches
+        by size or time.
+        :param update_type: 'message', 'edited_message', 'channel_post' or 'edited_channel_post'
+        :param messages: list of messages of one process_new_updates call
+        """
+        for handler in self.batch_handlers:
+            if update_type not in handler['update_types']:
+                continue
+            batch = [message for message in messages if self._test_message_handler(handler, message)]
+            if not batch:
+                continue
+            if handler['collector'] is not None:
+                handler['collector'].add(batch)
+            else:
+                self._exec_task(handler['function'], batch)
+
+    def _notify_media_group(self, messages):
+        """
+        Passes a complete album to the first matching media group handler. The filters are tested against the
+        first message of the album. Albums no media group handler accepts are passed to the message handlers
+        message by message.
+        :param messages: list of messages sharing one media_group_id
+        """
+        for handler in self.media_group_handlers:
+            if self._test_message_handler(handler, messages[0]):
+                self._exec_task(handler['function'], messages)
+                return
+        self._notify_command_handlers(self.message_handlers, messages, 'message')
 
     def process_new_edited_messages(self, edited_message):
-        self._notify_command_handlers(self.edited_message_handlers, edited_message)
+        self._notify_batch_handlers('edited_message', edited_message)
+        self._notify_command_handlers(self.edited_message_handlers, edited_message, 'edited_message')
 
     def process_new_channel_posts(self, channel_post):
-        self._notify_command_handlers(self.channel_post_handlers, channel_post)
+        self._notify_batch_handlers('channel_post', channel_post)
+        self._notify_command_handlers(self.channel_post_handlers, channel_post, 'channel_post')
 
     def process_new_edited_channel_posts(self, edited_channel_post):
-        self._notify_command_handlers(self.edited_channel_post_handlers, edited_channel_post)
+        self._notify_batch_handlers('edited_channel_post', edited_channel_post)
+        self._notify_command_handlers(self.edited_channel_post_handlers, edited_channel_post, 'edited_channel_post')
 
     def process_new_inline_query(self, new_inline_querys):
-        self._notify_command_handlers(self.inline_handlers, new_inline_querys)
+        if self.inline_query_coalescer is not None:
+            self.inline_query_coalescer.add(new_inline_querys)
+        else:
+            self._notify_command_handlers(self.inline_handlers, new_inline_querys, 'inline_query')
+
+    def enable_inline_query_coalescing(self, debounce=0):
+        """
+        Only answers the latest inline query of every user. A query is dropped if a newer query of the same user
+        arrives before its handler starts. With debounce, a query is dispatched only after the user did not send
+        a newer one for `debounce` seconds.
+        :param debounce: Seconds to wait for a newer query of the same user, 0 to dispatch immediately
+        """
+        self.inline_query_coalescer = util.Coalescer(
+            self._notify_coalesced_inline_query, lambda query: query.from_user.id, debounce,
+            self._handle_background_exception)
+
+    def _notify_coalesced_inline_query(self, inline_query):
+        for handler in self.inline_handlers:
+            if self._test_message_handler(handler, inline_query):
+                function = handler['function']
+                if self.process_pool is not None and function in self.process_handlers:
+                    # The process pool gets the bare handler, so the query is claimed before it is sent there
+                    if self.inline_query_coalescer.claim(inline_query):
+                        self._exec_task(function, inline_query)
+                    else:
+                        logger.debug('Dropped superseded inline query {0}'.format(inline_query.id))
+                    return
+                self._exec_task(self._wrap_coalesced(function), inline_query)
+                return
+        self.inline_query_coalescer.claim(inline_query)
+
+    def _wrap_coalesced(self, handler):
+        """
+        Returns a function that runs `handler` (with the inline query middleware chain) only if its query was not
+        superseded by a newer query of the same user in the meantime
+        """
+        wrapper = self._coalesced_wrappers.get(handler)
+        if wrapper is None:
+            inner = self._wrap_middlewares('inline_query', handler)
+
+            @functools.wraps(inner)
+            def wrapper(inline_query, *args, **kwargs):
+                if not self.inline_query_coalescer.claim(inline_query):
+                    logger.debug('Dropped superseded inline query {0}'.format(inline_query.id))
+                    return None
+                return inner(inline_query, *args, **kwargs)
+
+            self._coalesced_wrappers[handler] = wrapper
+        return wrapper
 
     def process_new_chosen_inline_query(self, new_chosen_inline_querys):
-        self._notify_command_handlers(self.chosen_inline_handlers, new_chosen_inline_querys)
+        self._notify_command_handlers(self.chosen_inline_handlers, new_chosen_inline_querys, 'chosen_inline_result')
 
     def process_new_callback_query(self, new_callback_querys):
-        self._notify_command_handlers(self.callback_query_handlers, new_callback_querys)
+        if len(self.callback_data_router):
+            new_callback_querys = self._notify_callback_data_handlers(new_callback_querys)
+        self._notify_command_handlers(self.callback_query_handlers, new_callback_querys, 'callback_query')
+
+    def _notify_callback_data_handlers(self, new_callback_querys):
+        """
+        Passes every callback query to the best matching handler registered with a data pattern,
+        with the parsed pattern parameters as keyword arguments.
+        :param new_callback_querys:
+        :return: list of the callback queries no data pattern handler accepted
+        """
+        remaining = []
+        for call in new_callback_querys:
+            for handler, kwargs in self.callback_data_router.iter_matches(call.data):
+                if self._test_message_handler(handler, call):
+                    self._exec_task(self._wrap_middlewares('callback_query', handler['function']), call, **kwargs)
+                    break
+            else:
+                remaining.append(call)
+        return remaining
 
     def process_new_shipping_query(self, new_shipping_querys):
-        self._notify_command_handlers(self.shipping_query_handlers, new_shipping_querys)
+        self._notify_command_handlers(self.shipping_query_handlers, new_shipping_querys, 'shipping_query')
 
     def process_new_pre_checkout_query(self, pre_checkout_querys):
-        self._notify_command_handlers(self.pre_checkout_query_handlers, pre_checkout_querys)
+        self._notify_command_handlers(self.pre_checkout_query_handlers, pre_checkout_querys, 'pre_checkout_query')
 
     def process_new_poll(self, polls):
-        self._notify_command_handlers(self.poll_handlers, polls)
+        self._notify_command_handlers(self.poll_handlers, polls, 'poll')
 
     def process_new_poll_answer(self, poll_answers):
-        self._notify_command_handlers(self.poll_answer_handlers, poll_answers)
+        self._notify_command_handlers(self.poll_answer_handlers, poll_answers, 'poll_answer')
 
     def process_middlewares(self, update):
-        for update_type, middlewares in self.typed_middleware_handlers.items():
-            if getattr(update, update_type) is not None:
-                for typed_middleware_handler in middlewares:
-                    typed_middleware_handler(self, getattr(update, update_type))
+        for update_type in self.typed_middleware_update_types:
+            obj = getattr(update, update_type)
+            if obj is not None:
+                for typed_middleware_handler in self.typed_middleware_handlers[update_type]:
+                    typed_middleware_handler(self, obj)
 
         if len(self.default_middleware_handlers) > 0:
             for default_middleware_handler in self.default_middleware_handlers:
@@ -606,6 +760,13 @@ class TeleBot:
         logger.info('Stopped polling.')
 
     def _exec_task(self, task, *args, **kwargs):
+        if self.process_pool is not None:
+            handler = inspect.unwrap(task)
+            if handler in self.process_handlers:
+                self.process_pool.put(handler, *args, **kwargs)
+                return
+        if self.watchdog is not None:
+            task = self.watchdog.wrap(task)
         if self.threaded:
             self.worker_pool.put(task, *args, **kwargs)
         else:
@@ -616,8 +777,72 @@ class TeleBot:
 
     def stop_bot(self):
         self.stop_polling()
+        if self.media_group_collector:
+            self.media_group_collector.flush()
+        for handler in self.batch_handlers:
+            if handler['collector'] is not None:
+                handler['collector'].flush()
         if self.worker_pool:
             self.worker_pool.close()
+        if self.process_pool:
+            self.process_pool.close()
+        if self.inline_query_coalescer:
+            self.inline_query_coalescer.close()
+        if self.watchdog:
+            self.watchdog.close()
+
+    def enable_watchdog(self, default_deadline=None, interval=1.0, cancel=True, on_overrun=None):
+        """
+        Starts a util.Watchdog that reports handlers running past their deadline and collects run time statistics.
+        Per handler deadlines are set with bot.watchdog.set_deadline(handler, seconds).
+        :param default_deadline: Seconds a handler may run, None for no global deadline
+        :param interval: Seconds between two checks
+        :param cancel: Ask handlers past their deadline to stop (see util.cancelled and util.check_cancelled)
+        :param on_overrun: Optional function called with (handler, seconds running, stack) for every overrun
+        :return: the watchdog
+        """
+        self.watchdog = util.Watchdog(default_deadline, interval, cancel, on_overrun)
+        return self.watchdog
+
+    def enable_process_pool(self, num_processes=None, initializer=None, initargs=()):
+        """
+        Starts a pool of worker processes for the handlers marked with run_in_process.
+        :param num_processes: Number of worker processes, defaults to the number of CPUs
+        :param initializer: Optional function called in every worker process
+        :param initargs: Arguments for initializer
+        Exceptions of handlers in the process pool are passed to the exception_handler like those of the worker threads.
+        """
+        self.process_pool = util.ProcessPool(num_processes, initializer, initargs, self._handle_background_exception)
+
+    def _handle_background_exception(self, exception):
+        """
+        Passes an exception raised outside the polling loop and the worker threads (in the process pool or a timer
+        thread) to the exception_handler, and logs it if it was not handled
+        """
+        if self.exception_handler is not None:
+            handled = self.exception_handler.handle(exception)
+        else:
+            handled = False
+        if not handled:
+            logger.error("Exception in background task: {0}".format(repr(exception)))
+
+    def run_in_process(self, handler):
+        """
+        Handler decorator that runs the handler in the process pool (see enable_process_pool) instead of a worker thread.
+        Must be placed below the handler decorator. The handler has to be a module level function.
+        Class based middleware is not run for handlers in the process pool.
+
+        Example:
+
+        bot.enable_process_pool(4)
+
+        @bot.message_handler(content_types=['document'])
+        @bot.run_in_process
+        def render(message):
+            bot.send_photo(message.chat.id, render_document(message.document))
+        """
+        self.process_handlers.add(handler)
+        return handler
 
     def set_update_listener(self, listener):
         self.update_listener.append(listener)
@@ -1585,7 +1810,7 @@ class TeleBot:
         Use this method to send answers to an inline query. On success, True is returned.
         No more than 50 results per query are allowed.
         :param inline_query_id: Unique identifier for the answered query
-        :param results: Array of results for the inline query
+        :param results: Array of results for the inline query, or a string with the serialized JSON array
         :param cache_time: The maximum amount of time in seconds that the result of the inline query may be cached on the server.
         :param is_personal: Pass True, if results may be cached on the server side only for the user that sent the query.
         :param next_offset: Pass the offset that a client should send in the next query with the same text to receive more results.
@@ -1597,6 +1822,37 @@ class TeleBot:
         return apihelper.answer_inline_query(self.token, inline_query_id, results, cache_time, is_personal, next_offset,
                                              switch_pm_text, switch_pm_parameter)
 
+    def answer_inline_query_paged(self, inline_query, results, cache_time=None, is_personal=None,
+                                  switch_pm_text=None, switch_pm_parameter=None):
+        """
+        Answers an inline query with one page of a result list cached in bot.inline_results_cache.
+        The result list is computed and serialized only once per query text (and user, if is_personal);
+        the following pages are served from the cache using the offset sent by the client.
+
+        Example:
+
+        @bot.inline_handler(func=lambda query: True)
+        def search(inline_query):
+            bot.answer_inline_query_paged(inline_query, lambda: expensive_search(inline_query.query))
+
+        :param inline_query: InlineQuery to answer
+        :param results: list of results, or a function returning it that is only called if the list is not cached
+        :param cache_time: The maximum amount of time in seconds that the result of the inline query may be cached on the server.
+        :param is_personal: Pass True, if the results are specific to the user; they are then cached per user
+        :param switch_pm_text: See answer_inline_query
+        :param switch_pm_parameter: See answer_inline_query
+        :return: True means success.
+        """
+        user_id = inline_query.from_user.id if is_personal else None
+        serialized = self.inline_results_cache.get(inline_query.query, user_id)
+        if serialized is None:
+            if callable(results):
+                results = results()
+            serialized = self.inline_results_cache.set(inline_query.query, results, user_id)
+        page, next_offset = self.inline_results_cache.page(serialized, inline_query.offset)
+        return self.answer_inline_query(inline_query.id, page, cache_time, is_personal, next_offset,
+                                        switch_pm_text, switch_pm_parameter)
+
     def answer_callback_query(self, callback_query_id, text=None, show_alert=None, url=None, cache_time=None):
         """
         Use this method to send answers to callback queries sent from inline keyboards. The answer will be displayed to
@@ -1712,7 +1968,8 @@ class TeleBot:
                 handlers = self.reply_backend.get_handlers(message.reply_to_message.message_id)
                 if handlers:
                     for handler in handlers:
-                        self._exec_task(handler["callback"], message, *handler["args"], **handler["kwargs"])
+                        callback = self._wrap_middlewares('message', handler["callback"], cache=False)
+                        self._exec_task(callback, message, *handler["args"], **handler["kwargs"])
 
     def register_next_step_handler(self, message, callback, *args, **kwargs):
         """
@@ -1781,15 +2038,64 @@ class TeleBot:
         :param new_messages:
         :return:
         """
-        for i, message in enumerate(new_messages):
-            need_pop = False
+        remaining = []
+        for message in new_messages:
             handlers = self.next_step_backend.get_handlers(message.chat.id)
             if handlers:
                 for handler in handlers:
-                    need_pop = True
-                    self._exec_task(handler["callback"], message, *handler["args"], **handler["kwargs"])
-            if need_pop:
-                new_messages.pop(i)  # removing message that was detected with next_step_handler
+                    callback = self._wrap_middlewares('message', handler["callback"], cache=False)
+                    self._exec_task(callback, message, *handler["args"], **handler["kwargs"])
+            else:
+                remaining.append(message)
+        if len(remaining) != len(new_messages):
+            new_messages[:] = remaining  # removing messages that were detected with next_step_handler
+
+    def _notify_state_handlers(self, new_messages):
+        """
+        Passes every message whose (chat, user) is in a state with registered state handlers to the first matching
+        handler of that state. Handled messages are removed from new_messages.
+        :param new_messages:
+        :return:
+        """
+        if not self.state_handlers:
+            return
+        remaining = []
+        for message in new_messages:
+            handled = False
+            if message.from_user is not None:
+                handlers = self.state_handlers.get(self.state_storage.get_state(message.chat.id, message.from_user.id))
+                if handlers:
+                    for handler in handlers:
+                        if self._test_message_handler(handler, message):
+                            self._exec_task(self._wrap_middlewares('message', handler['function']), message)
+                            handled = True
+                            break
+            if not handled:
+                remaining.append(message)
+        if len(remaining) != len(new_messages):
+            new_messages[:] = remaining
+
+    def set_state(self, chat_id, user_id, state):
+        """
+        Sets the conversation state of a user in a chat. The next messages of the user in this chat are passed to
+        the state handlers of `state` (see state_handler) before any message handler.
+        :param chat_id:
+        :param user_id:
+        :param state: Any string
+        """
+        self.state_storage.set_state(chat_id, user_id, state)
+
+    def get_state(self, chat_id, user_id):
+        """
+        Returns the conversation state of a user in a chat, None if no state is set
+        """
+        return self.state_storage.get_state(chat_id, user_id)
+
+    def delete_state(self, chat_id, user_id):
+        """
+        Ends the conversation of a user in a chat, removing its state and data
+        """
+        self.state_storage.delete_state(chat_id, user_id)
 
     @staticmethod
     def _build_handler_dict(handler, **filters):
@@ -1849,9 +2155,92 @@ class TeleBot:
         if update_types:
             for update_type in update_types:
                 self.typed_middleware_handlers[update_type].append(handler)
+            self.typed_middleware_update_types = tuple(
+                update_type for update_type, handlers in self.typed_middleware_handlers.items() if handlers)
         else:
             self.default_middleware_handlers.append(handler)
 
+    def setup_middleware(self, middleware):
+        """
+        Registers a class based middleware (a handler_backends.BaseMiddleware instance). Middleware runs in the
+        order it was registered, on the worker thread together with each handler of its update types.
+        Class based middleware does not need apihelper.ENABLE_MIDDLEWARE.
+        :param middleware: BaseMiddleware instance
+        """
+        self.middlewares.append(middleware)
+        chains = {}
+        for update_type in util.update_types:
+            chain = tuple(m for m in self.middlewares if not m.update_types or update_type in m.update_types)
+            if chain:
+                chains[update_type] = chain
+        with self._middleware_lock:
+            self.middleware_chains = chains
+            self._middleware_wrappers = {}
+            self._coalesced_wrappers = {}
+
+    def _wrap_middlewares(self, update_type, handler, cache=True):
+        """
+        Returns a function that runs the middleware chain of `update_type` around `handler`,
+        or the handler itself if no middleware is registered for the update type.
+        :param cache: Reuse the wrapper for the next calls. False for short lived handlers like next step callbacks,
+            which would otherwise fill the cache.
+        """
+        chain = self.middleware_chains.get(update_type)
+        if not chain:
+            return handler
+        key = (update_type, handler)
+        wrapper = self._middleware_wrappers.get(key) if cache else None
+        if wrapper is None:
+            @functools.wraps(handler)
+            def wrapper(message, *args, **kwargs):
+                return self._run_middlewares(chain, handler, message, args, kwargs)
+
+            if cache:
+                self._middleware_wrappers[key] = wrapper
+        return wrapper
+
+    def _run_middlewares(self, chain, handler, message, args, kwargs):
+        data = {}
+        exception = None
+        started = []
+        try:
+            for middleware in chain:
+                start = time.perf_counter()
+                result = middleware.pre_process(message, data)
+                self._record_middleware_time(middleware, 'pre', time.perf_counter() - start)
+                started.append(middleware)
+                if isinstance(result, SkipHandler):
+                    return None
+            return handler(message, *args, **kwargs)
+        except Exception as e:
+            exception = e
+            raise
+        finally:
+            for middleware in reversed(started):
+                start = time.perf_counter()
+                middleware.post_process(message, data, exception)
+                self._record_middleware_time(middleware, 'post', time.perf_counter() - start)
+
+    def _record_middleware_time(self, middleware, phase, elapsed):
+        key = (type(middleware).__name__, phase)
+        with self._middleware_lock:
+            timing = self.middleware_timings.get(key)
+            if timing is None:
+                timing = self.middleware_timings[key] = [0, 0.0]
+            timing[0] += 1
+            timing[1] += elapsed
+
+    def middleware_stats(self):
+        """
+        Returns the number of calls and the total time in seconds of every class based middleware by phase, e.g.
+        {'LoggingMiddleware': {'pre': (120, 0.004), 'post': (120, 0.011)}}
+        """
+        stats = {}
+        with self._middleware_lock:
+            for (name, phase), (calls, total) in self.middleware_timings.items():
+                stats.setdefault(name, {})[phase] = (calls, total)
+        return stats
+
     def message_handler(self, commands=None, regexp=None, func=None, content_types=None, **kwargs):
         """
         Message handler decorator.
@@ -1904,8 +2293,147 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.message_handlers.append(handler_dict)
 
+    def state_handler(self, state, commands=None, regexp=None, func=None, content_types=None, **kwargs):
+        """
+        State handler decorator.
+        Handles messages of users in the given conversation state (see set_state). State handlers are looked up by
+        the state of the message's (chat, user), so only one state read is needed per message, and take precedence
+        over message handlers.
+
+        Example:
+
+        @bot.message_handler(commands=['register'])
+        def register(message):
+            bot.set_state(message.chat.id, message.from_user.id, 'ask_name')
+            bot.send_message(message.chat.id, 'What is your name?')
+
+        @bot.state_handler('ask_name')
+        def ask_name(message):
+            bot.delete_state(message.chat.id, message.from_user.id)
+            bot.send_message(message.chat.id, 'Hello, {0}'.format(message.text))
+
+        :param state: State the handler is registered for.
+        :param commands: Optional list of strings (commands to handle).
+        :param regexp: Optional regular expression.
+        :param func: Optional lambda function.
+        :param content_types: Supported content types. Defaults to ['text'].
+        """
+        if content_types is None:
+            content_types = ['text']
+
+        def decorator(handler):
+            handler_dict = self._build_handler_dict(handler, commands=commands, regexp=regexp, func=func,
+                                                    content_types=content_types, **kwargs)
+            self.add_state_handler(state, handler_dict)
+            return handler
+
+        return decorator
+
+    def add_state_handler(self, state, handler_dict):
+        """
+        Adds a state handler
+        :param state:
+        :param handler_dict:
+        :return:
+        """
+        self._compile_handler(handler_dict)
+        self.state_handlers.setdefault(state, []).append(handler_dict)
+
+    def media_group_handler(self, func=None, content_types=None, **kwargs):
+        """
+        Media group handler decorator.
+        Handles albums: the messages sharing a media_group_id are buffered until no further message of the album
+        arrived for bot.media_group_debounce seconds, then the handler is called once with the list of messages,
+        sorted by message_id. Registering a media group handler enables the buffering; album messages are then no
+        longer passed to message handlers, unless no media group handler accepts the album.
+
+        Example:
+
+        @bot.media_group_handler(content_types=['photo', 'video'])
+        def album(messages):
+            bot.send_message(messages[0].chat.id, 'Got {0} files'.format(len(messages)))
+
+        :param func: Optional lambda function, called with the first message of the album.
+        :param content_types: Supported content types of the first message. Defaults to photo, video, document and audio.
+        """
+        if content_types is None:
+            content_types = ['photo', 'video', 'document', 'audio']
+
+        def decorator(handler):
+            handler_dict = self._build_handler_dict(handler, func=func, content_types=content_types, **kwargs)
+            self.add_media_group_handler(handler_dict)
+            return handler
+
+        return decorator
+
+    def batch_handler(self, update_types=None, max_size=None, max_delay=None, commands=None, regexp=None, func=None,
+                      content_types=None, **kwargs):
+        """
+        Batch handler decorator.
+        The handler is called with the list of all matching messages of one process_new_updates call, or, if max_size
+        or max_delay is given, of a window of up to max_size messages or max_delay seconds. Batch handlers are called
+        in addition to the message handlers, like update listeners.
+
+        Example:
+
+        @bot.batch_handler(content_types=['text', 'photo'], max_size=500, max_delay=2)
+        def store(messages):
+            db.insert_many([message.json for message in messages])
+
+        :param update_types: Message update types to collect. Defaults to ['message'].
+        :param max_size: Maximum number of messages per batch
+        :param max_delay: Maximum seconds a message waits for its batch
+        :param commands: Optional list of strings (commands to handle).
+        :param regexp: Optional regular expression.
+        :param func: Optional lambda function, called with every single message.
+        :param content_types: Supported content types. Defaults to ['text'].
+        """
+        if update_types is None:
+            update_types = ['message']
+        if content_types is None:
+            content_types = ['text']
+
+        def decorator(handler):
+            handler_dict = self._build_handler_dict(handler, commands=commands, regexp=regexp, func=func,
+                                                    content_types=content_types, **kwargs)
+            self.add_batch_handler(handler_dict, update_types, max_size, max_delay)
+            return handler
+
+        return decorator
+
+    def add_batch_handler(self, handler_dict, update_types=None, max_size=None, max_delay=None):
+        """
+        Adds a batch handler
+        :param handler_dict:
+        :param update_types: Message update types to collect. Defaults to ['message'].
+        :param max_size: Maximum number of messages per batch
+        :param max_delay: Maximum seconds a message waits for its batch
+        :return:
+        """
+        self._compile_handler(handler_dict)
+        handler_dict['update_types'] = frozenset(update_types if update_types else ['message'])
+        handler_dict['collector'] = None
+        if max_size or max_delay is not None:
+            handler_dict['collector'] = util.BatchCollector(
+                functools.partial(self._exec_task, handler_dict['function']), max_size, max_delay,
+                self._handle_background_exception)
+        self.batch_handlers.append(handler_dict)
+
+    def add_media_group_handler(self, handler_dict):
+        """
+        Adds a media group handler
+        :param handler_dict:
+        :return:
+        """
+        self._compile_handler(handler_dict)
+        self.media_group_handlers.append(handler_dict)
+        if self.media_group_collector is None:
+            self.media_group_collector = util.MediaGroupCollector(
+                self._notify_media_group, self.media_group_debounce, self._handle_background_exception)
+
     def edited_message_handler(self, commands=None, regexp=None, func=None, content_types=None, **kwargs):
         """
         Edit message handler decorator
@@ -1938,6 +2466,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.edited_message_handlers.append(handler_dict)
 
     def channel_post_handler(self, commands=None, regexp=None, func=None, content_types=None, **kwargs):
@@ -1972,6 +2501,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.channel_post_handlers.append(handler_dict)
 
     def edited_channel_post_handler(self, commands=None, regexp=None, func=None, content_types=None, **kwargs):
@@ -2006,6 +2536,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.edited_channel_post_handlers.append(handler_dict)
 
     def inline_handler(self, func, **kwargs):
@@ -2029,6 +2560,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.inline_handlers.append(handler_dict)
 
     def chosen_inline_handler(self, func, **kwargs):
@@ -2052,30 +2584,48 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.chosen_inline_handlers.append(handler_dict)
 
-    def callback_query_handler(self, func, **kwargs):
+    def callback_query_handler(self, func=None, data=None, **kwargs):
         """
-        Callback request handler decorator
-        :param func:
+        Callback request handler decorator.
+        Handlers with a `data` pattern are looked up in a trie (see callback_data.CallbackDataRouter) before the
+        handlers without one are tested in order. The parameters parsed from the pattern are passed to the handler
+        as keyword arguments.
+
+        Example:
+
+        @bot.callback_query_handler(data='page:{n:int}')
+        def page(call, n):
+            bot.answer_callback_query(call.id, 'Page {0}'.format(n))
+
+        :param func: Optional lambda function
+        :param data: Optional callback_data pattern, e.g. 'page:{n:int}' or 'settings:*'
         :param kwargs:
         :return:
         """
 
         def decorator(handler):
             handler_dict = self._build_handler_dict(handler, func=func, **kwargs)
-            self.add_callback_query_handler(handler_dict)
+            self.add_callback_query_handler(handler_dict, data)
             return handler
 
         return decorator
 
-    def add_callback_query_handler(self, handler_dict):
+    def add_callback_query_handler(self, handler_dict, data=None):
         """
         Adds a callback request handler
         :param handler_dict:
+        :param data: Optional callback_data pattern
         :return:
         """
-        self.callback_query_handlers.append(handler_dict)
+        self._compile_handler(handler_dict)
+        if data is None:
+            self.callback_query_handlers.append(handler_dict)
+        else:
+            self.callback_data_router.add(data, handler_dict)
+            self.callback_data_handlers.append(handler_dict)
 
     def shipping_query_handler(self, func, **kwargs):
         """
@@ -2098,6 +2648,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.shipping_query_handlers.append(handler_dict)
 
     def pre_checkout_query_handler(self, func, **kwargs):
@@ -2121,6 +2672,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.pre_checkout_query_handlers.append(handler_dict)
 
     def poll_handler(self, func, **kwargs):
@@ -2144,6 +2696,7 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.poll_handlers.append(handler_dict)
 
     def poll_answer_handler(self, func=None, **kwargs):
@@ -2167,8 +2720,54 @@ class TeleBot:
         :param handler_dict:
         :return:
         """
+        self._compile_handler(handler_dict)
         self.poll_answer_handlers.append(handler_dict)
 
+    def add_custom_filter(self, custom_filter):
+        """
+        Registers a custom filter class. The filter is used for every handler declared with a keyword argument
+        equal to custom_filter.key. Handlers registered earlier are recompiled.
+
+        Example:
+
+        class ChatTypeFilter(handler_filters.HandlerFilter):
+            key = 'chat_types'
+            cost = 5
+
+            def check(self, message):
+                return message.chat.type in self.value
+
+        bot.add_custom_filter(ChatTypeFilter)
+
+        @bot.message_handler(chat_types=['supergroup'])
+        def group_message(message):
+            pass
+
+        :param custom_filter: subclass of handler_filters.HandlerFilter
+        """
+        self.custom_filters[custom_filter.key] = custom_filter
+        for handlers in (
+                self.message_handlers, self.edited_message_handlers, self.channel_post_handlers,
+                self.edited_channel_post_handlers, self.inline_handlers, self.chosen_inline_handlers,
+                self.callback_query_handlers, self.shipping_query_handlers, self.pre_checkout_query_handlers,
+                self.poll_handlers, self.poll_answer_handlers, self.media_group_handlers, self.batch_handlers,
+                self.callback_data_handlers):
+            for handler_dict in handlers:
+                self._compile_handler(handler_dict)
+        for handlers in self.state_handlers.values():
+            for handler_dict in handlers:
+                self._compile_handler(handler_dict)
+
+    def _compile_handler(self, handler_dict):
+        """
+        Compiles the filters of a handler dict and stores them under the 'compiled_filters' key
+        :param handler_dict:
+        :return: compiled filters
+        """
+        compiled_filters = handler_filters.compile_filters(handler_dict['filters'], self.custom_filters)
+        handler_dict['compiled_filters'] = compiled_filters
+        return compiled_filters
+
     def _test_message_handler(self, message_handler, message):
         """
         Test message handler
@@ -2176,14 +2775,11 @@ class TeleBot:
         :param message:
         :return:
         """
-        for message_filter, filter_value in message_handler['filters'].items():
-            if filter_value is None:
-                continue
-
-            if not self._test_filter(message_filter, filter_value, message):
-                return False
-
-        return True
+        compiled_filters = message_handler.get('compiled_filters')
+        if compiled_filters is None:
+            # Handler dict was appended to a handler list directly
+            compiled_filters = self._compile_handler(message_handler)
+        return handler_filters.check_filters(compiled_filters, message)
 
     @staticmethod
     def _test_filter(message_filter, filter_value, message):
@@ -2194,20 +2790,14 @@ class TeleBot:
         :param message:
         :return:
         """
-        test_cases = {
-            'content_types': lambda msg: msg.content_type in filter_value,
-            'regexp': lambda msg: msg.content_type == 'text' and re.search(filter_value, msg.text, re.IGNORECASE),
-            'commands': lambda msg: msg.content_type == 'text' and util.extract_command(msg.text) in filter_value,
-            'func': lambda msg: filter_value(msg)
-        }
-
-        return test_cases.get(message_filter, lambda msg: False)(message)
+        return handler_filters.build_filter(message_filter, filter_value).check(message)
 
-    def _notify_command_handlers(self, handlers, new_messages):
+    def _notify_command_handlers(self, handlers, new_messages, update_type=None):
         """
         Notifies command handlers
         :param handlers:
         :param new_messages:
+        :param update_type: Update type of new_messages, selects the middleware chain run around the handler
         :return:
         """
         if len(handlers) == 0:
@@ -2215,7 +2805,7 @@ class TeleBot:
         for message in new_messages:
             for message_handler in handlers:
                 if self._test_message_handler(message_handler, message):
-                    self._exec_task(message_handler['function'], message)
+                    self._exec_task(self._wrap_middlewares(update_type, message_handler['function']), message)
                     break
 
 
@@ -2460,6 +3050,10 @@ class AsyncTeleBot(TeleBot):
     def answer_inline_query(self, *args, **kwargs):
         return TeleBot.answer_inline_query(self, *args, **kwargs)
 
+    @util.async_dec()
+    def answer_inline_query_paged(self, *args, **kwargs):
+        return TeleBot.answer_inline_query_paged(self, *args, **kwargs)
+
     @util.async_dec()
     def answer_callback_query(self, *args, **kwargs):
         return TeleBot.answer_callback_query(self, *args, **kwargs)
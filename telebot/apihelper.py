@@ -1199,7 +1199,9 @@ def answer_callback_query(token, callback_query_id, text=None, show_alert=None,
 def answer_inline_query(token, inline_query_id, results, cache_time=None, is_personal=None, next_offset=None,
                         switch_pm_text=None, switch_pm_parameter=None):
     method_url = 'answerInlineQuery'
-    payload = {'inline_query_id': inline_query_id, 'results': _convert_list_json_serializable(results)}
+    if not util.is_string(results):
+        results = _convert_list_json_serializable(results)
+    payload = {'inline_query_id': inline_query_id, 'results': results}
     if cache_time is not None:
         payload['cache_time'] = cache_time
     if is_personal is not None:
@@ -1321,13 +1323,11 @@ def stop_poll(token, chat_id, message_id, reply_markup=None):
 
 
 def _convert_list_json_serializable(results):
-    ret = ''
-    for r in results:
-        if isinstance(r, types.JsonSerializable):
-            ret = ret + r.to_json() + ','
-    if len(ret) > 0:
-        ret = ret[:-1]
-    return '[' + ret + ']'
+    results = [r for r in results if isinstance(r, types.JsonSerializable)]
+    if all(isinstance(r, types.Dictionaryable) for r in results):
+        # Encode the whole list in a single pass
+        return json.dumps([r.to_dict() for r in results])
+    return '[' + ','.join(r.to_json() for r in results) + ']'
 
 
 def _convert_markup(markup):
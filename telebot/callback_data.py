@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import re
+
+_param_re = re.compile(r'^\{(\w+)(?::(\w+))?\}$')
+_int_re = re.compile(r'^-?\d+$')
+
+
+def _convert_int(segment):
+    if _int_re.match(segment) is None:
+        raise ValueError(segment)
+    return int(segment)
+
+
+def _convert_str(segment):
+    if not segment:
+        raise ValueError(segment)
+    return segment
+
+
+CONVERTERS = {
+    'int': _convert_int,
+    'float': float,
+    'str': _convert_str,
+}
+
+
+class _Node(object):
+    __slots__ = ('literals', 'params', 'wildcard', 'values')
+
+    def __init__(self):
+        self.literals = {}
+        self.params = []
+        self.wildcard = None
+        self.values = []
+
+
+class CallbackDataRouter(object):
+    """
+    Routes callback_data strings to values (handlers) registered for patterns.
+
+    A pattern consists of segments split by `separator`. A segment is either a literal, a typed parameter
+    ('{n:int}', '{q:float}', '{name}' or '{name:str}') or, as the last segment, '*' to match any rest:
+
+        router.add('page:{n:int}', handler)
+        router.add('settings:*', other_handler)
+        router.match('page:3')  # (handler, {'n': 3})
+
+    Patterns are stored in a trie, so matching walks the segments of the data once instead of testing every
+    pattern. Literal segments are preferred over parameters, parameters over '*'; values registered for the same
+    pattern are returned in registration order.
+    """
+
+    def __init__(self, separator=':'):
+        self.separator = separator
+        self.root = _Node()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, pattern, value):
+        """
+        Registers `value` for `pattern`
+        :param pattern: pattern string, e.g. 'page:{n:int}'
+        :param value: value returned by match, usually a handler
+        """
+        node = self.root
+        segments = self._split_pattern(pattern)
+        for i, segment in enumerate(segments):
+            if segment == '*':
+                if i != len(segments) - 1:
+                    raise ValueError("'*' must be the last segment of the pattern {0!r}".format(pattern))
+                if node.wildcard is None:
+                    node.wildcard = _Node()
+                node = node.wildcard
+                break
+            param = _param_re.match(segment)
+            if param is None:
+                node = node.literals.setdefault(segment, _Node())
+                continue
+            name, type_name = param.group(1), param.group(2) or 'str'
+            converter = CONVERTERS.get(type_name)
+            if converter is None:
+                raise ValueError("Unknown parameter type {0!r} in pattern {1!r}".format(type_name, pattern))
+            for param_name, param_converter, child in node.params:
+                if param_name == name and param_converter is converter:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, converter, child))
+                node = child
+        node.values.append(value)
+        self.size += 1
+
+    def _split_pattern(self, pattern):
+        # The separator may appear inside parameters ('{n:int}'), only split outside of braces
+        segments = []
+        start = depth = 0
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif depth == 0 and pattern.startswith(self.separator, i):
+                segments.append(pattern[start:i])
+                i += len(self.separator)
+                start = i
+                continue
+            i += 1
+        segments.append(pattern[start:])
+        return segments
+
+    def iter_matches(self, data):
+        """
+        Yields (value, kwargs) for every pattern matching `data`, best match first
+        """
+        if data is None:
+            return
+        segments = data.split(self.separator)
+        for value, kwargs in self._walk(self.root, segments, 0, {}):
+            yield value, kwargs
+
+    def _walk(self, node, segments, index, kwargs):
+        if index == len(segments):
+            for value in node.values:
+                yield value, dict(kwargs)
+        else:
+            segment = segments[index]
+            child = node.literals.get(segment)
+            if child is not None:
+                for match in self._walk(child, segments, index + 1, kwargs):
+                    yield match
+            for name, converter, child in node.params:
+                try:
+                    kwargs[name] = converter(segment)
+                except ValueError:
+                    continue
+                for match in self._walk(child, segments, index + 1, kwargs):
+                    yield match
+                del kwargs[name]
+        if node.wildcard is not None:
+            for value in node.wildcard.values:
+                yield value, dict(kwargs)
+
+    def match(self, data):
+        """
+        Returns (value, kwargs) of the best matching pattern, or None if no pattern matches `data`
+        """
+        for match in self.iter_matches(data):
+            return match
+        return None
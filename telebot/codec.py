@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary encoding of values containing telebot.types objects, e.g. for state storages, caches and queues.
+
+The encoding is msgpack. Objects are stored as msgpack extension values holding the class id and the object's json
+dict, with json keys replaced by small integer ids. The class and key tables are generated from the type definitions
+in telebot.types; every encoded value starts with a checksum of the tables, so data written by a telebot version with
+different types is rejected instead of being decoded wrongly.
+
+If the msgpack package is installed it is used for speed, otherwise a pure Python implementation of the same format.
+"""
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from telebot import types
+
+FORMAT_VERSION = 1
+EXT_OBJECT = 1
+
+
+def _build_tables():
+    classes = sorted((cls for cls in vars(types).values()
+                      if isinstance(cls, type) and issubclass(cls, types.JsonDeserializable)
+                      and cls is not types.JsonDeserializable),
+                     key=lambda cls: cls.__name__)
+    keys = set(['inline_keyboard', 'option_ids'])
+    for cls in classes:
+        keys.update(key for name, key in types._json_fields(cls))
+    keys = sorted(keys)
+    checksum = zlib.crc32('\n'.join([cls.__name__ for cls in classes] + [''] + keys).encode('utf-8')) & 0xffff
+    return tuple(classes), tuple(keys), checksum
+
+
+CLASSES, KEYS, TABLE_CHECKSUM = _build_tables()
+_CLASS_IDS = dict((cls, i) for i, cls in enumerate(CLASSES))
+_KEY_IDS = dict((key, i) for i, key in enumerate(KEYS))
+_HEADER = struct.pack('>BH', FORMAT_VERSION, TABLE_CHECKSUM)
+
+
+def _compress_keys(value):
+    if isinstance(value, dict):
+        return dict((_KEY_IDS.get(key, key), _compress_keys(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_compress_keys(item) for item in value]
+    return value
+
+
+def _expand_keys(value):
+    if isinstance(value, dict):
+        return dict((KEYS[key] if isinstance(key, int) else key, _expand_keys(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_expand_keys(item) for item in value]
+    return value
+
+
+def _object_payload(obj):
+    class_id = _CLASS_IDS.get(type(obj))
+    if class_id is None:
+        raise TypeError("Can't encode {0}".format(type(obj).__name__))
+    return [class_id, _compress_keys(obj.to_dict())]
+
+
+def _object_from_payload(payload):
+    class_id, json_dict = payload
+    return CLASSES[class_id].de_json(_expand_keys(json_dict))
+
+
+def encode(value):
+    """
+    Encodes `value` as bytes. The value may be a telebot.types object or None, bool, int, float, str, bytes and
+    lists, tuples and dicts of them (tuples are decoded as lists).
+    :param value: value to encode
+    :return: bytes
+    """
+    if msgpack is not None:
+        return _HEADER + msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+    parts = [_HEADER]
+    _pack(value, parts)
+    return b''.join(parts)
+
+
+def decode(data):
+    """
+    Decodes bytes created by encode
+    :param data: bytes, bytearray or memoryview
+    :return: decoded value
+    """
+    data = memoryview(data)
+    if len(data) < 3:
+        raise ValueError('Not an encoded telebot value')
+    version, checksum = struct.unpack_from('>BH', data)
+    if version != FORMAT_VERSION or checksum != TABLE_CHECKSUM:
+        raise ValueError('Value was encoded by a telebot version with different types')
+    if msgpack is not None:
+        return msgpack.unpackb(data[3:], ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+    value, position = _unpack(data, 3)
+    if position != len(data):
+        raise ValueError('Extra data after the encoded value')
+    return value
+
+
+# encode and decode under the names of pickle, so the module can be passed as a serializer
+dumps = encode
+loads = decode
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, types.JsonDeserializable):
+        return msgpack.ExtType(EXT_OBJECT, msgpack.packb(_object_payload(obj), use_bin_type=True))
+    raise TypeError("Can't encode {0}".format(type(obj).__name__))
+
+
+def _msgpack_ext_hook(code, data):
+    if code != EXT_OBJECT:
+        raise ValueError('Unknown extension type {0}'.format(code))
+    return _object_from_payload(msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+
+# Pure Python msgpack
+
+def _pack_header(size, fix, fix_limit, codes, parts):
+    if size < fix_limit:
+        parts.append(bytes((fix | size,)))
+    elif codes[0] is not None and size < 0x100:
+        parts.append(struct.pack('>BB', codes[0], size))
+    elif size < 0x10000:
+        parts.append(struct.pack('>BH', codes[1], size))
+    else:
+        parts.append(struct.pack('>BI', codes[2], size))
+
+
+def _pack(value, parts):
+    if value is None:
+        parts.append(b'\xc0')
+    elif value is True:
+        parts.append(b'\xc3')
+    elif value is False:
+        parts.append(b'\xc2')
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            parts.append(bytes((value,)))
+        elif -32 <= value < 0:
+            parts.append(struct.pack('>b', value))
+        elif 0 <= value < 0x10000000000000000:
+            for code, fmt, limit in ((0xcc, '>BB', 0x100), (0xcd, '>BH', 0x10000), (0xce, '>BI', 0x100000000),
+                                     (0xcf, '>BQ', 0x10000000000000000)):
+                if value < limit:
+                    parts.append(struct.pack(fmt, code, value))
+                    break
+        elif -0x8000000000000000 <= value < 0:
+            for code, fmt, limit in ((0xd0, '>Bb', 0x80), (0xd1, '>Bh', 0x8000), (0xd2, '>Bi', 0x80000000),
+                                     (0xd3, '>Bq', 0x8000000000000000)):
+                if value >= -limit:
+                    parts.append(struct.pack(fmt, code, value))
+                    break
+        else:
+            raise OverflowError('Integer out of range: {0}'.format(value))
+    elif isinstance(value, float):
+        parts.append(struct.pack('>Bd', 0xcb, value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        _pack_header(len(data), 0xa0, 32, (0xd9, 0xda, 0xdb), parts)
+        parts.append(data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        _pack_header(len(data), 0, 0, (0xc4, 0xc5, 0xc6), parts)
+        parts.append(data)
+    elif isinstance(value, (list, tuple)):
+        _pack_header(len(value), 0x90, 16, (None, 0xdc, 0xdd), parts)
+        for item in value:
+            _pack(item, parts)
+    elif isinstance(value, dict):
+        _pack_header(len(value), 0x80, 16, (None, 0xde, 0xdf), parts)
+        for key, item in value.items():
+            _pack(key, parts)
+            _pack(item, parts)
+    elif isinstance(value, types.JsonDeserializable):
+        payload = []
+        _pack(_object_payload(value), payload)
+        data = b''.join(payload)
+        _pack_header(len(data), 0, 0, (0xc7, 0xc8, 0xc9), parts)
+        parts.append(bytes((EXT_OBJECT,)))
+        parts.append(data)
+    else:
+        raise TypeError("Can't encode {0}".format(type(value).__name__))
+
+
+_FIXED = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+# code -> (struct format of the length, kind)
+_SIZED = {
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+    0xc7: ('>B', 'ext'), 0xc8: ('>H', 'ext'), 0xc9: ('>I', 'ext'),
+}
+_FIXEXT_SIZES = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+
+
+def _unpack(data, position):
+    code = data[position]
+    position += 1
+    if code < 0x80:
+        return code, position
+    if code >= 0xe0:
+        return code - 0x100, position
+    if 0xa0 <= code <= 0xbf:
+        return _unpack_sized('str', code & 0x1f, data, position)
+    if 0x90 <= code <= 0x9f:
+        return _unpack_sized('array', code & 0x0f, data, position)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_sized('map', code & 0x0f, data, position)
+    if code == 0xc0:
+        return None, position
+    if code == 0xc2:
+        return False, position
+    if code == 0xc3:
+        return True, position
+    fmt = _FIXED.get(code)
+    if fmt is not None:
+        return struct.unpack_from(fmt, data, position)[0], position + struct.calcsize(fmt)
+    if code in _SIZED:
+        fmt, kind = _SIZED[code]
+        size = struct.unpack_from(fmt, data, position)[0]
+        return _unpack_sized(kind, size, data, position + struct.calcsize(fmt))
+    if code in _FIXEXT_SIZES:
+        return _unpack_sized('ext', _FIXEXT_SIZES[code], data, position)
+    raise ValueError('Unknown msgpack type 0x{0:02x}'.format(code))
+
+
+def _unpack_sized(kind, size, data, position):
+    if kind == 'str':
+        return bytes(data[position:position + size]).decode('utf-8'), position + size
+    if kind == 'bin':
+        return bytes(data[position:position + size]), position + size
+    if kind == 'array':
+        items = []
+        for _ in range(size):
+            item, position = _unpack(data, position)
+            items.append(item)
+        return items, position
+    if kind == 'map':
+        items = {}
+        for _ in range(size):
+            key, position = _unpack(data, position)
+            items[key], position = _unpack(data, position)
+        return items, position
+    ext_code = data[position]
+    position += 1
+    if ext_code != EXT_OBJECT:
+        raise ValueError('Unknown extension type {0}'.format(ext_code))
+    payload, end = _unpack(data, position)
+    if end != position + size:
+        raise ValueError('Corrupt extension value')
+    return _object_from_payload(payload), end
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Renders message text with its entities as HTML or MarkdownV2, e.g. to repost a formatted message.
+"""
+
+HTML_SUBS = {
+    'bold': '<b>{text}</b>',
+    'italic': '<i>{text}</i>',
+    'pre': '<pre>{text}</pre>',
+    'code': '<code>{text}</code>',
+    # plain URLs have no text and do not need tags
+    'text_link': '<a href="{url}">{text}</a>',
+    'strikethrough': '<s>{text}</s>',
+    'underline': '<u>{text}</u>',
+}
+
+MARKDOWN_V2_SUBS = {
+    'bold': '*{text}*',
+    'italic': '_{text}_',
+    'pre': '```{language}\n{text}```',
+    'code': '`{text}`',
+    'text_link': '[{text}]({url})',
+    'strikethrough': '~{text}~',
+    'underline': '__{text}__',
+}
+
+_MARKDOWN_V2_SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+_MARKDOWN_V2_TABLE = str.maketrans(dict((char, '\\' + char) for char in _MARKDOWN_V2_SPECIAL))
+_MARKDOWN_V2_CODE_TABLE = str.maketrans({'`': '\\`', '\\': '\\\\'})
+_HTML_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_CODE_TYPES = frozenset(('pre', 'code'))
+_TEXT = '\x00'
+
+
+def escape_html(text):
+    return text.translate(_HTML_TABLE)
+
+
+def escape_markdown_v2(text, code=False):
+    """
+    Escapes `text` for MarkdownV2
+    :param text: text
+    :param code: True for text inside pre or code entities, where only '`' and '\\' are escaped
+    """
+    return text.translate(_MARKDOWN_V2_CODE_TABLE if code else _MARKDOWN_V2_TABLE)
+
+
+def utf16_offsets(text):
+    """
+    Returns a list mapping every UTF-16 code unit offset of `text` (as used by Telegram entities) to a str index,
+    or None if both are the same because `text` has no characters outside the BMP
+    """
+    if not text or max(text) <= '\uffff':
+        return None
+    offsets = []
+    for index, char in enumerate(text):
+        offsets.append(index)
+        if char > '\uffff':
+            offsets.append(index)
+    offsets.append(len(text))
+    return offsets
+
+
+class _Span(object):
+    __slots__ = ('start', 'end', 'open', 'close', 'code')
+
+    def __init__(self, start, end, open, close, code):
+        self.start = start
+        self.end = end
+        self.open = open
+        self.close = close
+        self.code = code
+
+
+def _spans(text, entities, subs, html):
+    offsets = utf16_offsets(text)
+    spans = []
+    for entity in entities:
+        if not entity.length:
+            continue
+        start, end = entity.offset, entity.offset + entity.length
+        if offsets is not None:
+            start, end = offsets[min(start, len(offsets) - 1)], offsets[min(end, len(offsets) - 1)]
+        entity_type, url = entity.type, entity.url
+        if entity_type == 'text_mention':
+            url = 'tg://user?id={0}'.format(entity.user.id)
+            if entity_type not in subs:
+                entity_type = 'text_link'
+        elif entity_type == 'mention':
+            url = 'https://t.me/{0}'.format(text[start + 1:end])
+        template = subs.get(entity_type)
+        if not template:
+            continue
+        if url is not None:
+            url = url.replace('"', '&quot;') if html else url.replace('\\', '\\\\').replace(')', '\\)')
+        tag = template.format(text=_TEXT, url=url, language=getattr(entity, 'language', None) or '')
+        open, _, close = tag.partition(_TEXT)
+        spans.append(_Span(start, end, open, close, entity_type in _CODE_TYPES))
+    # Outer entities first if several start at the same position
+    spans.sort(key=lambda span: (span.start, -span.end))
+    return spans
+
+
+def apply_entities(text, entities, mode='HTML', custom_subs=None):
+    """
+    Returns `text` with `entities` applied as HTML or MarkdownV2 markup.
+
+    Nested entities are rendered nested; entities that overlap without nesting are closed and reopened around each
+    other. Entity types without a substitute (e.g. url, hashtag) are only escaped.
+    :param text: message text or caption
+    :param entities: list of MessageEntity
+    :param mode: 'HTML' or 'MarkdownV2'
+    :param custom_subs: dict of entity type to a substitute like '<b>{text}</b>', replacing or adding to the defaults.
+        Substitutes can use {text}, {url} and {language}.
+    :return: formatted text
+    """
+    if mode == 'HTML':
+        subs, html = HTML_SUBS, True
+    elif mode == 'MarkdownV2':
+        subs, html = MARKDOWN_V2_SUBS, False
+    else:
+        raise ValueError("mode must be 'HTML' or 'MarkdownV2', not {0!r}".format(mode))
+    if custom_subs:
+        subs = dict(subs, **custom_subs)
+
+    def escape(chunk):
+        if html:
+            return chunk.translate(_HTML_TABLE)
+        if any(span.code for span in stack):
+            return chunk.translate(_MARKDOWN_V2_CODE_TABLE)
+        return chunk.translate(_MARKDOWN_V2_TABLE)
+
+    spans = _spans(text, entities, subs, html)
+    openings = {}
+    for span in spans:
+        openings.setdefault(span.start, []).append(span)
+    boundaries = sorted(set([span.start for span in spans] + [span.end for span in spans]))
+
+    parts = []
+    stack = []
+    position = 0
+    for boundary in boundaries:
+        if boundary > position:
+            parts.append(escape(text[position:boundary]))
+            position = boundary
+        if any(span.end == boundary for span in stack):
+            # Close spans down to the outermost one ending here, then reopen the inner ones that go on
+            reopen = []
+            while any(span.end == boundary for span in stack):
+                span = stack.pop()
+                parts.append(span.close)
+                if span.end != boundary:
+                    reopen.append(span)
+            for span in reversed(reopen):
+                parts.append(span.open)
+                stack.append(span)
+        for span in openings.get(boundary, ()):
+            parts.append(span.open)
+            stack.append(span)
+    if position < len(text):
+        parts.append(escape(text[position:]))
+    return ''.join(parts)
@@ -141,3 +141,136 @@ class RedisHandlerBackend(HandlerBackend):
             handlers = pickle.loads(value)
             self.clear_handlers(handler_group_id)
         return handlers
+
+
+class StateStorage(object):
+    """
+    Class for storing the conversation state (and optional data) per (chat, user)
+    """
+    def set_state(self, chat_id, user_id, state):
+        raise NotImplementedError()
+
+    def get_state(self, chat_id, user_id):
+        raise NotImplementedError()
+
+    def delete_state(self, chat_id, user_id):
+        raise NotImplementedError()
+
+    def set_data(self, chat_id, user_id, data):
+        raise NotImplementedError()
+
+    def get_data(self, chat_id, user_id):
+        raise NotImplementedError()
+
+
+class MemoryStateStorage(StateStorage):
+    def __init__(self):
+        self.states = {}
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def set_state(self, chat_id, user_id, state):
+        with self.lock:
+            self.states[(chat_id, user_id)] = state
+
+    def get_state(self, chat_id, user_id):
+        return self.states.get((chat_id, user_id))
+
+    def delete_state(self, chat_id, user_id):
+        with self.lock:
+            self.states.pop((chat_id, user_id), None)
+            self.data.pop((chat_id, user_id), None)
+
+    def set_data(self, chat_id, user_id, data):
+        with self.lock:
+            self.data[(chat_id, user_id)] = data
+
+    def get_data(self, chat_id, user_id):
+        return self.data.get((chat_id, user_id), {})
+
+
+class RedisStateStorage(StateStorage):
+    """
+    Keeps state and data of a (chat, user) in one Redis hash, so reading the state is a single HGET.
+    State and data are serialized with `serializer`, any object with pickle-like dumps and loads, so get_state
+    returns a state equal to the one set, e.g. an int or an enum member with pickle.
+    Pass telebot.codec to store data holding telebot types compactly; states are then limited to str, int and the
+    other plain values codec encodes.
+    """
+    def __init__(self, host='localhost', port=6379, db=0, prefix='telebot_state', password=None, serializer=pickle):
+        from redis import Redis
+        self.prefix = prefix
+        self.redis = Redis(host, port, db, password)
+        self.serializer = serializer
+
+    def _key(self, chat_id, user_id):
+        return ':'.join((self.prefix, str(chat_id), str(user_id)))
+
+    def set_state(self, chat_id, user_id, state):
+        self.redis.hset(self._key(chat_id, user_id), 'state', self.serializer.dumps(state))
+
+    def get_state(self, chat_id, user_id):
+        value = self.redis.hget(self._key(chat_id, user_id), 'state')
+        return self.serializer.loads(value) if value is not None else None
+
+    def delete_state(self, chat_id, user_id):
+        self.redis.delete(self._key(chat_id, user_id))
+
+    def set_data(self, chat_id, user_id, data):
+        self.redis.hset(self._key(chat_id, user_id), 'data', self.serializer.dumps(data))
+
+    def get_data(self, chat_id, user_id):
+        value = self.redis.hget(self._key(chat_id, user_id), 'data')
+        return self.serializer.loads(value) if value else {}
+
+
+class BaseMiddleware(object):
+    """
+    Base class for class based middleware, registered with TeleBot.setup_middleware.
+
+    Middleware runs on the worker thread together with each handler of its update types: pre_process before the
+    handler, post_process after it (also if the handler raised). `data` is a dict shared by the middleware of one
+    handler call. Both hooks do nothing by default, override the ones you need. Unlike middleware_handler functions,
+    class based middleware does not need apihelper.ENABLE_MIDDLEWARE.
+
+    Middleware runs for message, state, next step and reply handlers and the handlers of the other update types.
+    It does not run for media group and batch handlers, which get a list of messages, nor for handlers in the
+    process pool.
+
+        class LoggingMiddleware(BaseMiddleware):
+            update_types = ['message', 'callback_query']
+
+            def pre_process(self, message, data):
+                data['started'] = time.time()
+
+            def post_process(self, message, data, exception):
+                logger.info('handled in %s', time.time() - data['started'])
+
+        bot.setup_middleware(LoggingMiddleware())
+    """
+    # Update types the middleware runs for, None for all update types
+    update_types = None
+
+    def pre_process(self, message, data):
+        """
+        Called before the handler. Return SkipHandler() to skip the handler; post_process is called anyway.
+        :param message: Message (or query) passed to the handler
+        :param data: dict shared with the other middleware and post_process
+        """
+        pass
+
+    def post_process(self, message, data, exception):
+        """
+        Called after the handler, in reverse order of pre_process.
+        :param message: Message (or query) passed to the handler
+        :param data: dict shared with the other middleware and pre_process
+        :param exception: Exception raised by the handler or pre_process, None on success
+        """
+        pass
+
+
+class SkipHandler(object):
+    """
+    Returned by BaseMiddleware.pre_process to skip the handler
+    """
+    pass
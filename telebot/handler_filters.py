@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import re
+
+from telebot import util
+
+_pattern_type = type(re.compile(''))
+
+
+class HandlerFilter(object):
+    """
+    Base class for compiled handler filters.
+
+    Filters are built once, when a handler is registered, from the keyword arguments passed to the handler
+    decorator (e.g. commands=['start'] builds a CommandsFilter). The filters of one handler are checked in
+    ascending order of `cost`, so cheap checks reject a message before regular expressions or user
+    functions are run.
+
+    Custom filters subclass this class, set `key` to the name of the decorator keyword argument and
+    override check. They are registered with TeleBot.add_custom_filter:
+
+        class IsAdminFilter(HandlerFilter):
+            key = 'is_admin'
+
+            def check(self, message):
+                return (message.from_user.id in ADMINS) == self.value
+
+        bot.add_custom_filter(IsAdminFilter)
+
+        @bot.message_handler(is_admin=True)
+        def admin_only(message):
+            pass
+    """
+    key = None
+    cost = 50
+
+    def __init__(self, value):
+        self.value = value
+
+    def check(self, message):
+        """
+        Returns True if the handler may process `message`.
+
+        This function must be overridden by subclasses.
+        :param message: Message (or query) to test
+        :return: bool
+        """
+        raise NotImplementedError
+
+
+class ContentTypesFilter(HandlerFilter):
+    key = 'content_types'
+    cost = 0
+
+    def __init__(self, value):
+        if util.is_string(value):
+            value = [value]
+        super(ContentTypesFilter, self).__init__(frozenset(value))
+
+    def check(self, message):
+        return message.content_type in self.value
+
+
+class CommandsFilter(HandlerFilter):
+    key = 'commands'
+    cost = 10
+
+    def __init__(self, value):
+        if util.is_string(value):
+            value = [value]
+        super(CommandsFilter, self).__init__(frozenset(command.lstrip('/') for command in value))
+
+    def check(self, message):
+        return message.content_type == 'text' and util.extract_command(message.text) in self.value
+
+
+class RegexpFilter(HandlerFilter):
+    key = 'regexp'
+    cost = 20
+
+    def __init__(self, value):
+        if not isinstance(value, _pattern_type):
+            value = re.compile(value, re.IGNORECASE)
+        super(RegexpFilter, self).__init__(value)
+
+    def check(self, message):
+        return message.content_type == 'text' and self.value.search(message.text) is not None
+
+
+class FuncFilter(HandlerFilter):
+    key = 'func'
+    cost = 100
+
+    def check(self, message):
+        return self.value(message)
+
+
+class UnknownFilter(HandlerFilter):
+    """
+    Placeholder for a keyword argument no filter is registered for. It never matches, so a handler with an
+    unknown filter is never called.
+    """
+    cost = 0
+
+    def check(self, message):
+        return False
+
+
+DEFAULT_FILTERS = {
+    ContentTypesFilter.key: ContentTypesFilter,
+    CommandsFilter.key: CommandsFilter,
+    RegexpFilter.key: RegexpFilter,
+    FuncFilter.key: FuncFilter,
+}
+
+
+def build_filter(key, value, custom_filters=None):
+    """
+    Builds the filter object for one decorator keyword argument.
+    :param key: Name of the filter (e.g. 'commands')
+    :param value: Value passed to the decorator
+    :param custom_filters: Optional dict of custom filter classes by key, checked before the default ones
+    :return: HandlerFilter instance
+    """
+    filter_class = None
+    if custom_filters:
+        filter_class = custom_filters.get(key)
+    if filter_class is None:
+        filter_class = DEFAULT_FILTERS.get(key)
+    if filter_class is None:
+        return UnknownFilter(value)
+    return filter_class(value)
+
+
+def compile_filters(filters, custom_filters=None):
+    """
+    Compiles the filters of a handler dict into a tuple of filter objects, cheapest first.
+    Filters with a None value are skipped.
+    :param filters: dict of filter values by key
+    :param custom_filters: Optional dict of custom filter classes by key
+    :return: tuple of HandlerFilter
+    """
+    compiled = [build_filter(key, value, custom_filters) for key, value in filters.items() if value is not None]
+    compiled.sort(key=lambda handler_filter: handler_filter.cost)
+    return tuple(compiled)
+
+
+def check_filters(compiled_filters, message):
+    """
+    Checks compiled filters in order and stops at the first one that fails.
+    :param compiled_filters: tuple returned by compile_filters
+    :param message: Message (or query) to test
+    :return: True if all filters pass
+    """
+    for handler_filter in compiled_filters:
+        if not handler_filter.check(message):
+            return False
+    return True
@@ -7,18 +7,186 @@ try:
 except ImportError:
     import json
 
+from telebot import formatting
 from telebot import util
 
 DISABLE_KEYLEN_ERROR = False
+# If True, Update and Message keep nested objects as raw dicts and build them on first attribute access
+LAZY_PARSING = False
+# How Message keeps its raw payload in message.json:
+# 'keep' - as received (bytes for bytearray and memoryview input), 'bytes' - as UTF-8 encoded json, compact unless
+# received as bytes, 'drop' - not at all,
+# 'top_level' - as received, except for messages nested in another one (reply_to_message, pinned_message).
+# With 'bytes' nested messages keep no json either, it is part of the json of the outer message.
+MESSAGE_JSON_RETENTION = 'keep'
+_JSON_RETENTIONS = ('keep', 'bytes', 'drop', 'top_level')
+
+# util.LRUCache of shared User and Chat instances, see enable_interning
+_intern_table = None
 
 logger = logging.getLogger('TeleBot')
 
 
+class _Raw(object):
+    """
+    Json value of a lazy attribute that has not been parsed yet
+    """
+    __slots__ = ('parse', 'value')
+
+    def __init__(self, parse, value):
+        self.parse = parse
+        self.value = value
+
+
+def _lazy(parse, value):
+    """
+    Returns parse(value), or a _Raw placeholder for it if LAZY_PARSING is enabled
+    """
+    if value is None:
+        return None
+    if LAZY_PARSING:
+        return _Raw(parse, value)
+    return parse(value)
+
+
+def _lazy_attribute(name):
+    """
+    Property over the slot '_' + name that parses a _Raw value on first access and caches the result
+    """
+    slot = '_' + name
+
+    def getter(self):
+        value = getattr(self, slot)
+        if value.__class__ is _Raw:
+            value = value.parse(value.value)
+            setattr(self, slot, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, slot, value)
+
+    return property(getter, setter)
+
+
+def _with_lazy_attributes(cls):
+    """
+    Class decorator adding a _lazy_attribute property for every name in cls._lazy_attributes
+    """
+    for name in cls._lazy_attributes:
+        setattr(cls, name, _lazy_attribute(name))
+    return cls
+
+
+def _retained_json(json_string):
+    if MESSAGE_JSON_RETENTION == 'bytes':
+        if isinstance(json_string, bytes):
+            # Received as bytes, e.g. a webhook body; kept as is
+            return json_string
+        if not util.is_string(json_string):
+            json_string = util.compact_json(json_string)
+        return json_string.encode('utf-8')
+    if MESSAGE_JSON_RETENTION == 'drop':
+        return None
+    if MESSAGE_JSON_RETENTION not in _JSON_RETENTIONS:
+        raise ValueError('Unknown MESSAGE_JSON_RETENTION {0!r}, expected one of {1}'.format(
+            MESSAGE_JSON_RETENTION, ', '.join(_JSON_RETENTIONS)))
+    return json_string
+
+
+def _parse_nested_message(json_string):
+    # With 'bytes' the nested json is not encoded again, it is already part of the outer message's json
+    return Message._de_json(json_string, MESSAGE_JSON_RETENTION not in ('bytes', 'top_level'))
+
+
+def enable_interning(maxsize=10000):
+    """
+    Makes User.de_json and Chat.de_json return one shared instance for identical users and chats.
+    Instances are looked up by class and id and reused while their json stays the same; the `maxsize` most recently
+    seen ids are kept. Shared instances must not be modified by handlers.
+    :param maxsize: Maximum number of interned users and chats
+    """
+    global _intern_table
+    _intern_table = util.LRUCache(maxsize)
+
+
+def disable_interning():
+    global _intern_table
+    _intern_table = None
+
+
+def get_interned(cls, id):
+    """
+    Returns the most recently received User or Chat (`cls`) with the given id, or None if it is not interned
+    """
+    table = _intern_table
+    if table is None:
+        return None
+    entry = table.get((cls, id))
+    return entry[1] if entry is not None else None
+
+
+def _intern(cls, obj, parse):
+    table = _intern_table
+    try:
+        fingerprint = frozenset(obj.items())
+    except TypeError:
+        # Objects with nested values, e.g. a full Chat from getChat, are not interned
+        return parse(obj)
+    key = (cls, obj['id'])
+    entry = table.get(key)
+    if entry is not None and entry[0] == fingerprint:
+        return entry[1]
+    instance = parse(obj)
+    table.set(key, (fingerprint, instance))
+    return instance
+
+
+# Attributes whose json key differs from their name, for JsonDeserializable.to_dict
+_JSON_KEYS = {'from_user': 'from'}
+_json_fields_cache = {}
+
+
+def _json_fields(cls):
+    """
+    Returns (attribute, json key) pairs of the json fields of the JsonDeserializable `cls`
+    """
+    fields = _json_fields_cache.get(cls)
+    if fields is None:
+        fields = []
+        exclude = getattr(cls, '_not_json', ())
+        for name in util.slot_names(cls):
+            if name[:1] == '_':
+                if not isinstance(getattr(cls, name[1:], None), property):
+                    continue
+                name = name[1:]
+            if name not in exclude:
+                fields.append((name, _JSON_KEYS.get(name, name)))
+        fields = _json_fields_cache[cls] = tuple(fields)
+    return fields
+
+
+def _to_json_value(value):
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(item) for item in value]
+    if isinstance(value, (JsonDeserializable, Dictionaryable)):
+        return value.to_dict()
+    return value
+
+
+def _loads_bytes(data):
+    try:
+        return json.loads(data)
+    except TypeError:
+        # The json parser doesn't take this buffer type: memoryview, or any bytes in the json module of Python 3.5
+        return json.loads(bytes(data).decode('utf-8'))
+
+
 class JsonSerializable(object):
     """
     Subclasses of this class are guaranteed to be able to be converted to JSON format.
     All subclasses of this class must override to_json.
     """
+    __slots__ = ()
 
     def to_json(self):
         """
@@ -35,6 +203,7 @@ class Dictionaryable(object):
     Subclasses of this class are guaranteed to be able to be converted to dictionary.
     All subclasses of this class must override to_dict.
     """
+    __slots__ = ()
 
     def to_dict(self):
         """
@@ -51,6 +220,7 @@ class JsonDeserializable(object):
     Subclasses of this class are guaranteed to be able to be created from a json-style dict or json formatted string.
     All subclasses of this class must override de_json.
     """
+    __slots__ = ()
 
     @classmethod
     def de_json(cls, json_string):
@@ -65,8 +235,9 @@ class JsonDeserializable(object):
     @staticmethod
     def check_json(json_type):
         """
-        Checks whether json_type is a dict or a string. If it is already a dict, it is returned as-is.
-        If it is not, it is converted to a dict by means of json.loads(json_type)
+        Checks whether json_type is a dict, a string or bytes. If it is already a dict, it is returned as-is.
+        If it is not, it is converted to a dict by means of json.loads(json_type). Bytes, bytearray and memoryview
+        (e.g. a webhook request body) are parsed directly where the json parser takes them, otherwise decoded as UTF-8.
         :param json_type:
         :return:
         """
@@ -74,40 +245,76 @@ class JsonDeserializable(object):
             return json_type
         elif util.is_string(json_type):
             return json.loads(json_type)
+        elif isinstance(json_type, (bytes, bytearray, memoryview)):
+            return _loads_bytes(json_type)
         else:
-            raise ValueError("json_type should be a json dict or string.")
+            raise ValueError("json_type should be a json dict, string or bytes.")
+
+    def to_dict(self):
+        """
+        Returns the json dict of this object, which de_json turns into an equal object.
+        Attributes that are None are left out.
+        """
+        json_dict = {}
+        for name, key in _json_fields(type(self)):
+            value = getattr(self, name, None)
+            if value is not None:
+                json_dict[key] = _to_json_value(value)
+        return json_dict
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
 
     def __str__(self):
         d = {}
-        for x, y in self.__dict__.items():
-            if hasattr(y, '__dict__'):
-                d[x] = y.__dict__
+        for x, y in util.object_attributes(self).items():
+            if isinstance(y, (JsonSerializable, Dictionaryable, JsonDeserializable)) or hasattr(y, '__dict__'):
+                d[x] = util.object_attributes(y)
             else:
                 d[x] = y
 
         return str(d)
 
 
+@_with_lazy_attributes
 class Update(JsonDeserializable):
+    _lazy_attributes = (
+        'message', 'edited_message', 'channel_post', 'edited_channel_post', 'inline_query', 'chosen_inline_result',
+        'callback_query', 'shipping_query', 'pre_checkout_query', 'poll', 'poll_answer'
+    )
+    __slots__ = ('update_id',) + tuple('_' + name for name in _lazy_attributes)
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
         obj = cls.check_json(json_string)
         update_id = obj['update_id']
-        message = Message.de_json(obj.get('message'))
-        edited_message = Message.de_json(obj.get('edited_message'))
-        channel_post = Message.de_json(obj.get('channel_post'))
-        edited_channel_post = Message.de_json(obj.get('edited_channel_post'))
-        inline_query = InlineQuery.de_json(obj.get('inline_query'))
-        chosen_inline_result = ChosenInlineResult.de_json(obj.get('chosen_inline_result'))
-        callback_query = CallbackQuery.de_json(obj.get('callback_query'))
-        shipping_query = ShippingQuery.de_json(obj.get('shipping_query'))
-        pre_checkout_query = PreCheckoutQuery.de_json(obj.get('pre_checkout_query'))
-        poll = Poll.de_json(obj.get('poll'))
-        poll_answer = PollAnswer.de_json(obj.get('poll_answer'))
+        message = _lazy(Message.de_json, obj.get('message'))
+        edited_message = _lazy(Message.de_json, obj.get('edited_message'))
+        channel_post = _lazy(Message.de_json, obj.get('channel_post'))
+        edited_channel_post = _lazy(Message.de_json, obj.get('edited_channel_post'))
+        inline_query = _lazy(InlineQuery.de_json, obj.get('inline_query'))
+        chosen_inline_result = _lazy(ChosenInlineResult.de_json, obj.get('chosen_inline_result'))
+        callback_query = _lazy(CallbackQuery.de_json, obj.get('callback_query'))
+        shipping_query = _lazy(ShippingQuery.de_json, obj.get('shipping_query'))
+        pre_checkout_query = _lazy(PreCheckoutQuery.de_json, obj.get('pre_checkout_query'))
+        poll = _lazy(Poll.de_json, obj.get('poll'))
+        poll_answer = _lazy(PollAnswer.de_json, obj.get('poll_answer'))
         return cls(update_id, message, edited_message, channel_post, edited_channel_post, inline_query,
                    chosen_inline_result, callback_query, shipping_query, pre_checkout_query, poll, poll_answer)
 
+    @classmethod
+    def de_json_many(cls, json_string):
+        """
+        Returns a list of updates from a list of update dicts, or from the json (string or bytes) of such a list or
+        of a whole getUpdates response
+        """
+        if not isinstance(json_string, list):
+            json_string = cls.check_json(json_string)
+            if isinstance(json_string, dict):
+                json_string = json_string['result']
+        return [cls.de_json(update) for update in json_string]
+
     def __init__(self, update_id, message, edited_message, channel_post, edited_channel_post, inline_query,
                  chosen_inline_result, callback_query, shipping_query, pre_checkout_query, poll, poll_answer):
         self.update_id = update_id
@@ -125,6 +332,11 @@ class Update(JsonDeserializable):
 
 
 class WebhookInfo(JsonDeserializable):
+    __slots__ = (
+        'url', 'has_custom_certificate', 'pending_update_count', 'ip_address', 'last_error_date', 'last_error_message',
+        'max_connections', 'allowed_updates'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -153,10 +365,21 @@ class WebhookInfo(JsonDeserializable):
 
 
 class User(JsonDeserializable, Dictionaryable, JsonSerializable):
+    __slots__ = (
+        'id', 'is_bot', 'first_name', 'username', 'last_name', 'language_code', 'can_join_groups',
+        'can_read_all_group_messages', 'supports_inline_queries'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
         obj = cls.check_json(json_string)
+        if _intern_table is not None:
+            return _intern(cls, obj, cls._from_dict)
+        return cls._from_dict(obj)
+
+    @classmethod
+    def _from_dict(cls, obj):
         id = obj['id']
         is_bot = obj['is_bot']
         first_name = obj['first_name']
@@ -202,6 +425,8 @@ class User(JsonDeserializable, Dictionaryable, JsonSerializable):
 
 
 class GroupChat(JsonDeserializable):
+    __slots__ = ('id', 'title')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -216,11 +441,23 @@ class GroupChat(JsonDeserializable):
 
 
 class Chat(JsonDeserializable):
+    __slots__ = (
+        'id', 'type', 'title', 'username', 'first_name', 'last_name', 'photo', 'bio', 'description', 'invite_link',
+        'pinned_message', 'permissions', 'slow_mode_delay', 'sticker_set_name', 'can_set_sticker_set',
+        'linked_chat_id', 'location'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if json_string is None:
             return None
         obj = cls.check_json(json_string)
+        if _intern_table is not None:
+            return _intern(cls, obj, cls._from_dict)
+        return cls._from_dict(obj)
+
+    @classmethod
+    def _from_dict(cls, obj):
         id = obj['id']
         type = obj['type']
         title = obj.get('title')
@@ -269,6 +506,8 @@ class Chat(JsonDeserializable):
 
 
 class MessageID(JsonDeserializable):
+    __slots__ = ('message_id',)
+
     @classmethod
     def de_json(cls, json_string):
         if(json_string is None):
@@ -281,140 +520,51 @@ class MessageID(JsonDeserializable):
         self.message_id = message_id
 
 
+@_with_lazy_attributes
 class Message(JsonDeserializable):
+    _not_json = ('content_type', 'id', 'json', 'new_chat_member')
+    _lazy_attributes = (
+        'from_user', 'chat', 'forward_from', 'forward_from_chat', 'reply_to_message', 'entities',
+        'caption_entities', 'audio', 'document', 'animation', 'game', 'photo', 'sticker', 'video', 'video_note',
+        'voice', 'contact', 'location', 'venue', 'dice', 'new_chat_members', 'left_chat_member', 'new_chat_photo',
+        'pinned_message', 'invoice', 'successful_payment', 'poll', 'reply_markup'
+    )
+    __slots__ = tuple('_' + name for name in _lazy_attributes) + (
+        'content_type', 'id', 'message_id', 'date', 'forward_from_message_id', 'forward_signature',
+        'forward_sender_name', 'forward_date', 'edit_date', 'media_group_id', 'author_signature', 'text', 'caption',
+        'new_chat_member', 'new_chat_title', 'delete_chat_photo', 'group_chat_created', 'supergroup_chat_created',
+        'channel_chat_created', 'migrate_to_chat_id', 'migrate_from_chat_id', 'connected_website', 'json',
+        'passport_data', '__dict__'
+    )
+
     @classmethod
     def de_json(cls, json_string):
+        return cls._de_json(json_string, True)
+
+    @classmethod
+    def _de_json(cls, json_string, retain_json):
         if (json_string is None): return None
+        if isinstance(json_string, (bytearray, memoryview)):
+            # Copy the caller's buffer once, message.json must not change when it is reused and must be picklable
+            json_string = bytes(json_string)
         obj = cls.check_json(json_string)
         message_id = obj['message_id']
-        from_user = User.de_json(obj.get('from'))
+        from_user = _lazy(User.de_json, obj.get('from'))
         date = obj['date']
-        chat = Chat.de_json(obj['chat'])
+        chat = _lazy(Chat.de_json, obj['chat'])
         content_type = None
+        priority = -1
         opts = {}
-        if 'forward_from' in obj:
-            opts['forward_from'] = User.de_json(obj['forward_from'])
-        if 'forward_from_chat' in obj:
-            opts['forward_from_chat'] = Chat.de_json(obj['forward_from_chat'])
-        if 'forward_from_message_id' in obj:
-            opts['forward_from_message_id'] = obj.get('forward_from_message_id')
-        if 'forward_signature' in obj:
-            opts['forward_signature'] = obj.get('forward_signature')
-        if 'forward_sender_name' in obj:
-            opts['forward_sender_name'] = obj.get('forward_sender_name')
-        if 'forward_date' in obj:
-            opts['forward_date'] = obj.get('forward_date')
-        if 'reply_to_message' in obj:
-            opts['reply_to_message'] = Message.de_json(obj['reply_to_message'])
-        if 'edit_date' in obj:
-            opts['edit_date'] = obj.get('edit_date')
-        if 'media_group_id' in obj:
-            opts['media_group_id'] = obj.get('media_group_id')
-        if 'author_signature' in obj:
-            opts['author_signature'] = obj.get('author_signature')
-        if 'text' in obj:
-            opts['text'] = obj['text']
-            content_type = 'text'
-        if 'entities' in obj:
-            opts['entities'] = Message.parse_entities(obj['entities'])
-        if 'caption_entities' in obj:
-            opts['caption_entities'] = Message.parse_entities(obj['caption_entities'])
-        if 'audio' in obj:
-            opts['audio'] = Audio.de_json(obj['audio'])
-            content_type = 'audio'
-        if 'document' in obj:
-            opts['document'] = Document.de_json(obj['document'])
-            content_type = 'document'
-        if 'animation' in obj:
-            # Document content type accompanies "animation", so "animation" should be checked below "document" to override it
-            opts['animation'] = Animation.de_json(obj['animation'])
-            content_type = 'animation'
-        if 'game' in obj:
-            opts['game'] = Game.de_json(obj['game'])
-            content_type = 'game'
-        if 'photo' in obj:
-            opts['photo'] = Message.parse_photo(obj['photo'])
-            content_type = 'photo'
-        if 'sticker' in obj:
-            opts['sticker'] = Sticker.de_json(obj['sticker'])
-            content_type = 'sticker'
-        if 'video' in obj:
-            opts['video'] = Video.de_json(obj['video'])
-            content_type = 'video'
-        if 'video_note' in obj:
-            opts['video_note'] = VideoNote.de_json(obj['video_note'])
-            content_type = 'video_note'
-        if 'voice' in obj:
-            opts['voice'] = Audio.de_json(obj['voice'])
-            content_type = 'voice'
-        if 'caption' in obj:
-            opts['caption'] = obj['caption']
-        if 'contact' in obj:
-            opts['contact'] = Contact.de_json(json.dumps(obj['contact']))
-            content_type = 'contact'
-        if 'location' in obj:
-            opts['location'] = Location.de_json(obj['location'])
-            content_type = 'location'
-        if 'venue' in obj:
-            opts['venue'] = Venue.de_json(obj['venue'])
-            content_type = 'venue'
-        if 'dice' in obj:
-            opts['dice'] = Dice.de_json(obj['dice'])
-            content_type = 'dice'
-        if 'new_chat_members' in obj:
-            new_chat_members = []
-            for member in obj['new_chat_members']:
-                new_chat_members.append(User.de_json(member))
-            opts['new_chat_members'] = new_chat_members
-            content_type = 'new_chat_members'
-        if 'left_chat_member' in obj:
-            opts['left_chat_member'] = User.de_json(obj['left_chat_member'])
-            content_type = 'left_chat_member'
-        if 'new_chat_title' in obj:
-            opts['new_chat_title'] = obj['new_chat_title']
-            content_type = 'new_chat_title'
-        if 'new_chat_photo' in obj:
-            opts['new_chat_photo'] = Message.parse_photo(obj['new_chat_photo'])
-            content_type = 'new_chat_photo'
-        if 'delete_chat_photo' in obj:
-            opts['delete_chat_photo'] = obj['delete_chat_photo']
-            content_type = 'delete_chat_photo'
-        if 'group_chat_created' in obj:
-            opts['group_chat_created'] = obj['group_chat_created']
-            content_type = 'group_chat_created'
-        if 'supergroup_chat_created' in obj:
-            opts['supergroup_chat_created'] = obj['supergroup_chat_created']
-            content_type = 'supergroup_chat_created'
-        if 'channel_chat_created' in obj:
-            opts['channel_chat_created'] = obj['channel_chat_created']
-            content_type = 'channel_chat_created'
-        if 'migrate_to_chat_id' in obj:
-            opts['migrate_to_chat_id'] = obj['migrate_to_chat_id']
-            content_type = 'migrate_to_chat_id'
-        if 'migrate_from_chat_id' in obj:
-            opts['migrate_from_chat_id'] = obj['migrate_from_chat_id']
-            content_type = 'migrate_from_chat_id'
-        if 'pinned_message' in obj:
-            opts['pinned_message'] = Message.de_json(obj['pinned_message'])
-            content_type = 'pinned_message'
-        if 'invoice' in obj:
-            opts['invoice'] = Invoice.de_json(obj['invoice'])
-            content_type = 'invoice'
-        if 'successful_payment' in obj:
-            opts['successful_payment'] = SuccessfulPayment.de_json(obj['successful_payment'])
-            content_type = 'successful_payment'
-        if 'connected_website' in obj:
-            opts['connected_website'] = obj['connected_website']
-            content_type = 'connected_website'
-        if 'poll' in obj:
-            opts['poll'] = Poll.de_json(obj['poll'])
-            content_type = 'poll'
-        if 'passport_data' in obj:
-            opts['passport_data'] = obj['passport_data']
-            content_type = 'passport_data'
-        if 'reply_markup' in obj:
-            opts['reply_markup'] = InlineKeyboardMarkup.de_json(obj['reply_markup'])
-        return cls(message_id, from_user, date, chat, content_type, opts, json_string)
+        for key, value in obj.items():
+            field = _message_fields.get(key)
+            if field is None:
+                continue
+            parse, field_content_type, field_priority = field
+            opts[key] = value if parse is None else _lazy(parse, value)
+            if field_priority > priority:
+                content_type, priority = field_content_type, field_priority
+        return cls(message_id, from_user, date, chat, content_type, opts,
+                   _retained_json(json_string) if retain_json else None)
 
     @classmethod
     def parse_chat(cls, chat):
@@ -437,6 +587,13 @@ class Message(JsonDeserializable):
             ret.append(MessageEntity.de_json(me))
         return ret
 
+    @classmethod
+    def parse_users(cls, user_array):
+        ret = []
+        for user in user_array:
+            ret.append(User.de_json(user))
+        return ret
+
     def __init__(self, message_id, from_user, date, chat, content_type, options, json_string):
         self.content_type = content_type
         self.id = message_id           # Lets fix the telegram usability ####up with ID in Message :)
@@ -507,57 +664,9 @@ class Message(JsonDeserializable):
             message.html_text
             >> "<strong class=\"example\">Test</strong> parse <i class=\"example\">formatting</i>, <a href=\"https://example.com\">url</a> and <a href=\"tg://user?id=123456\">text_mention</a> and mention <a href=\"https://t.me/username\">@username</a>"
         """
-
         if not entities:
             return text
-
-        _subs = {
-            "bold"     : "<b>{text}</b>",
-            "italic"   : "<i>{text}</i>",
-            "pre"      : "<pre>{text}</pre>",
-            "code"     : "<code>{text}</code>",
-            #"url"      : "<a href=\"{url}\">{text}</a>", # @badiboy plain URLs have no text and do not need tags
-            "text_link": "<a href=\"{url}\">{text}</a>",
-            "strikethrough": "<s>{text}</s>",
-            "underline":     "<u>{text}</u>"
- 	    }
-         
-        if hasattr(self, "custom_subs"):
-            for key, value in self.custom_subs.items():
-                _subs[key] = value
-        utf16_text = text.encode("utf-16-le")
-        html_text = ""
-
-        def func(upd_text, subst_type=None, url=None, user=None):
-            upd_text = upd_text.decode("utf-16-le")
-            if subst_type == "text_mention":
-                subst_type = "text_link"
-                url = "tg://user?id={0}".format(user.id)
-            elif subst_type == "mention":
-                url = "https://t.me/{0}".format(upd_text[1:])
-            upd_text = upd_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-            if not subst_type or not _subs.get(subst_type):
-                return upd_text
-            subs = _subs.get(subst_type)
-            return subs.format(text=upd_text, url=url)
-
-        offset = 0
-        for entity in entities:
-            if entity.offset > offset:
-                html_text += func(utf16_text[offset * 2 : entity.offset * 2])
-                offset = entity.offset
-                html_text += func(utf16_text[offset * 2 : (offset + entity.length) * 2], entity.type, entity.url, entity.user)
-                offset += entity.length
-            elif entity.offset == offset:
-                html_text += func(utf16_text[offset * 2 : (offset + entity.length) * 2], entity.type, entity.url, entity.user)
-                offset += entity.length
-            else:
-                # TODO: process nested entities from Bot API 4.5
-                # Now ignoring them
-                pass
-        if offset * 2 < len(utf16_text):
-            html_text += func(utf16_text[offset * 2:])
-        return html_text
+        return formatting.apply_entities(text, entities, 'HTML', getattr(self, 'custom_subs', None))
 
     @property
     def html_text(self):
@@ -567,8 +676,29 @@ class Message(JsonDeserializable):
     def html_caption(self):
         return self.__html_text(self.caption, self.caption_entities)
 
+    def __markdown_text(self, text, entities):
+        """
+        Text with its entities as MarkdownV2, nested entities included. Substitutes in message.custom_subs are
+        used like in html_text and must be MarkdownV2 then, e.g. {"bold": "*{text}*"}.
+        """
+        if text is None:
+            return None
+        if not entities:
+            return formatting.escape_markdown_v2(text)
+        return formatting.apply_entities(text, entities, 'MarkdownV2', getattr(self, 'custom_subs', None))
+
+    @property
+    def markdown_text(self):
+        return self.__markdown_text(self.text, self.entities)
+
+    @property
+    def markdown_caption(self):
+        return self.__markdown_text(self.caption, self.caption_entities)
+
 
 class MessageEntity(Dictionaryable, JsonSerializable, JsonDeserializable):
+    __slots__ = ('type', 'offset', 'length', 'url', 'user', 'language')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -597,11 +727,13 @@ class MessageEntity(Dictionaryable, JsonSerializable, JsonDeserializable):
                 "offset": self.offset,
                 "length": self.length,
                 "url": self.url,
-                "user": self.user,
+                "user": self.user.to_dict() if self.user else None,
                 "language":  self.language}
 
 
 class Dice(JsonSerializable, Dictionaryable, JsonDeserializable):
+    __slots__ = ('value', 'emoji')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -623,6 +755,8 @@ class Dice(JsonSerializable, Dictionaryable, JsonDeserializable):
 
 
 class PhotoSize(JsonDeserializable):
+    __slots__ = ('file_size', 'file_unique_id', 'height', 'width', 'file_id')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -643,6 +777,8 @@ class PhotoSize(JsonDeserializable):
 
 
 class Audio(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'duration', 'performer', 'title', 'mime_type', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -667,6 +803,8 @@ class Audio(JsonDeserializable):
 
 
 class Voice(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'duration', 'mime_type', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -687,6 +825,8 @@ class Voice(JsonDeserializable):
 
 
 class Document(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'thumb', 'file_name', 'mime_type', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -711,6 +851,8 @@ class Document(JsonDeserializable):
 
 
 class Video(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'width', 'height', 'duration', 'thumb', 'mime_type', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -738,6 +880,8 @@ class Video(JsonDeserializable):
 
 
 class VideoNote(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'length', 'duration', 'thumb', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -761,6 +905,8 @@ class VideoNote(JsonDeserializable):
 
 
 class Contact(JsonDeserializable):
+    __slots__ = ('phone_number', 'first_name', 'last_name', 'user_id', 'vcard')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -782,6 +928,8 @@ class Contact(JsonDeserializable):
 
 
 class Location(JsonDeserializable):
+    __slots__ = ('longitude', 'latitude')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -797,6 +945,8 @@ class Location(JsonDeserializable):
 
 
 class Venue(JsonDeserializable):
+    __slots__ = ('location', 'title', 'address', 'foursquare_id', 'foursquare_type')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -818,6 +968,8 @@ class Venue(JsonDeserializable):
 
 
 class UserProfilePhotos(JsonDeserializable):
+    __slots__ = ('total_count', 'photos')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -833,6 +985,8 @@ class UserProfilePhotos(JsonDeserializable):
 
 
 class File(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'file_size', 'file_path')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -852,6 +1006,8 @@ class File(JsonDeserializable):
 
 
 class ForceReply(JsonSerializable):
+    __slots__ = ('selective',)
+
     def __init__(self, selective=None):
         self.selective = selective
 
@@ -863,6 +1019,8 @@ class ForceReply(JsonSerializable):
 
 
 class ReplyKeyboardRemove(JsonSerializable):
+    __slots__ = ('selective',)
+
     def __init__(self, selective=None):
         self.selective = selective
 
@@ -873,7 +1031,58 @@ class ReplyKeyboardRemove(JsonSerializable):
         return json.dumps(json_dict)
 
 
-class ReplyKeyboardMarkup(JsonSerializable):
+def _copy_json(value):
+    if isinstance(value, dict):
+        return dict((key, _copy_json(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+class _Freezable(object):
+    """
+    Markup that can cache its json: after freeze() to_json returns the cached string until the markup is changed
+    through its attributes, add or row. Buttons of a frozen markup must not be modified.
+    Subclasses need a '_json_cache' slot and must return _json_cache from to_json if it is not None. Subclasses
+    with to_dict also list '_dict_cache' in _caches and return a copy of it from to_dict if it is not None, so
+    markup nested in other objects (e.g. inline results) is not rebuilt either.
+    """
+    __slots__ = ()
+    _caches = ('_json_cache',)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in self._caches:
+            for cache in self._caches:
+                object.__setattr__(self, cache, None)
+
+    def freeze(self):
+        """
+        Serializes the markup once and reuses the json for every send. The keyboard rows become tuples,
+        so they can't be changed in place.
+        :return: self, to allow function chaining.
+        """
+        self.keyboard = tuple(tuple(row) for row in self.keyboard)
+        if '_dict_cache' in self._caches:
+            object.__setattr__(self, '_dict_cache', self.to_dict())
+        object.__setattr__(self, '_json_cache', self.to_json())
+        return self
+
+    @property
+    def frozen(self):
+        return self._json_cache is not None
+
+    def _thaw(self):
+        if isinstance(self.keyboard, tuple):
+            self.keyboard = [list(row) for row in self.keyboard]
+        else:
+            for cache in self._caches:
+                object.__setattr__(self, cache, None)
+
+
+class ReplyKeyboardMarkup(_Freezable, JsonSerializable):
+    __slots__ = ('resize_keyboard', 'one_time_keyboard', 'selective', 'row_width', 'keyboard', '_json_cache')
+
     max_row_keys = 12
 
     def __init__(self, resize_keyboard=None, one_time_keyboard=None, selective=None, row_width=3):
@@ -910,6 +1119,7 @@ class ReplyKeyboardMarkup(JsonSerializable):
                 logger.error('Telegram does not support reply keyboard row width over %d.' % self.max_row_keys)
             row_width = self.max_row_keys
         
+        self._thaw()
         for row in util.chunks(args, row_width):
             button_array = []
             for button in row:
@@ -923,6 +1133,21 @@ class ReplyKeyboardMarkup(JsonSerializable):
 
         return self
 
+    @classmethod
+    def build(cls, rows, resize_keyboard=None, one_time_keyboard=None, selective=None):
+        """
+        Builds a frozen keyboard, e.g. for static menus declared at import time:
+
+            MAIN_MENU = types.ReplyKeyboardMarkup.build([['Search', 'Settings'], ['Help']], resize_keyboard=True)
+
+        :param rows: list of rows, a row is a list of strings or KeyboardButton
+        :return: frozen ReplyKeyboardMarkup
+        """
+        markup = cls(resize_keyboard, one_time_keyboard, selective)
+        for row in rows:
+            markup.row(*row)
+        return markup.freeze()
+
     def row(self, *args):
         """
         Adds a list of KeyboardButton to the keyboard. This function does not consider row_width.
@@ -940,6 +1165,8 @@ class ReplyKeyboardMarkup(JsonSerializable):
         https://core.telegram.org/bots/api#replykeyboardmarkup
         :return:
         """
+        if self._json_cache is not None:
+            return self._json_cache
         json_dict = {'keyboard': self.keyboard}
         if self.one_time_keyboard:
             json_dict['one_time_keyboard'] = True
@@ -951,6 +1178,8 @@ class ReplyKeyboardMarkup(JsonSerializable):
 
 
 class KeyboardButton(Dictionaryable, JsonSerializable):
+    __slots__ = ('text', 'request_contact', 'request_location', 'request_poll')
+
     def __init__(self, text, request_contact=None, request_location=None, request_poll=None):
         self.text = text
         self.request_contact = request_contact
@@ -972,6 +1201,8 @@ class KeyboardButton(Dictionaryable, JsonSerializable):
 
 
 class KeyboardButtonPollType(Dictionaryable):
+    __slots__ = ('type',)
+
     def __init__(self, type=''):
         self.type = type
 
@@ -979,7 +1210,10 @@ class KeyboardButtonPollType(Dictionaryable):
         return {'type': self.type}
 
 
-class InlineKeyboardMarkup(Dictionaryable, JsonSerializable, JsonDeserializable):
+class InlineKeyboardMarkup(_Freezable, Dictionaryable, JsonSerializable, JsonDeserializable):
+    __slots__ = ('row_width', 'keyboard', '_json_cache', '_dict_cache')
+    _caches = ('_json_cache', '_dict_cache')
+
     max_row_keys = 8
     
     @classmethod
@@ -1028,12 +1262,36 @@ class InlineKeyboardMarkup(Dictionaryable, JsonSerializable, JsonDeserializable)
             logger.error('Telegram does not support inline keyboard row width over %d.' % self.max_row_keys)
             row_width = self.max_row_keys
         
+        self._thaw()
         for row in util.chunks(args, row_width):
             button_array = [button for button in row]
             self.keyboard.append(button_array)
         
         return self
         
+    @classmethod
+    def build(cls, rows):
+        """
+        Builds a frozen keyboard, e.g. for static menus declared at import time:
+
+            PAGER = types.InlineKeyboardMarkup.build([[('<', 'page:prev'), ('>', 'page:next')]])
+
+        :param rows: list of rows, a row is a list of InlineKeyboardButton, dicts of InlineKeyboardButton
+            arguments or (text, callback_data) tuples
+        :return: frozen InlineKeyboardMarkup
+        """
+        markup = cls()
+        for row in rows:
+            buttons = []
+            for button in row:
+                if isinstance(button, dict):
+                    button = InlineKeyboardButton(**button)
+                elif isinstance(button, tuple):
+                    button = InlineKeyboardButton(button[0], callback_data=button[1])
+                buttons.append(button)
+            markup.row(*buttons)
+        return markup.freeze()
+
     def row(self, *args):
         """
         Adds a list of InlineKeyboardButton to the keyboard.
@@ -1056,15 +1314,21 @@ class InlineKeyboardMarkup(Dictionaryable, JsonSerializable, JsonDeserializable)
         https://core.telegram.org/bots/api#inlinekeyboardmarkup
         :return:
         """
+        if self._json_cache is not None:
+            return self._json_cache
         return json.dumps(self.to_dict())
 
     def to_dict(self):
+        if self._dict_cache is not None:
+            return _copy_json(self._dict_cache)
         json_dict = dict()
         json_dict['inline_keyboard'] = [[button.to_dict() for button in row] for row in self.keyboard]
         return json_dict
 
 
 class LoginUrl(Dictionaryable, JsonSerializable, JsonDeserializable):
+    __slots__ = ('url', 'forward_text', 'bot_username', 'request_write_access')
+
     def __init__(self, url, forward_text=None, bot_username=None, request_write_access=None):
         self.url = url
         self.forward_text = forward_text
@@ -1097,6 +1361,11 @@ class LoginUrl(Dictionaryable, JsonSerializable, JsonDeserializable):
 
 
 class InlineKeyboardButton(Dictionaryable, JsonSerializable, JsonDeserializable):
+    __slots__ = (
+        'text', 'url', 'callback_data', 'switch_inline_query', 'switch_inline_query_current_chat', 'callback_game',
+        'pay', 'login_url'
+    )
+
     def __init__(self, text, url=None, callback_data=None, switch_inline_query=None,
                  switch_inline_query_current_chat=None, callback_game=None, pay=None, login_url=None):
         self.text = text
@@ -1146,6 +1415,8 @@ class InlineKeyboardButton(Dictionaryable, JsonSerializable, JsonDeserializable)
 
 
 class CallbackQuery(JsonDeserializable):
+    __slots__ = ('game_short_name', 'chat_instance', 'id', 'from_user', 'message', 'data', 'inline_message_id')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -1170,6 +1441,8 @@ class CallbackQuery(JsonDeserializable):
 
 
 class ChatPhoto(JsonDeserializable):
+    __slots__ = ('small_file_id', 'small_file_unique_id', 'big_file_id', 'big_file_unique_id')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -1189,6 +1462,13 @@ class ChatPhoto(JsonDeserializable):
 
 
 class ChatMember(JsonDeserializable):
+    __slots__ = (
+        'user', 'status', 'custom_title', 'can_be_edited', 'can_post_messages', 'can_edit_messages',
+        'can_delete_messages', 'can_restrict_members', 'can_promote_members', 'can_change_info', 'can_invite_users',
+        'can_pin_messages', 'is_member', 'can_send_messages', 'can_send_media_messages', 'can_send_polls',
+        'can_send_other_messages', 'can_add_web_page_previews', 'until_date'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if json_string is None:
@@ -1248,6 +1528,11 @@ class ChatMember(JsonDeserializable):
 
 
 class ChatPermissions(JsonDeserializable, JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'can_send_messages', 'can_send_media_messages', 'can_send_polls', 'can_send_other_messages',
+        'can_add_web_page_previews', 'can_change_info', 'can_invite_users', 'can_pin_messages'
+    )
+
     def __init__(self, can_send_messages=None, can_send_media_messages=None,
                  can_send_polls=None, can_send_other_messages=None,
                  can_add_web_page_previews=None, can_change_info=None,
@@ -1303,7 +1588,9 @@ class ChatPermissions(JsonDeserializable, JsonSerializable, Dictionaryable):
         return json_dict
 
 
-class BotCommand(JsonSerializable):
+class BotCommand(JsonSerializable, Dictionaryable):
+    __slots__ = ('command', 'description')
+
     def __init__(self, command, description):
         """
         This object represents a bot command.
@@ -1325,6 +1612,8 @@ class BotCommand(JsonSerializable):
 # InlineQuery
 
 class InlineQuery(JsonDeserializable):
+    __slots__ = ('id', 'from_user', 'location', 'query', 'offset')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -1357,6 +1646,8 @@ class InlineQuery(JsonDeserializable):
 
 
 class InputTextMessageContent(Dictionaryable):
+    __slots__ = ('message_text', 'parse_mode', 'disable_web_page_preview')
+
     def __init__(self, message_text, parse_mode=None, disable_web_page_preview=None):
         self.message_text = message_text
         self.parse_mode = parse_mode
@@ -1372,6 +1663,8 @@ class InputTextMessageContent(Dictionaryable):
 
 
 class InputLocationMessageContent(Dictionaryable):
+    __slots__ = ('latitude', 'longitude', 'live_period')
+
     def __init__(self, latitude, longitude, live_period=None):
         self.latitude = latitude
         self.longitude = longitude
@@ -1385,6 +1678,8 @@ class InputLocationMessageContent(Dictionaryable):
 
 
 class InputVenueMessageContent(Dictionaryable):
+    __slots__ = ('latitude', 'longitude', 'title', 'address', 'foursquare_id', 'foursquare_type')
+
     def __init__(self, latitude, longitude, title, address, foursquare_id=None, foursquare_type=None):
         self.latitude = latitude
         self.longitude = longitude
@@ -1408,6 +1703,8 @@ class InputVenueMessageContent(Dictionaryable):
 
 
 class InputContactMessageContent(Dictionaryable):
+    __slots__ = ('phone_number', 'first_name', 'last_name', 'vcard')
+
     def __init__(self, phone_number, first_name, last_name=None, vcard=None):
         self.phone_number = phone_number
         self.first_name = first_name
@@ -1415,7 +1712,7 @@ class InputContactMessageContent(Dictionaryable):
         self.vcard = vcard
 
     def to_dict(self):
-        json_dict = {'phone_numbe': self.phone_number, 'first_name': self.first_name}
+        json_dict = {'phone_number': self.phone_number, 'first_name': self.first_name}
         if self.last_name:
             json_dict['last_name'] = self.last_name
         if self.vcard:
@@ -1424,6 +1721,8 @@ class InputContactMessageContent(Dictionaryable):
 
 
 class ChosenInlineResult(JsonDeserializable):
+    __slots__ = ('result_id', 'from_user', 'query', 'location', 'inline_message_id')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None):
@@ -1452,7 +1751,12 @@ class ChosenInlineResult(JsonDeserializable):
         self.inline_message_id = inline_message_id
 
 
-class InlineQueryResultArticle(JsonSerializable):
+class InlineQueryResultArticle(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'title', 'input_message_content', 'reply_markup', 'url', 'hide_url', 'description', 'thumb_url',
+        'thumb_width', 'thumb_height'
+    )
+
     def __init__(self, id, title, input_message_content, reply_markup=None, url=None,
                  hide_url=None, description=None, thumb_url=None, thumb_width=None, thumb_height=None):
         """
@@ -1482,6 +1786,9 @@ class InlineQueryResultArticle(JsonSerializable):
         self.thumb_height = thumb_height
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {
             'type': self.type,
             'id': self.id,
@@ -1501,10 +1808,15 @@ class InlineQueryResultArticle(JsonSerializable):
             json_dict['thumb_width'] = self.thumb_width
         if self.thumb_height:
             json_dict['thumb_height'] = self.thumb_height
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultPhoto(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'photo_url', 'photo_width', 'photo_height', 'thumb_url', 'title', 'description', 'caption',
+        'parse_mode', 'reply_markup', 'input_message_content'
+    )
 
-class InlineQueryResultPhoto(JsonSerializable):
     def __init__(self, id, photo_url, thumb_url, photo_width=None, photo_height=None, title=None,
                  description=None, caption=None, parse_mode=None, reply_markup=None, input_message_content=None):
         """
@@ -1537,6 +1849,9 @@ class InlineQueryResultPhoto(JsonSerializable):
         self.input_message_content = input_message_content
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'photo_url': self.photo_url, 'thumb_url': self.thumb_url}
         if self.photo_width:
             json_dict['photo_width'] = self.photo_width
@@ -1554,10 +1869,15 @@ class InlineQueryResultPhoto(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultGif(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'gif_url', 'gif_width', 'gif_height', 'thumb_url', 'title', 'caption', 'reply_markup',
+        'input_message_content', 'gif_duration'
+    )
 
-class InlineQueryResultGif(JsonSerializable):
     def __init__(self, id, gif_url, thumb_url, gif_width=None, gif_height=None, title=None, caption=None,
                  reply_markup=None, input_message_content=None, gif_duration=None):
         """
@@ -1586,6 +1906,9 @@ class InlineQueryResultGif(JsonSerializable):
         self.gif_duration = gif_duration
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'gif_url': self.gif_url, 'thumb_url': self.thumb_url}
         if self.gif_height:
             json_dict['gif_height'] = self.gif_height
@@ -1601,10 +1924,15 @@ class InlineQueryResultGif(JsonSerializable):
             json_dict['input_message_content'] = self.input_message_content.to_dict()
         if self.gif_duration:
             json_dict['gif_duration'] = self.gif_duration
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultMpeg4Gif(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'mpeg4_url', 'mpeg4_width', 'mpeg4_height', 'thumb_url', 'title', 'caption', 'parse_mode',
+        'reply_markup', 'input_message_content', 'mpeg4_duration'
+    )
 
-class InlineQueryResultMpeg4Gif(JsonSerializable):
     def __init__(self, id, mpeg4_url, thumb_url, mpeg4_width=None, mpeg4_height=None, title=None, caption=None,
                  parse_mode=None, reply_markup=None, input_message_content=None, mpeg4_duration=None):
         """
@@ -1636,6 +1964,9 @@ class InlineQueryResultMpeg4Gif(JsonSerializable):
         self.mpeg4_duration = mpeg4_duration
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'mpeg4_url': self.mpeg4_url, 'thumb_url': self.thumb_url}
         if self.mpeg4_width:
             json_dict['mpeg4_width'] = self.mpeg4_width
@@ -1652,11 +1983,16 @@ class InlineQueryResultMpeg4Gif(JsonSerializable):
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
         if self.mpeg4_duration:
-            json_dict['mpeg4_duration '] = self.mpeg4_duration
-        return json.dumps(json_dict)
+            json_dict['mpeg4_duration'] = self.mpeg4_duration
+        return json_dict
+
 
+class InlineQueryResultVideo(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'video_url', 'mime_type', 'video_width', 'video_height', 'video_duration', 'thumb_url', 'title',
+        'caption', 'parse_mode', 'description', 'input_message_content', 'reply_markup'
+    )
 
-class InlineQueryResultVideo(JsonSerializable):
     def __init__(self, id, video_url, mime_type, thumb_url, title,
                  caption=None, parse_mode=None, video_width=None, video_height=None, video_duration=None,
                  description=None, reply_markup=None, input_message_content=None):
@@ -1691,6 +2027,9 @@ class InlineQueryResultVideo(JsonSerializable):
         self.reply_markup = reply_markup
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'video_url': self.video_url, 'mime_type': self.mime_type,
                      'thumb_url': self.thumb_url, 'title': self.title}
         if self.video_width:
@@ -1709,10 +2048,15 @@ class InlineQueryResultVideo(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultAudio(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'audio_url', 'title', 'caption', 'parse_mode', 'performer', 'audio_duration', 'reply_markup',
+        'input_message_content'
+    )
 
-class InlineQueryResultAudio(JsonSerializable):
     def __init__(self, id, audio_url, title, caption=None, parse_mode=None, performer=None, audio_duration=None,
                  reply_markup=None, input_message_content=None):
         self.type = 'audio'
@@ -1727,6 +2071,9 @@ class InlineQueryResultAudio(JsonSerializable):
         self.input_message_content = input_message_content
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'audio_url': self.audio_url, 'title': self.title}
         if self.caption:
             json_dict['caption'] = self.caption
@@ -1740,10 +2087,15 @@ class InlineQueryResultAudio(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultVoice(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'voice_url', 'title', 'caption', 'parse_mode', 'performer', 'voice_duration', 'reply_markup',
+        'input_message_content'
+    )
 
-class InlineQueryResultVoice(JsonSerializable):
     def __init__(self, id, voice_url, title, caption=None, parse_mode=None, performer=None, voice_duration=None,
                  reply_markup=None, input_message_content=None):
         self.type = 'voice'
@@ -1758,6 +2110,9 @@ class InlineQueryResultVoice(JsonSerializable):
         self.input_message_content = input_message_content
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'voice_url': self.voice_url, 'title': self.title}
         if self.caption:
             json_dict['caption'] = self.caption
@@ -1771,10 +2126,15 @@ class InlineQueryResultVoice(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultDocument(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'title', 'document_url', 'mime_type', 'caption', 'parse_mode', 'description', 'reply_markup',
+        'input_message_content', 'thumb_url', 'thumb_width', 'thumb_height'
+    )
 
-class InlineQueryResultDocument(JsonSerializable):
     def __init__(self, id, title, document_url, mime_type, caption=None, parse_mode=None, description=None,
                  reply_markup=None, input_message_content=None, thumb_url=None, thumb_width=None, thumb_height=None):
         self.type = 'document'
@@ -1792,6 +2152,9 @@ class InlineQueryResultDocument(JsonSerializable):
         self.thumb_height = thumb_height
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'title': self.title, 'document_url': self.document_url,
                      'mime_type': self.mime_type}
         if self.caption:
@@ -1810,10 +2173,15 @@ class InlineQueryResultDocument(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultLocation(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'title', 'latitude', 'longitude', 'live_period', 'reply_markup', 'input_message_content',
+        'thumb_url', 'thumb_width', 'thumb_height'
+    )
 
-class InlineQueryResultLocation(JsonSerializable):
     def __init__(self, id, title, latitude, longitude, live_period=None, reply_markup=None,
                  input_message_content=None, thumb_url=None, thumb_width=None, thumb_height=None):
         self.type = 'location'
@@ -1829,6 +2197,9 @@ class InlineQueryResultLocation(JsonSerializable):
         self.thumb_height = thumb_height
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'latitude': self.latitude, 'longitude': self.longitude,
                      'title': self.title}
         if self.live_period:
@@ -1843,10 +2214,15 @@ class InlineQueryResultLocation(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultVenue(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'title', 'latitude', 'longitude', 'address', 'foursquare_id', 'foursquare_type', 'reply_markup',
+        'input_message_content', 'thumb_url', 'thumb_width', 'thumb_height'
+    )
 
-class InlineQueryResultVenue(JsonSerializable):
     def __init__(self, id, title, latitude, longitude, address, foursquare_id=None, foursquare_type=None,
                  reply_markup=None, input_message_content=None, thumb_url=None, thumb_width=None, thumb_height=None):
         self.type = 'venue'
@@ -1864,6 +2240,9 @@ class InlineQueryResultVenue(JsonSerializable):
         self.thumb_height = thumb_height
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'title': self.title, 'latitude': self.latitude,
                      'longitude': self.longitude, 'address': self.address}
         if self.foursquare_id:
@@ -1880,10 +2259,15 @@ class InlineQueryResultVenue(JsonSerializable):
             json_dict['reply_markup'] = self.reply_markup.to_dict()
         if self.input_message_content:
             json_dict['input_message_content'] = self.input_message_content.to_dict()
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class InlineQueryResultContact(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'phone_number', 'first_name', 'last_name', 'vcard', 'reply_markup', 'input_message_content',
+        'thumb_url', 'thumb_width', 'thumb_height'
+    )
 
-class InlineQueryResultContact(JsonSerializable):
     def __init__(self, id, phone_number, first_name, last_name=None, vcard=None,
                  reply_markup=None, input_message_content=None,
                  thumb_url=None, thumb_width=None, thumb_height=None):
@@ -1900,6 +2284,9 @@ class InlineQueryResultContact(JsonSerializable):
         self.thumb_height = thumb_height
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dict = {'type': self.type, 'id': self.id, 'phone_number': self.phone_number, 'first_name': self.first_name}
         if self.last_name:
             json_dict['last_name'] = self.last_name
@@ -1915,10 +2302,15 @@ class InlineQueryResultContact(JsonSerializable):
             json_dict['thumb_width'] = self.thumb_width
         if self.thumb_height:
             json_dict['thumb_height'] = self.thumb_height
-        return json.dumps(json_dict)
+        return json_dict
+
 
+class BaseInlineQueryResultCached(JsonSerializable, Dictionaryable):
+    __slots__ = (
+        'type', 'id', 'title', 'description', 'caption', 'reply_markup', 'input_message_content', 'parse_mode',
+        'payload_dic'
+    )
 
-class BaseInlineQueryResultCached(JsonSerializable):
     def __init__(self):
         self.type = None
         self.id = None
@@ -1931,7 +2323,10 @@ class BaseInlineQueryResultCached(JsonSerializable):
         self.payload_dic = {}
 
     def to_json(self):
-        json_dict = self.payload_dic
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        json_dict = dict(self.payload_dic)
         json_dict['type'] = self.type
         json_dict['id'] = self.id
         if self.title:
@@ -1946,10 +2341,12 @@ class BaseInlineQueryResultCached(JsonSerializable):
             json_dict['input_message_content'] = self.input_message_content.to_dict()
         if self.parse_mode:
             json_dict['parse_mode'] = self.parse_mode
-        return json.dumps(json_dict)
+        return json_dict
 
 
 class InlineQueryResultCachedPhoto(BaseInlineQueryResultCached):
+    __slots__ = ('photo_file_id',)
+
     def __init__(self, id, photo_file_id, title=None, description=None, caption=None, parse_mode=None,
                  reply_markup=None, input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -1966,6 +2363,8 @@ class InlineQueryResultCachedPhoto(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedGif(BaseInlineQueryResultCached):
+    __slots__ = ('gif_file_id',)
+
     def __init__(self, id, gif_file_id, title=None, description=None, caption=None, parse_mode=None, reply_markup=None,
                  input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -1982,6 +2381,8 @@ class InlineQueryResultCachedGif(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedMpeg4Gif(BaseInlineQueryResultCached):
+    __slots__ = ('mpeg4_file_id',)
+
     def __init__(self, id, mpeg4_file_id, title=None, description=None, caption=None, parse_mode=None,
                  reply_markup=None, input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -1998,6 +2399,8 @@ class InlineQueryResultCachedMpeg4Gif(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedSticker(BaseInlineQueryResultCached):
+    __slots__ = ('sticker_file_id',)
+
     def __init__(self, id, sticker_file_id, reply_markup=None, input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
         self.type = 'sticker'
@@ -2009,6 +2412,8 @@ class InlineQueryResultCachedSticker(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedDocument(BaseInlineQueryResultCached):
+    __slots__ = ('document_file_id',)
+
     def __init__(self, id, document_file_id, title, description=None, caption=None, parse_mode=None, reply_markup=None,
                  input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -2025,6 +2430,8 @@ class InlineQueryResultCachedDocument(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedVideo(BaseInlineQueryResultCached):
+    __slots__ = ('video_file_id',)
+
     def __init__(self, id, video_file_id, title, description=None, caption=None, parse_mode=None, reply_markup=None,
                  input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -2041,6 +2448,8 @@ class InlineQueryResultCachedVideo(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedVoice(BaseInlineQueryResultCached):
+    __slots__ = ('voice_file_id',)
+
     def __init__(self, id, voice_file_id, title, caption=None, parse_mode=None, reply_markup=None,
                  input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
@@ -2056,6 +2465,8 @@ class InlineQueryResultCachedVoice(BaseInlineQueryResultCached):
 
 
 class InlineQueryResultCachedAudio(BaseInlineQueryResultCached):
+    __slots__ = ('audio_file_id',)
+
     def __init__(self, id, audio_file_id, caption=None, parse_mode=None, reply_markup=None, input_message_content=None):
         BaseInlineQueryResultCached.__init__(self)
         self.type = 'audio'
@@ -2070,7 +2481,9 @@ class InlineQueryResultCachedAudio(BaseInlineQueryResultCached):
 
 # Games
 
-class InlineQueryResultGame(JsonSerializable):
+class InlineQueryResultGame(JsonSerializable, Dictionaryable):
+    __slots__ = ('type', 'id', 'game_short_name', 'reply_markup')
+
     def __init__(self, id, game_short_name, reply_markup=None):
         self.type = 'game'
         self.id = id
@@ -2078,13 +2491,18 @@ class InlineQueryResultGame(JsonSerializable):
         self.reply_markup = reply_markup
 
     def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
         json_dic = {'type': self.type, 'id': self.id, 'game_short_name': self.game_short_name}
         if self.reply_markup:
             json_dic['reply_markup'] = self.reply_markup.to_dict()
-        return json.dumps(json_dic)
+        return json_dic
 
 
 class Game(JsonDeserializable):
+    __slots__ = ('title', 'description', 'photo', 'text', 'text_entities', 'animation')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2124,6 +2542,8 @@ class Game(JsonDeserializable):
 
 
 class Animation(JsonDeserializable):
+    __slots__ = ('file_id', 'file_unique_id', 'thumb', 'file_name', 'mime_type', 'file_size')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2146,6 +2566,8 @@ class Animation(JsonDeserializable):
 
 
 class GameHighScore(JsonDeserializable):
+    __slots__ = ('position', 'user', 'score')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2163,18 +2585,23 @@ class GameHighScore(JsonDeserializable):
 
 # Payments
 
-class LabeledPrice(JsonSerializable):
+class LabeledPrice(JsonSerializable, Dictionaryable):
+    __slots__ = ('label', 'amount')
+
     def __init__(self, label, amount):
         self.label = label
         self.amount = amount
 
     def to_json(self):
-        return json.dumps({
-            'label': self.label, 'amount': self.amount
-        })
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        return {'label': self.label, 'amount': self.amount}
 
 
 class Invoice(JsonDeserializable):
+    __slots__ = ('title', 'description', 'start_parameter', 'currency', 'total_amount')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2195,6 +2622,8 @@ class Invoice(JsonDeserializable):
 
 
 class ShippingAddress(JsonDeserializable):
+    __slots__ = ('country_code', 'state', 'city', 'street_line1', 'street_line2', 'post_code')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2217,6 +2646,8 @@ class ShippingAddress(JsonDeserializable):
 
 
 class OrderInfo(JsonDeserializable):
+    __slots__ = ('name', 'phone_number', 'email', 'shipping_address')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2234,7 +2665,9 @@ class OrderInfo(JsonDeserializable):
         self.shipping_address = shipping_address
 
 
-class ShippingOption(JsonSerializable):
+class ShippingOption(JsonSerializable, Dictionaryable):
+    __slots__ = ('id', 'title', 'prices')
+
     def __init__(self, id, title):
         self.id = id
         self.title = title
@@ -2250,14 +2683,18 @@ class ShippingOption(JsonSerializable):
         return self
 
     def to_json(self):
-        price_list = []
-        for p in self.prices:
-            price_list.append(p.to_dict())
-        json_dict = json.dumps({'id': self.id, 'title': self.title, 'prices': price_list})
-        return json_dict
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        return {'id': self.id, 'title': self.title, 'prices': [p.to_dict() for p in self.prices]}
 
 
 class SuccessfulPayment(JsonDeserializable):
+    __slots__ = (
+        'currency', 'total_amount', 'invoice_payload', 'shipping_option_id', 'order_info',
+        'telegram_payment_charge_id', 'provider_payment_charge_id'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2284,6 +2721,8 @@ class SuccessfulPayment(JsonDeserializable):
 
 
 class ShippingQuery(JsonDeserializable):
+    __slots__ = ('id', 'from_user', 'invoice_payload', 'shipping_address')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2302,6 +2741,8 @@ class ShippingQuery(JsonDeserializable):
 
 
 class PreCheckoutQuery(JsonDeserializable):
+    __slots__ = ('id', 'from_user', 'currency', 'total_amount', 'invoice_payload', 'shipping_option_id', 'order_info')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2328,6 +2769,8 @@ class PreCheckoutQuery(JsonDeserializable):
 # Stickers
 
 class StickerSet(JsonDeserializable):
+    __slots__ = ('stickers', 'is_animated', 'contains_masks', 'title', 'name')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2350,6 +2793,11 @@ class StickerSet(JsonDeserializable):
 
 
 class Sticker(JsonDeserializable):
+    __slots__ = (
+        'file_id', 'file_unique_id', 'width', 'height', 'thumb', 'emoji', 'set_name', 'mask_position', 'file_size',
+        'is_animated'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2380,6 +2828,8 @@ class Sticker(JsonDeserializable):
 
 
 class MaskPosition(Dictionaryable, JsonDeserializable, JsonSerializable):
+    __slots__ = ('point', 'x_shift', 'y_shift', 'scale')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2406,6 +2856,8 @@ class MaskPosition(Dictionaryable, JsonDeserializable, JsonSerializable):
 # InputMedia
 
 class InputMedia(Dictionaryable, JsonSerializable):
+    __slots__ = ('type', 'media', 'caption', 'parse_mode', '_media_name', '_media_dic')
+
     def __init__(self, type, media, caption=None, parse_mode=None):
         self.type = type
         self.media = media
@@ -2438,6 +2890,8 @@ class InputMedia(Dictionaryable, JsonSerializable):
 
 
 class InputMediaPhoto(InputMedia):
+    __slots__ = ()
+
     def __init__(self, media, caption=None, parse_mode=None):
         if util.is_pil_image(media):
             media = util.pil_image_to_file(media)
@@ -2449,6 +2903,8 @@ class InputMediaPhoto(InputMedia):
 
 
 class InputMediaVideo(InputMedia):
+    __slots__ = ('thumb', 'width', 'height', 'duration', 'supports_streaming')
+
     def __init__(self, media, thumb=None, caption=None, parse_mode=None, width=None, height=None, duration=None,
                  supports_streaming=None):
         super(InputMediaVideo, self).__init__(type="video", media=media, caption=caption, parse_mode=parse_mode)
@@ -2474,6 +2930,8 @@ class InputMediaVideo(InputMedia):
 
 
 class InputMediaAnimation(InputMedia):
+    __slots__ = ('thumb', 'width', 'height', 'duration')
+
     def __init__(self, media, thumb=None, caption=None, parse_mode=None, width=None, height=None, duration=None):
         super(InputMediaAnimation, self).__init__(type="animation", media=media, caption=caption, parse_mode=parse_mode)
         self.thumb = thumb
@@ -2495,6 +2953,8 @@ class InputMediaAnimation(InputMedia):
 
 
 class InputMediaAudio(InputMedia):
+    __slots__ = ('thumb', 'duration', 'performer', 'title')
+
     def __init__(self, media, thumb=None, caption=None, parse_mode=None, duration=None, performer=None, title=None):
         super(InputMediaAudio, self).__init__(type="audio", media=media, caption=caption, parse_mode=parse_mode)
         self.thumb = thumb
@@ -2516,6 +2976,8 @@ class InputMediaAudio(InputMedia):
 
 
 class InputMediaDocument(InputMedia):
+    __slots__ = ('thumb',)
+
     def __init__(self, media, thumb=None, caption=None, parse_mode=None):
         super(InputMediaDocument, self).__init__(type="document", media=media, caption=caption, parse_mode=parse_mode)
         self.thumb = thumb
@@ -2528,6 +2990,8 @@ class InputMediaDocument(InputMedia):
 
 
 class PollOption(JsonSerializable, JsonDeserializable):
+    __slots__ = ('text', 'voter_count')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2546,6 +3010,12 @@ class PollOption(JsonSerializable, JsonDeserializable):
 
 
 class Poll(JsonDeserializable):
+    __slots__ = (
+        'id', 'question', 'options', 'total_voter_count', 'is_closed', 'is_anonymous', 'type',
+        'allows_multiple_answers', 'correct_option_id', 'explanation', 'explanation_entities', 'open_period',
+        'close_date'
+    )
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2602,6 +3072,8 @@ class Poll(JsonDeserializable):
 
 
 class PollAnswer(JsonSerializable, JsonDeserializable, Dictionaryable):
+    __slots__ = ('poll_id', 'user', 'options_ids')
+
     @classmethod
     def de_json(cls, json_string):
         if (json_string is None): return None
@@ -2622,4 +3094,60 @@ class PollAnswer(JsonSerializable, JsonDeserializable, Dictionaryable):
     def to_dict(self):
         return {'poll_id': self.poll_id,
                 'user': self.user.to_dict(),
-                'options_ids': self.options_ids}
+                'option_ids': self.options_ids}
+
+
+# Optional fields of Message: json key (also the attribute name), parser (None keeps the json value) and content type.
+# If a message has several content fields, the one listed last is its content type: "animation" messages also
+# carry "document", so "animation" is listed after it.
+_MESSAGE_FIELDS = (
+    ('forward_from', User.de_json, None),
+    ('forward_from_chat', Chat.de_json, None),
+    ('forward_from_message_id', None, None),
+    ('forward_signature', None, None),
+    ('forward_sender_name', None, None),
+    ('forward_date', None, None),
+    ('reply_to_message', _parse_nested_message, None),
+    ('edit_date', None, None),
+    ('media_group_id', None, None),
+    ('author_signature', None, None),
+    ('entities', Message.parse_entities, None),
+    ('caption_entities', Message.parse_entities, None),
+    ('caption', None, None),
+    ('reply_markup', InlineKeyboardMarkup.de_json, None),
+    ('text', None, 'text'),
+    ('audio', Audio.de_json, 'audio'),
+    ('document', Document.de_json, 'document'),
+    ('animation', Animation.de_json, 'animation'),
+    ('game', Game.de_json, 'game'),
+    ('photo', Message.parse_photo, 'photo'),
+    ('sticker', Sticker.de_json, 'sticker'),
+    ('video', Video.de_json, 'video'),
+    ('video_note', VideoNote.de_json, 'video_note'),
+    ('voice', Audio.de_json, 'voice'),
+    ('contact', Contact.de_json, 'contact'),
+    ('location', Location.de_json, 'location'),
+    ('venue', Venue.de_json, 'venue'),
+    ('dice', Dice.de_json, 'dice'),
+    ('new_chat_members', Message.parse_users, 'new_chat_members'),
+    ('left_chat_member', User.de_json, 'left_chat_member'),
+    ('new_chat_title', None, 'new_chat_title'),
+    ('new_chat_photo', Message.parse_photo, 'new_chat_photo'),
+    ('delete_chat_photo', None, 'delete_chat_photo'),
+    ('group_chat_created', None, 'group_chat_created'),
+    ('supergroup_chat_created', None, 'supergroup_chat_created'),
+    ('channel_chat_created', None, 'channel_chat_created'),
+    ('migrate_to_chat_id', None, 'migrate_to_chat_id'),
+    ('migrate_from_chat_id', None, 'migrate_from_chat_id'),
+    ('pinned_message', _parse_nested_message, 'pinned_message'),
+    ('invoice', Invoice.de_json, 'invoice'),
+    ('successful_payment', SuccessfulPayment.de_json, 'successful_payment'),
+    ('connected_website', None, 'connected_website'),
+    ('poll', Poll.de_json, 'poll'),
+    ('passport_data', None, 'passport_data'),
+)
+
+# json key -> (parser, content type, content type priority)
+_message_fields = dict(
+    (key, (parse, content_type, priority if content_type else -1))
+    for priority, (key, parse, content_type) in enumerate(_MESSAGE_FIELDS))
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
+import bisect
+import collections
+import heapq
+import json
+import multiprocessing
 import random
 import re
 import string
+import sys
 import threading
+import time
 import traceback
 import warnings
+import weakref
 import functools
+import inspect
 
 import queue as Queue
 import logging
@@ -31,6 +40,26 @@ content_type_service = [
     'supergroup_chat_created', 'channel_chat_created', 'migrate_to_chat_id', 'migrate_from_chat_id', 'pinned_message'
 ]
 
+update_types = [
+    'message', 'edited_message', 'channel_post', 'edited_channel_post', 'inline_query', 'chosen_inline_result',
+    'callback_query', 'shipping_query', 'pre_checkout_query', 'poll', 'poll_answer'
+]
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Queries the user is actively waiting for are answered ahead of message handlers
+default_update_priorities = {
+    'callback_query': PRIORITY_HIGH,
+    'inline_query': PRIORITY_HIGH,
+    'pre_checkout_query': PRIORITY_HIGH,
+    'shipping_query': PRIORITY_HIGH,
+}
+
+# (types class, update type) pairs for update_type_of, built on first use as telebot.types imports this module
+_update_types_by_class = None
+
 class WorkerThread(threading.Thread):
     count = 0
 
@@ -52,6 +81,7 @@ class WorkerThread(threading.Thread):
 
         self.exception_callback = exception_callback
         self.exception_info = None
+        self.idle_since = time.monotonic()
         self._running = True
         self.start()
 
@@ -65,9 +95,11 @@ class WorkerThread(threading.Thread):
                 self.exception_event.clear()
                 logger.debug("Received task")
                 self.received_task_event.set()
+                self.idle_since = None
 
                 task(*args, **kwargs)
                 logger.debug("Task complete")
+                self.idle_since = time.monotonic()
                 self.done_event.set()
             except Queue.Empty:
                 pass
@@ -78,6 +110,7 @@ class WorkerThread(threading.Thread):
                 if self.exception_callback:
                     self.exception_callback(self, self.exception_info)
                 self.continue_event.wait()
+                self.idle_since = time.monotonic()
 
     def put(self, task, *args, **kwargs):
         self.queue.put((task, args, kwargs))
@@ -94,19 +127,172 @@ class WorkerThread(threading.Thread):
         self._running = False
 
 
+_slot_names_cache = {}
+
+
+def slot_names(cls):
+    """
+    Returns the names of all __slots__ of `cls` and its base classes, without '__dict__' and '__weakref__'
+    """
+    names = _slot_names_cache.get(cls)
+    if names is None:
+        names = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            for name in slots:
+                if name not in ('__dict__', '__weakref__') and name not in names:
+                    names.append(name)
+        names = _slot_names_cache[cls] = tuple(names)
+    return names
+
+
+def object_attributes(obj, raw=False):
+    """
+    Returns a dict of the attributes of `obj`, read from its slots and its __dict__.
+    A private slot backing a property of the same public name ('_chat' for 'chat') is read through the property,
+    unless `raw` is True.
+    :param obj: object
+    :param raw: return the slot values as stored, under the slot names
+    """
+    attributes = {}
+    cls = type(obj)
+    for name in slot_names(cls):
+        if not raw and name[:1] == '_' and isinstance(getattr(cls, name[1:], None), property):
+            name = name[1:]
+        try:
+            attributes[name] = getattr(obj, name)
+        except AttributeError:
+            pass
+    attributes.update(getattr(obj, '__dict__', ()))
+    return attributes
+
+
+def approximate_size(obj, _depth=0):
+    """
+    Returns the approximate memory footprint of `obj` in bytes, following containers and object attributes
+    up to a small depth. Meant for accounting, not for exact measurements.
+    """
+    # getsizeof has no default size on PyPy and raises TypeError without one
+    size = sys.getsizeof(obj, 64)
+    if _depth >= 8:
+        return size
+    _depth += 1
+    if isinstance(obj, dict):
+        size += sum(approximate_size(key, _depth) + approximate_size(value, _depth) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, _depth) for item in obj)
+    elif not isinstance(obj, type) and (hasattr(obj, '__slots__') or hasattr(obj, '__dict__')):
+        for value in object_attributes(obj, raw=True).values():
+            size += approximate_size(value, _depth)
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__, 64)
+    return size
+
+
+class TaskLimiter:
+    """
+    Counts the tasks a thread pool holds (queued or running) and the approximate size of their first argument.
+
+    The limits are soft: putting a task never blocks, so a handler can always schedule follow-up work. Producers
+    (the polling loop) call wait_for_capacity before fetching more updates instead.
+    """
+
+    def __init__(self, max_tasks=None, max_bytes=None, size_func=None):
+        """
+        :param max_tasks: Maximum number of pending tasks, None for no limit
+        :param max_bytes: Maximum approximate size of the pending tasks in bytes, None for no limit
+        :param size_func: Function returning the size of a task's first argument. Defaults to approximate_size.
+        """
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.size_func = size_func if size_func else approximate_size
+        self.pending_tasks = 0
+        self.pending_bytes = 0
+        self._condition = threading.Condition()
+
+    def wrap(self, func, args, kwargs):
+        """
+        Accounts a new task and returns the (task, args, kwargs) tuple to queue in its place
+        """
+        size = self.size_func(args[0]) if self.max_bytes and args else 0
+        with self._condition:
+            self.pending_tasks += 1
+            self.pending_bytes += size
+        return self._run, (size, func, args, kwargs), {}
+
+    def _run(self, size, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        finally:
+            with self._condition:
+                self.pending_tasks -= 1
+                self.pending_bytes -= size
+                self._condition.notify_all()
+
+    def is_full(self):
+        return bool((self.max_tasks and self.pending_tasks >= self.max_tasks) or
+                    (self.max_bytes and self.pending_bytes >= self.max_bytes))
+
+    def free_slots(self):
+        """
+        Returns the number of tasks that fit until max_tasks is reached, or None without a task limit
+        """
+        if not self.max_tasks:
+            return None
+        return max(0, self.max_tasks - self.pending_tasks)
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Blocks until the limits leave room for another task.
+        :param timeout: seconds to wait, None to wait forever
+        :return: False if the timeout expired while still full
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self.is_full(), timeout)
+
+
 class ThreadPool:
 
-    def __init__(self, num_threads=2):
+    def __init__(self, num_threads=2, max_tasks=None, max_bytes=None):
+        """
+        :param num_threads: Number of worker threads
+        :param max_tasks: Maximum number of pending tasks before polling pauses, None for no limit
+        :param max_bytes: Maximum approximate size of the pending updates in bytes before polling pauses,
+            None for no limit
+        """
         self.tasks = Queue.Queue()
         self.workers = [WorkerThread(self.on_exception, self.tasks) for _ in range(num_threads)]
         self.num_threads = num_threads
+        self.limiter = TaskLimiter(max_tasks, max_bytes) if max_tasks or max_bytes else None
 
         self.exception_event = threading.Event()
         self.exception_info = None
 
     def put(self, func, *args, **kwargs):
+        if self.limiter:
+            func, args, kwargs = self.limiter.wrap(func, args, kwargs)
         self.tasks.put((func, args, kwargs))
 
+    def wait_for_capacity(self, timeout=None):
+        """
+        Blocks until the pool has room for more tasks. Returns immediately if the pool has no limits.
+        :param timeout: seconds to wait, None to wait forever
+        :return: False if the timeout expired while the pool was still full
+        """
+        if self.limiter is None:
+            return True
+        return self.limiter.wait_for_capacity(timeout)
+
+    def free_slots(self):
+        """
+        Returns the number of tasks the pool accepts until it is full, or None if the number of tasks is not limited
+        """
+        if self.limiter is None:
+            return None
+        return self.limiter.free_slots()
+
     def on_exception(self, worker_thread, exc_info):
         self.exception_info = exc_info
         self.exception_event.set()
@@ -126,6 +312,995 @@ class ThreadPool:
             worker.join()
 
 
+class ElasticThreadPool(ThreadPool):
+    """
+    Thread pool that grows and shrinks with the load.
+
+    A monitor thread checks every scale_interval seconds how long the oldest queued task has been waiting. If that
+    exceeds wait_threshold, a worker is added (up to max_threads). Workers that were idle for keep_alive seconds are
+    retired (down to min_threads). stats() reports the current size, queue wait times and the recent scaling events.
+    """
+
+    def __init__(self, min_threads=2, max_threads=8, wait_threshold=0.5, keep_alive=60, scale_interval=0.1,
+                 max_tasks=None, max_bytes=None):
+        """
+        :param min_threads: Number of workers the pool starts with and never goes below
+        :param max_threads: Maximum number of workers
+        :param wait_threshold: Queue wait time in seconds above which a worker is added
+        :param keep_alive: Seconds a worker above min_threads may stay idle before it is retired
+        :param scale_interval: Seconds between two checks of the monitor thread
+        :param max_tasks: Maximum number of pending tasks before polling pauses, None for no limit
+        :param max_bytes: Maximum approximate size of the pending updates in bytes before polling pauses
+        """
+        self.min_threads = min_threads
+        self.max_threads = max(max_threads, min_threads)
+        self.wait_threshold = wait_threshold
+        self.keep_alive = keep_alive
+        self.scale_interval = scale_interval
+
+        self.tasks = Queue.Queue()
+        self.workers = [WorkerThread(self.on_exception, self.tasks) for _ in range(min_threads)]
+        self.num_threads = min_threads
+        self.limiter = TaskLimiter(max_tasks, max_bytes) if max_tasks or max_bytes else None
+
+        self.exception_event = threading.Event()
+        self.exception_info = None
+
+        self.last_wait = 0.0
+        self.average_wait = 0.0
+        self.max_wait = 0.0
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.events = collections.deque(maxlen=100)
+
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._monitor = threading.Thread(target=self._monitor_loop, name="ElasticThreadPoolMonitor")
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def put(self, func, *args, **kwargs):
+        if self.limiter:
+            func, args, kwargs = self.limiter.wrap(func, args, kwargs)
+        self.tasks.put((self._run, (time.monotonic(), func, args, kwargs), {}))
+
+    def _run(self, enqueued, func, args, kwargs):
+        wait = time.monotonic() - enqueued
+        with self._lock:
+            self.last_wait = wait
+            self.average_wait = wait if not self.average_wait else 0.9 * self.average_wait + 0.1 * wait
+            self.max_wait = max(self.max_wait, wait)
+        func(*args, **kwargs)
+
+    def oldest_wait(self):
+        """
+        Returns the seconds the oldest queued task has been waiting, 0 if the queue is empty
+        """
+        with self.tasks.mutex:
+            if not self.tasks.queue:
+                return 0.0
+            enqueued = self.tasks.queue[0][1][0]
+        return time.monotonic() - enqueued
+
+    def _monitor_loop(self):
+        while not self._closed.wait(self.scale_interval):
+            self.scale()
+
+    def scale(self):
+        """
+        Adds a worker if queued tasks wait too long, otherwise retires one worker that was idle for keep_alive seconds.
+        Called periodically by the monitor thread.
+        """
+        wait = self.oldest_wait()
+        with self._lock:
+            if wait > self.wait_threshold and len(self.workers) < self.max_threads:
+                self.workers.append(WorkerThread(self.on_exception, self.tasks))
+                self.scale_ups += 1
+                self._record_event('up', wait)
+            elif len(self.workers) > self.min_threads:
+                now = time.monotonic()
+                for worker in self.workers:
+                    idle_since = worker.idle_since
+                    if idle_since is not None and now - idle_since > self.keep_alive:
+                        worker.stop()
+                        self.workers.remove(worker)
+                        self.scale_downs += 1
+                        self._record_event('down', wait)
+                        break
+
+    def _record_event(self, direction, wait):
+        self.num_threads = len(self.workers)
+        self.events.append((time.time(), direction, self.num_threads))
+        logger.info("ElasticThreadPool scaled {0} to {1} workers (queue wait {2:.3f}s)".format(
+            direction, self.num_threads, wait))
+
+    def stats(self):
+        """
+        Returns a dict with the current size of the pool, queue wait times in seconds and the recent scaling events
+        as (timestamp, 'up' or 'down', size after scaling) tuples.
+        """
+        oldest_wait = self.oldest_wait()
+        with self._lock:
+            return {
+                'size': len(self.workers),
+                'busy': sum(1 for worker in self.workers if worker.idle_since is None),
+                'queued': self.tasks.qsize(),
+                'oldest_wait': oldest_wait,
+                'last_wait': self.last_wait,
+                'average_wait': self.average_wait,
+                'max_wait': self.max_wait,
+                'scale_ups': self.scale_ups,
+                'scale_downs': self.scale_downs,
+                'events': list(self.events),
+            }
+
+    def close(self):
+        self._closed.set()
+        self._monitor.join()
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+
+
+def compact_json(obj):
+    """
+    Returns `obj` encoded as json without whitespace and with non-ASCII characters kept as is
+    """
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def pack_task_argument(obj):
+    """
+    Converts a task argument into the form sent to a ProcessPool worker. Objects parsed from an update (e.g. Message,
+    CallbackQuery) are sent as compact JSON, their raw JSON if they kept it, and parsed again in the child.
+    Other objects are pickled.
+    """
+    cls = type(obj)
+    if hasattr(cls, 'de_json'):
+        raw = getattr(obj, 'json', None)
+        if raw and isinstance(raw, dict):
+            return cls, compact_json(raw)
+        if raw and isinstance(raw, str):
+            return cls, raw
+        if raw and isinstance(raw, bytes):
+            return cls, raw.decode('utf-8')
+        if hasattr(obj, 'to_dict'):
+            return cls, compact_json(obj.to_dict())
+    return None, obj
+
+
+def unpack_task_argument(packed):
+    cls, data = packed
+    return cls.de_json(data) if cls is not None else data
+
+
+def _init_process_worker(initializer, initargs):
+    # Connections of the parent must not be shared with the child, every process gets its own requests session
+    from telebot import apihelper
+    apihelper.session = None
+    apihelper._get_req_session(reset=True)
+    if initializer:
+        initializer(*initargs)
+
+
+def _run_in_process(func, packed_args, kwargs):
+    return func(*[unpack_task_argument(packed) for packed in packed_args], **kwargs)
+
+
+class ProcessPool:
+    """
+    Runs tasks in worker processes, so CPU-bound handlers do not hold the GIL of the polling and handler threads.
+
+    Task functions must be picklable (defined at module level). Messages are sent to the child as their raw JSON and
+    parsed again there, so attributes added after parsing (e.g. by middleware) are not available in the child.
+    Each child creates its own requests session; apihelper.session is not shared with the children.
+    """
+
+    def __init__(self, num_processes=None, initializer=None, initargs=(), exception_callback=None):
+        """
+        :param num_processes: Number of worker processes, defaults to the number of CPUs
+        :param initializer: Optional function called in every child after the API client was set up
+        :param initargs: Arguments for initializer
+        :param exception_callback: Optional function called with the exception of a failed task, in the pool's
+            result thread. Exceptions are logged if it is not set.
+        """
+        self.pool = multiprocessing.Pool(num_processes, _init_process_worker, (initializer, initargs))
+        self.exception_callback = exception_callback
+
+    def put(self, func, *args, **kwargs):
+        """
+        Schedules func(*args, **kwargs) in a worker process.
+        :return: multiprocessing.pool.AsyncResult
+        """
+        packed_args = [pack_task_argument(arg) for arg in args]
+        return self.pool.apply_async(_run_in_process, (func, packed_args, kwargs), error_callback=self.on_exception)
+
+    def on_exception(self, exc_info):
+        if self.exception_callback:
+            self.exception_callback(exc_info)
+        else:
+            logger.error("Exception in process pool task: {0}".format(repr(exc_info)))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class TaskCancelled(Exception):
+    """
+    Raised by check_cancelled in a handler the watchdog asked to stop
+    """
+    pass
+
+
+def cancelled():
+    """
+    Returns True if the watchdog asked the handler running in the current thread to stop.
+    Long running handlers should check this (or call check_cancelled) between steps.
+    """
+    task = getattr(thread_local, 'watchdog_task', None)
+    return task is not None and task.cancel_event.is_set()
+
+
+def check_cancelled():
+    """
+    Raises TaskCancelled if the watchdog asked the handler running in the current thread to stop
+    """
+    if cancelled():
+        raise TaskCancelled()
+
+
+class _RunningTask:
+    __slots__ = ('handler', 'thread_id', 'started', 'deadline', 'cancel_event', 'flagged')
+
+    def __init__(self, handler, deadline):
+        self.handler = handler
+        self.thread_id = threading.get_ident()
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.cancel_event = threading.Event()
+        self.flagged = False
+
+
+def _handler_name(handler):
+    return "{0}.{1}".format(getattr(handler, '__module__', None), getattr(handler, '__qualname__', repr(handler)))
+
+
+class Watchdog:
+    """
+    Watches the execution time of handlers.
+
+    Handlers running longer than their deadline (set per handler with set_deadline, otherwise default_deadline) are
+    logged once with a snapshot of their stack and, if cancel is True, asked to stop: cancelled() returns True in
+    the handler's thread and check_cancelled raises TaskCancelled. Cancellation is cooperative, a handler blocked in
+    a call keeps its worker until the call returns.
+    stats() reports calls, total and maximum run time and overruns per handler.
+    """
+
+    def __init__(self, default_deadline=None, interval=1.0, cancel=True, on_overrun=None):
+        """
+        :param default_deadline: Seconds a handler may run, None for no global deadline
+        :param interval: Seconds between two checks of the running handlers
+        :param cancel: Ask handlers past their deadline to stop
+        :param on_overrun: Optional function called with (handler, seconds running, stack) for every overrun
+        """
+        self.default_deadline = default_deadline
+        self.interval = interval
+        self.cancel = cancel
+        self.on_overrun = on_overrun
+        self.deadlines = {}
+
+        # Bounded, as next step handlers are often closures created per message
+        self._wrappers = LRUCache(maxsize=1024)
+        # thread id -> stack of the _RunningTask of that thread, a wrapped handler may call another one
+        self._running = {}
+        # Statistics of handlers that can't be weakly referenced are kept in _strong_stats
+        self._stats = weakref.WeakKeyDictionary()
+        self._strong_stats = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._monitor_loop, name="WatchdogThread")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_deadline(self, handler, seconds):
+        """
+        Sets the deadline of `handler`, overriding default_deadline. None disables the deadline for this handler.
+        """
+        self.deadlines[handler] = seconds
+
+    def wrap(self, handler):
+        """
+        Returns a function that runs `handler` under the watchdog. The wrapper's __wrapped__ attribute is the handler.
+        Deadlines and statistics are kept for the innermost function if `handler` itself wraps another function.
+        """
+        wrapper = self._wrappers.get(handler)
+        if wrapper is None:
+            target = inspect.unwrap(handler)
+
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                return self._run(target, handler, args, kwargs)
+
+            self._wrappers.set(handler, wrapper)
+        return wrapper
+
+    def _run(self, target, handler, args, kwargs):
+        task = _RunningTask(target, self.deadlines.get(target, self.default_deadline))
+        outer_task = getattr(thread_local, 'watchdog_task', None)
+        thread_local.watchdog_task = task
+        with self._lock:
+            self._running.setdefault(task.thread_id, []).append(task)
+        try:
+            return handler(*args, **kwargs)
+        except TaskCancelled:
+            logger.info("Handler {0} was cancelled".format(_handler_name(target)))
+        finally:
+            elapsed = time.monotonic() - task.started
+            thread_local.watchdog_task = outer_task
+            with self._lock:
+                stack = self._running[task.thread_id]
+                stack.remove(task)
+                if not stack:
+                    del self._running[task.thread_id]
+                stats = self._handler_stats(target)
+                stats['calls'] += 1
+                stats['total_time'] += elapsed
+                stats['max_time'] = max(stats['max_time'], elapsed)
+                if task.flagged:
+                    stats['overruns'] += 1
+
+    def _handler_stats(self, target):
+        try:
+            stats_by_handler = self._stats
+            stats = stats_by_handler.get(target)
+        except TypeError:
+            stats_by_handler = self._strong_stats
+            stats = stats_by_handler.get(target)
+        if stats is None:
+            stats = stats_by_handler[target] = {'calls': 0, 'total_time': 0.0, 'max_time': 0.0, 'overruns': 0}
+        return stats
+
+    def _running_tasks(self):
+        return [task for stack in self._running.values() for task in stack]
+
+    def _monitor_loop(self):
+        while not self._closed.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """
+        Flags the handlers that are past their deadline. Called periodically by the watchdog thread.
+        """
+        now = time.monotonic()
+        with self._lock:
+            overdue = [task for task in self._running_tasks()
+                       if not task.flagged and task.deadline is not None and now - task.started > task.deadline]
+            for task in overdue:
+                task.flagged = True
+        if not overdue:
+            return
+        frames = sys._current_frames()
+        for task in overdue:
+            frame = frames.get(task.thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            elapsed = now - task.started
+            logger.warning("Handler {0} exceeded its deadline of {1}s (running for {2:.1f}s):\n{3}".format(
+                _handler_name(task.handler), task.deadline, elapsed, stack))
+            if self.cancel:
+                task.cancel_event.set()
+            if self.on_overrun:
+                self.on_overrun(task.handler, elapsed, stack)
+
+    def stats(self):
+        """
+        Returns a dict with the statistics of every handler by name, and the handlers running right now as
+        (name, seconds running) tuples under 'running'. Names are module.qualname, followed by '#' and the id of the
+        handler if several handlers have the same name.
+        """
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._stats.items()) + list(self._strong_stats.items())
+            running = [(_handler_name(task.handler), now - task.started) for task in self._running_tasks()]
+        names = collections.Counter(_handler_name(handler) for handler, stats in items)
+        result = {}
+        for handler, stats in items:
+            name = _handler_name(handler)
+            if names[name] > 1:
+                name = '{0}#{1}'.format(name, id(handler))
+            result[name] = dict(stats)
+        result['running'] = running
+        return result
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+
+class MediaGroupCollector:
+    """
+    Buffers the messages of albums (messages sharing a media_group_id) and passes every album to `callback` as one
+    list, sorted by message_id, once no new message of the album arrived for `debounce` seconds.
+    Albums are collected across several calls of collect, so an album split between two getUpdates batches is still
+    delivered once. Every album has one timer, which is rescheduled when it fires while new messages still arrive.
+    """
+
+    def __init__(self, callback, debounce=1.0, exception_callback=None):
+        """
+        :param callback: Function called with the list of messages of an album. Runs in a timer thread.
+        :param debounce: Seconds to wait for further messages of an album. Changes apply to the next timeout.
+        :param exception_callback: Optional function called with an exception raised by callback. Exceptions are
+            logged if it is not set.
+        """
+        self.callback = callback
+        self.debounce = debounce
+        self.exception_callback = exception_callback
+        self._groups = {}
+        self._last_seen = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def collect(self, messages):
+        """
+        Buffers the album messages of `messages`
+        :return: list of the messages that are not part of an album
+        """
+        single = []
+        for message in messages:
+            group_id = getattr(message, 'media_group_id', None)
+            if group_id is None:
+                single.append(message)
+                continue
+            with self._lock:
+                self._groups.setdefault(group_id, []).append(message)
+                self._last_seen[group_id] = time.monotonic()
+                if group_id not in self._timers:
+                    self._schedule(group_id, self.debounce)
+        return single
+
+    def _schedule(self, group_id, delay):
+        timer = self._timers[group_id] = threading.Timer(delay, self._on_timeout, (group_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _on_timeout(self, group_id):
+        with self._lock:
+            if self._timers.get(group_id) is not threading.current_thread():
+                # Delivered by flush in the meantime
+                return
+            remaining = self._last_seen[group_id] + self.debounce - time.monotonic()
+            if remaining > 0:
+                self._schedule(group_id, remaining)
+                return
+        self._deliver(group_id)
+
+    def _deliver(self, group_id):
+        with self._lock:
+            self._timers.pop(group_id, None)
+            self._last_seen.pop(group_id, None)
+            group = self._groups.pop(group_id, None)
+        if not group:
+            return
+        group.sort(key=lambda message: message.message_id)
+        try:
+            self.callback(group)
+        except Exception as e:
+            if self.exception_callback:
+                self.exception_callback(e)
+            else:
+                logger.error("Exception in media group callback: {0}".format(repr(e)))
+
+    def pending(self):
+        """
+        Returns the number of albums waiting for their debounce window to close
+        """
+        with self._lock:
+            return len(self._groups)
+
+    def flush(self):
+        """
+        Delivers all buffered albums immediately
+        """
+        with self._lock:
+            group_ids = list(self._groups)
+            for timer in self._timers.values():
+                timer.cancel()
+        for group_id in group_ids:
+            self._deliver(group_id)
+
+
+class BatchCollector:
+    """
+    Collects items and passes them to `callback` as one list when max_size items are buffered or max_delay seconds
+    after the first buffered item, whichever comes first.
+    """
+
+    def __init__(self, callback, max_size=None, max_delay=None, exception_callback=None):
+        """
+        :param callback: Function called with the list of collected items
+        :param max_size: Maximum number of items per batch, None for no limit
+        :param max_delay: Maximum seconds an item waits for its batch to be delivered, None to wait for max_size
+        :param exception_callback: Optional function called with an exception raised by callback for a batch
+            delivered by the max_delay timer. Exceptions are logged if it is not set.
+        """
+        self.callback = callback
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.exception_callback = exception_callback
+        self._items = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, items):
+        batches = []
+        with self._lock:
+            self._items.extend(items)
+            if self.max_size:
+                while len(self._items) >= self.max_size:
+                    batches.append(self._items[:self.max_size])
+                    del self._items[:self.max_size]
+            if not self._items and self._timer:
+                self._timer.cancel()
+                self._timer = None
+            elif self._items and self.max_delay is not None and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self._on_timeout)
+                self._timer.daemon = True
+                self._timer.start()
+        for batch in batches:
+            self.callback(batch)
+
+    def flush(self):
+        """
+        Delivers the buffered items immediately
+        """
+        with self._lock:
+            items = self._items
+            self._items = []
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if items:
+            self.callback(items)
+
+    def _on_timeout(self):
+        try:
+            self.flush()
+        except Exception as e:
+            if self.exception_callback:
+                self.exception_callback(e)
+            else:
+                logger.error("Exception in batch callback: {0}".format(repr(e)))
+
+
+class Coalescer:
+    """
+    Keeps only the latest item per key, e.g. the latest inline query per user.
+
+    add passes the latest item of every key to `callback`, after `debounce` seconds without a newer item of the same
+    key if debounce is set. Before the work for an item starts, claim tells whether the item is still the latest of
+    its key; superseded items are dropped there, so a queue of outdated tasks is skipped instead of computed.
+    Debounced items wait in a heap served by one scheduler thread, started on first use.
+    """
+
+    def __init__(self, callback, key_func, debounce=0, exception_callback=None):
+        """
+        :param callback: Function called with an item that should be processed
+        :param key_func: Function returning the key of an item
+        :param debounce: Seconds to wait for a newer item of the same key before calling callback
+        :param exception_callback: Optional function called with an exception raised by callback in the scheduler
+            thread. Exceptions are logged if it is not set.
+        """
+        self.callback = callback
+        self.key_func = key_func
+        self.debounce = debounce
+        self.exception_callback = exception_callback
+        self.dropped = 0
+        self._latest = {}
+        # key -> time the latest item of the key is due, entries of the heap with another time are stale
+        self._due = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._scheduler = None
+        self._closed = False
+
+    def add(self, items):
+        batch = collections.OrderedDict()
+        with self._lock:
+            for item in items:
+                key = self.key_func(item)
+                if key in self._latest:
+                    self.dropped += 1
+                self._latest[key] = item
+                batch[key] = item
+            if self.debounce:
+                due = time.monotonic() + self.debounce
+                for key in batch:
+                    self._due[key] = due
+                    heapq.heappush(self._heap, (due, id(key), key))
+                if self._scheduler is None:
+                    self._scheduler = threading.Thread(target=self._schedule_loop, name="CoalescerThread")
+                    self._scheduler.daemon = True
+                    self._scheduler.start()
+                self._wakeup.notify()
+        if not self.debounce:
+            for item in batch.values():
+                self.callback(item)
+
+    def _schedule_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._wakeup.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._closed:
+                    return
+                due, _, key = heapq.heappop(self._heap)
+                if self._due.get(key) != due:
+                    # A newer item of the key arrived in the meantime
+                    continue
+                del self._due[key]
+                item = self._latest.get(key)
+            if item is None:
+                continue
+            try:
+                self.callback(item)
+            except Exception as e:
+                if self.exception_callback:
+                    self.exception_callback(e)
+                else:
+                    logger.error("Exception in coalescer callback: {0}".format(repr(e)))
+
+    def close(self):
+        """
+        Stops the scheduler thread; debounced items that are not due yet are dropped
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._scheduler is not None:
+            self._scheduler.join()
+
+    def claim(self, item):
+        """
+        Returns True if `item` is still the latest of its key and marks it as being processed.
+        Returns False if a newer item superseded it; the item should then be dropped.
+        """
+        key = self.key_func(item)
+        with self._lock:
+            if self._latest.get(key) is item:
+                del self._latest[key]
+                return True
+        return False
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps at most `maxsize` entries, evicting the least recently used one,
+    and optionally expires entries `ttl` seconds after they were set.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param maxsize: Maximum number of entries
+        :param ttl: Seconds an entry stays valid, None to keep entries until they are evicted
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class InlineResultsCache:
+    """
+    Caches complete inline query result lists in serialized form, keyed by (query text, user id or None), and serves
+    them page by page, so scrolling through the results of an expensive search does not recompute it.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, page_size=50):
+        """
+        :param maxsize: Maximum number of cached result lists
+        :param ttl: Seconds a result list stays cached
+        :param page_size: Number of results per answer, at most 50
+        """
+        self.cache = LRUCache(maxsize, ttl)
+        self.page_size = page_size
+
+    def get(self, query, user_id=None):
+        """
+        Returns the cached tuple of serialized results of `query`, None if not cached
+        """
+        return self.cache.get((query, user_id))
+
+    def set(self, query, results, user_id=None):
+        """
+        Serializes and caches `results` of `query`
+        :param results: list of InlineQueryResult* objects (JsonSerializable)
+        :return: tuple of the serialized results
+        """
+        serialized = tuple(result.to_json() for result in results)
+        self.cache.set((query, user_id), serialized)
+        return serialized
+
+    def page(self, serialized, offset):
+        """
+        Returns (JSON array of the results starting at `offset`, next_offset); next_offset is '' on the last page
+        :param serialized: tuple returned by get or set
+        :param offset: offset string sent by the client, '' for the first page
+        """
+        try:
+            start = max(int(offset), 0) if offset else 0
+        except ValueError:
+            start = 0
+        end = start + self.page_size
+        next_offset = str(end) if end < len(serialized) else ''
+        return '[' + ','.join(serialized[start:end]) + ']', next_offset
+
+
+def shard_key(obj):
+    """
+    Returns the key that orders the tasks for `obj`: the chat id for messages and for callback queries sent from
+    a message, the sender id for other queries and poll answers.
+    :param obj: First argument of a task (Message, CallbackQuery, InlineQuery, ...)
+    :return: the key, or None if `obj` has no chat or sender (e.g. the list passed to update listeners).
+    """
+    chat = getattr(obj, 'chat', None)
+    if chat is not None:
+        return chat.id
+    message = getattr(obj, 'message', None)
+    if message is not None and getattr(message, 'chat', None) is not None:
+        return message.chat.id
+    user = getattr(obj, 'from_user', None) or getattr(obj, 'user', None)
+    if user is not None:
+        return user.id
+    return None
+
+
+class ShardedThreadPool(ThreadPool):
+    """
+    Thread pool that runs the tasks of one chat in order while different chats run in parallel.
+
+    Every worker has its own queue (lane). A task is routed by the key returned by key_func for its first
+    argument (shard_key by default: the chat id). All tasks of a key that are pending or running stay on one
+    lane, so a handler for the second message of a chat starts only after the handler of the first one finished.
+    Tasks without a key go to the least loaded lane.
+
+    When a key has no pending tasks it is assigned a lane again. Normally that is the lane chosen by the hash of
+    the key, but if that lane has rebalance_threshold more pending tasks than the least loaded lane, the key is
+    moved to the least loaded one. This keeps a busy chat from delaying the chats that share its lane.
+    """
+
+    def __init__(self, num_threads=2, key_func=None, rebalance_threshold=4, max_tasks=None, max_bytes=None):
+        """
+        :param num_threads: Number of lanes. Each lane has exactly one worker thread.
+        :param key_func: Function returning the ordering key for the first task argument. Defaults to shard_key.
+        :param rebalance_threshold: Difference in pending tasks between the hashed and the least loaded lane
+            at which a key is assigned to the least loaded lane.
+        :param max_tasks: Maximum number of pending tasks before polling pauses, None for no limit
+        :param max_bytes: Maximum approximate size of the pending updates in bytes before polling pauses
+        """
+        self.key_func = key_func if key_func else shard_key
+        self.rebalance_threshold = rebalance_threshold
+        self.lanes = [Queue.Queue() for _ in range(num_threads)]
+        self.workers = [WorkerThread(self.on_exception, lane) for lane in self.lanes]
+        self.num_threads = num_threads
+        self.limiter = TaskLimiter(max_tasks, max_bytes) if max_tasks or max_bytes else None
+
+        self.exception_event = threading.Event()
+        self.exception_info = None
+
+        self._lock = threading.Lock()
+        self._lane_load = [0] * num_threads
+        self._keys = {}
+
+    def put(self, func, *args, **kwargs):
+        key = self.key_func(args[0]) if args else None
+        with self._lock:
+            if key is None:
+                lane = self._least_loaded_lane()
+            else:
+                entry = self._keys.get(key)
+                if entry is None:
+                    lane = hash(key) % self.num_threads
+                    least_loaded = self._least_loaded_lane()
+                    if self._lane_load[lane] - self._lane_load[least_loaded] >= self.rebalance_threshold:
+                        lane = least_loaded
+                    entry = self._keys[key] = [lane, 0]
+                lane = entry[0]
+                entry[1] += 1
+            self._lane_load[lane] += 1
+        if self.limiter:
+            func, args, kwargs = self.limiter.wrap(func, args, kwargs)
+        self.lanes[lane].put((self._run, (key, lane, func, args, kwargs), {}))
+
+    def _least_loaded_lane(self):
+        return min(range(self.num_threads), key=self._lane_load.__getitem__)
+
+    def _run(self, key, lane, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._lane_load[lane] -= 1
+                if key is not None:
+                    entry = self._keys[key]
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._keys[key]
+
+    def lane_of(self, key):
+        """
+        Returns the lane the pending tasks of `key` run on, or None if the key has no pending tasks
+        """
+        with self._lock:
+            entry = self._keys.get(key)
+            return entry[0] if entry else None
+
+
+def update_type_of(obj):
+    """
+    Returns the update type `obj` was delivered as, e.g. 'message', 'edited_channel_post' or 'callback_query'.
+    :param obj: Object passed to a handler
+    :return: the update type, or None for other objects (e.g. the list passed to update listeners).
+    """
+    global _update_types_by_class
+    from telebot import types
+    if isinstance(obj, types.Message):
+        channel = obj.chat is not None and obj.chat.type == 'channel'
+        if obj.edit_date:
+            return 'edited_channel_post' if channel else 'edited_message'
+        return 'channel_post' if channel else 'message'
+    if _update_types_by_class is None:
+        _update_types_by_class = (
+            (types.CallbackQuery, 'callback_query'),
+            (types.InlineQuery, 'inline_query'),
+            (types.ChosenInlineResult, 'chosen_inline_result'),
+            (types.ShippingQuery, 'shipping_query'),
+            (types.PreCheckoutQuery, 'pre_checkout_query'),
+            (types.Poll, 'poll'),
+            (types.PollAnswer, 'poll_answer'),
+        )
+    for cls, update_type in _update_types_by_class:
+        if isinstance(obj, cls):
+            return update_type
+    return None
+
+
+class PriorityTaskQueue(Queue.Queue):
+    """
+    Queue with one FIFO lane per priority. get() returns the oldest task of the lane with the lowest priority
+    number, unless the oldest task of another lane has waited longer than starvation_timeout seconds and is
+    older than that task; then the starving task is returned first.
+    Items are put as (priority, task) tuples and returned as task.
+    """
+
+    def __init__(self, starvation_timeout=1.0, maxsize=0):
+        self.starvation_timeout = starvation_timeout
+        Queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self.lanes = {}
+        self.priorities = []
+        self.size = 0
+
+    def _qsize(self):
+        return self.size
+
+    def _put(self, item):
+        priority, task = item
+        lane = self.lanes.get(priority)
+        if lane is None:
+            lane = self.lanes[priority] = collections.deque()
+            bisect.insort(self.priorities, priority)
+        lane.append((time.monotonic(), task))
+        self.size += 1
+
+    def _get(self):
+        now = time.monotonic()
+        chosen = None
+        for priority in self.priorities:
+            lane = self.lanes[priority]
+            if not lane:
+                continue
+            if chosen is None:
+                chosen = lane
+            elif now - lane[0][0] > self.starvation_timeout and lane[0][0] < chosen[0][0]:
+                chosen = lane
+        self.size -= 1
+        return chosen.popleft()[1]
+
+
+class PriorityThreadPool(ThreadPool):
+    """
+    Thread pool that runs latency-sensitive tasks first.
+
+    The priority of a task is looked up by its handler in handler_priorities, then by the update type of its first
+    argument in priorities (see default_update_priorities: callback, inline, shipping and pre-checkout queries are
+    PRIORITY_HIGH). Lower numbers run first. Tasks of lower priority that waited longer than starvation_timeout
+    seconds are run ahead of newer high priority tasks, so bulk work keeps moving during a burst of queries.
+    """
+
+    def __init__(self, num_threads=2, priorities=None, handler_priorities=None, default_priority=PRIORITY_NORMAL,
+                 starvation_timeout=1.0, max_tasks=None, max_bytes=None):
+        """
+        :param num_threads: Number of worker threads
+        :param priorities: dict of priorities by update type, merged over default_update_priorities
+        :param handler_priorities: dict of priorities by handler function
+        :param default_priority: priority of tasks that match neither mapping
+        :param starvation_timeout: seconds after which a waiting task is run regardless of its priority
+        :param max_tasks: Maximum number of pending tasks before polling pauses, None for no limit
+        :param max_bytes: Maximum approximate size of the pending updates in bytes before polling pauses
+        """
+        self.priorities = dict(default_update_priorities)
+        if priorities:
+            self.priorities.update(priorities)
+        self.handler_priorities = dict(handler_priorities) if handler_priorities else {}
+        self.default_priority = default_priority
+
+        self.tasks = PriorityTaskQueue(starvation_timeout)
+        self.workers = [WorkerThread(self.on_exception, self.tasks) for _ in range(num_threads)]
+        self.num_threads = num_threads
+        self.limiter = TaskLimiter(max_tasks, max_bytes) if max_tasks or max_bytes else None
+
+        self.exception_event = threading.Event()
+        self.exception_info = None
+
+    def set_handler_priority(self, handler, priority):
+        """
+        Sets the priority of all tasks that run `handler`
+        :param handler: handler function
+        :param priority: priority, lower runs first
+        """
+        self.handler_priorities[handler] = priority
+
+    def priority_of(self, func, args):
+        priority = self.handler_priorities.get(inspect.unwrap(func))
+        if priority is None:
+            update_type = update_type_of(args[0]) if args else None
+            priority = self.priorities.get(update_type, self.default_priority)
+        return priority
+
+    def put(self, func, *args, **kwargs):
+        priority = self.priority_of(func, args)
+        if self.limiter:
+            func, args, kwargs = self.limiter.wrap(func, args, kwargs)
+        self.tasks.put((priority, (func, args, kwargs)))
+
+
 class AsyncTask:
     def __init__(self, target, *args, **kwargs):
         self.target = target
@@ -0,0 +1,66 @@
+import sys
+
+sys.path.append('../')
+
+import pytest
+
+import telebot
+from telebot import types
+from telebot.callback_data import CallbackDataRouter
+
+
+@pytest.fixture()
+def telegram_bot():
+    return telebot.TeleBot('', threaded=False)
+
+
+def create_callback_query(data):
+    return types.CallbackQuery(1, types.User(7, False, 'u'), data, 'instance')
+
+
+def test_router_parses_typed_parameters():
+    router = CallbackDataRouter()
+    router.add('page:{n:int}', 'page')
+    router.add('item:{name}:{price:float}', 'item')
+    assert router.match('page:3') == ('page', {'n': 3})
+    assert router.match('page:-1') == ('page', {'n': -1})
+    assert router.match('page:x') is None
+    assert router.match('item:tea:2.5') == ('item', {'name': 'tea', 'price': 2.5})
+    assert router.match('item:tea') is None
+    assert len(router) == 2
+
+
+def test_router_prefers_literals_over_parameters_and_wildcards():
+    router = CallbackDataRouter()
+    router.add('settings:*', 'any setting')
+    router.add('settings:{name}', 'named setting')
+    router.add('settings:lang', 'language')
+    assert router.match('settings:lang') == ('language', {})
+    assert router.match('settings:theme') == ('named setting', {'name': 'theme'})
+    assert router.match('settings:theme:dark') == ('any setting', {})
+    assert [value for value, kwargs in router.iter_matches('settings:lang')] == [
+        'language', 'named setting', 'any setting']
+
+
+def test_router_rejects_invalid_patterns():
+    router = CallbackDataRouter()
+    with pytest.raises(ValueError):
+        router.add('a:*:b', 'value')
+    with pytest.raises(ValueError):
+        router.add('a:{n:decimal}', 'value')
+
+
+def test_callback_query_handler_with_data_pattern(telegram_bot):
+    results = []
+
+    @telegram_bot.callback_query_handler(data='page:{n:int}', func=lambda call: call.from_user.id == 7)
+    def page(call, n):
+        results.append(('page', n))
+
+    @telegram_bot.callback_query_handler(func=lambda call: True)
+    def fallback(call):
+        results.append(('fallback', call.data))
+
+    telegram_bot.process_new_callback_query([create_callback_query('page:2'), create_callback_query('other'),
+                                             create_callback_query('page:x')])
+    assert results == [('page', 2), ('fallback', 'other'), ('fallback', 'page:x')]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import sys
+
+sys.path.append('../')
+
+import pytest
+
+from telebot import codec
+from telebot import types
+
+
+@pytest.fixture(autouse=True, params=['msgpack', 'pure'])
+def backend(request, monkeypatch):
+    # Every test runs with the msgpack package and with the pure Python implementation
+    if request.param == 'msgpack':
+        monkeypatch.setattr(codec, 'msgpack', pytest.importorskip('msgpack'))
+    else:
+        monkeypatch.setattr(codec, 'msgpack', None)
+    return request.param
+
+
+def create_update(update_id):
+    user = {'id': 383324787, 'is_bot': False, 'first_name': 'Some', 'last_name': 'User', 'username': 'someuser',
+            'language_code': 'en'}
+    chat = {'id': -1001234567890, 'title': 'Group', 'type': 'supergroup', 'username': 'group'}
+    entities = [{'offset': 0, 'length': 6, 'type': 'bot_command'}, {'offset': 7, 'length': 4, 'type': 'bold'}]
+    photo = [{'file_id': 'AgADBAAD' + str(i), 'file_unique_id': 'AQAD' + str(i), 'file_size': 1000 * i,
+              'width': 90 * i, 'height': 60 * i} for i in range(1, 4)]
+    reply = {'message_id': 10, 'from': user, 'chat': chat, 'date': 1600000000, 'photo': photo, 'caption': 'фото',
+             'caption_entities': entities}
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': 11, 'from': user, 'chat': chat, 'date': 1600000001, 'text': '/start text',
+                    'entities': entities, 'reply_to_message': reply}})
+
+
+def test_encode_decode_objects():
+    update = create_update(1)
+    decoded = codec.decode(codec.encode(update))
+    assert isinstance(decoded, types.Update)
+    assert decoded.to_dict() == update.to_dict()
+    assert decoded.message.reply_to_message.photo[2].width == 270
+
+
+def test_encode_decode_values():
+    msg = create_update(1).message
+    value = {'messages': [msg, msg], 'ints': [0, 127, 128, -1, -33, -200, 70000, 2 ** 40, -2 ** 40],
+             'other': (None, True, False, 1.5, 'x' * 300, b'\x00\x01'), 1: {'nested': {}}}
+    decoded = codec.decode(bytearray(codec.encode(value)))
+    assert decoded['ints'] == value['ints']
+    assert decoded['other'] == list(value['other'])
+    assert decoded[1] == {'nested': {}}
+    assert decoded['messages'][1].text == '/start text'
+
+
+def test_decode_rejects_foreign_data():
+    with pytest.raises(ValueError):
+        codec.decode(b'\x00\x00\x00\xc0')
+    with pytest.raises(ValueError):
+        # fixext 1 with extension type 5
+        codec.decode(codec._HEADER + b'\xd4\x05\x00')
+    with pytest.raises(TypeError):
+        codec.encode(object())
+
+
+def test_codec_smaller_than_json():
+    updates = [create_update(i) for i in range(200)]
+    encoded = [codec.encode(update) for update in updates]
+    assert [codec.decode(data).to_dict() for data in encoded] == [update.to_dict() for update in updates]
+    json_encoded = [update.to_json() for update in updates]
+    size, json_size = sum(map(len, encoded)), sum(len(data.encode('utf-8')) for data in json_encoded)
+    assert size < json_size
+
+
+def test_backends_are_compatible(monkeypatch):
+    msgpack = pytest.importorskip('msgpack')
+    value = {'update': create_update(1), 'list': [1, -200, 'x' * 40, b'\x00', None, 2.5]}
+    encoded = codec.encode(value)
+    monkeypatch.setattr(codec, 'msgpack', None if codec.msgpack else msgpack)
+    assert codec.encode(value) == encoded
+    decoded = codec.decode(encoded)
+    assert decoded['update'].to_dict() == value['update'].to_dict() and decoded['list'] == value['list']
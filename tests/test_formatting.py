@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import sys
+
+sys.path.append('../')
+
+import pytest
+
+from telebot import formatting
+from telebot import types
+
+
+def entity(type, offset, length, **kwargs):
+    return types.MessageEntity(type, offset, length, **kwargs)
+
+
+def test_html_text():
+    text = 'Test parse formatting, url, text_mention and mention @username'
+    entities = [entity('bold', 0, 4), entity('italic', 11, 10), entity('text_link', 23, 3, url='https://example.com'),
+                entity('text_mention', 28, 12, user=types.User(123456, False, 'u')), entity('mention', 53, 9)]
+    msg = types.Message(1, None, 1, types.Chat(1, 'private'), 'text', {'text': text, 'entities': entities}, '')
+    assert msg.html_text == (
+        '<b>Test</b> parse <i>formatting</i>, <a href="https://example.com">url</a>, '
+        '<a href="tg://user?id=123456">text_mention</a> and mention @username')
+    msg.custom_subs = {'bold': '<strong>{text}</strong>', 'mention': '<a href="{url}">{text}</a>'}
+    assert msg.html_text.startswith('<strong>Test</strong>')
+    assert msg.html_text.endswith('<a href="https://t.me/username">@username</a>')
+
+
+def test_nested_and_overlapping_entities():
+    entities = [entity('bold', 0, 11), entity('italic', 6, 5), entity('underline', 9, 4)]
+    assert formatting.apply_entities('hello world!!', entities) == \
+        '<b>hello <i>wor<u>ld</u></i></b><u>!!</u>'
+
+
+def test_utf16_offsets_and_escaping():
+    text = '\U0001F600 <b> & \U0001F600 bold'
+    entities = [entity('bold', 12, 4)]
+    assert formatting.apply_entities(text, entities) == '\U0001F600 &lt;b&gt; &amp; \U0001F600 <b>bold</b>'
+
+
+def test_markdown_v2():
+    text = 'a_b bold code(x)'
+    entities = [entity('bold', 4, 4), entity('code', 9, 7), entity('text_link', 0, 3, url='http://x.y/(1)')]
+    assert formatting.apply_entities(text, entities, 'MarkdownV2') == \
+        '[a\\_b](http://x.y/(1\\)) *bold* `code(x)`'
+    with pytest.raises(ValueError):
+        formatting.apply_entities(text, entities, 'Markdown')
+
+
+def test_message_markdown_text():
+    chat = types.Chat(1, 'private')
+    msg = types.Message(1, None, 1, chat, 'text', {'text': 'a_b (c).'}, '')
+    assert msg.markdown_text == 'a\\_b \\(c\\)\\.'
+    assert msg.markdown_caption is None
+    msg = types.Message(1, None, 1, chat, 'text', {'text': 'bold', 'entities': [entity('bold', 0, 4)]}, '')
+    msg.custom_subs = {'bold': '*_{text}_*'}
+    assert msg.markdown_text == '*_bold_*'
@@ -5,13 +5,14 @@ sys.path.append('../')
 REDIS_TESTS = False
 
 import os
+import pickle
 import time
 
 import pytest
 
 import telebot
 from telebot import types
-from telebot.handler_backends import MemoryHandlerBackend, FileHandlerBackend
+from telebot.handler_backends import MemoryHandlerBackend, FileHandlerBackend, BaseMiddleware, SkipHandler
 
 if REDIS_TESTS:
     from telebot.handler_backends import RedisHandlerBackend
@@ -268,3 +269,155 @@ def test_redis_handler_backend_clear_next_step_handler(telegram_bot, private_cha
 
     telegram_bot.process_new_updates([update_type])
     assert update_type.message.text == 'entered start'
+
+
+class RecordingMiddleware(BaseMiddleware):
+    def __init__(self, name, calls, update_types=None, skip=False):
+        self.name = name
+        self.calls = calls
+        self.update_types = update_types
+        self.skip = skip
+
+    def pre_process(self, message, data):
+        self.calls.append((self.name, 'pre'))
+        data[self.name] = True
+        if self.skip:
+            return SkipHandler()
+
+    def post_process(self, message, data, exception):
+        self.calls.append((self.name, 'post', type(exception).__name__ if exception else None))
+
+
+def test_class_middleware_runs_around_handler(telegram_bot, update_type):
+    calls = []
+    telegram_bot.setup_middleware(RecordingMiddleware('outer', calls))
+    telegram_bot.setup_middleware(RecordingMiddleware('inner', calls, update_types=['message']))
+    telegram_bot.setup_middleware(RecordingMiddleware('queries', calls, update_types=['callback_query']))
+
+    @telegram_bot.message_handler(commands=['start'])
+    def start(message):
+        calls.append(('handler',))
+
+    telegram_bot.process_new_updates([update_type])
+    assert calls == [('outer', 'pre'), ('inner', 'pre'), ('handler',), ('inner', 'post', None), ('outer', 'post', None)]
+    stats = telegram_bot.middleware_stats()
+    assert stats['RecordingMiddleware']['pre'][0] == 2
+    assert stats['RecordingMiddleware']['post'][0] == 2
+
+
+def test_class_middleware_skip_handler_and_exception(telegram_bot, update_type, message):
+    calls = []
+    telegram_bot.setup_middleware(RecordingMiddleware('skipper', calls, skip=True))
+
+    @telegram_bot.message_handler(commands=['start'])
+    def start(msg):
+        calls.append(('handler',))
+
+    telegram_bot.process_new_updates([update_type])
+    assert calls == [('skipper', 'pre'), ('skipper', 'post', None)]
+
+    calls[:] = []
+    telegram_bot.middlewares[0].skip = False
+
+    @telegram_bot.edited_message_handler(commands=['start'])
+    def edited(msg):
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        telegram_bot.process_new_edited_messages([message])
+    assert calls == [('skipper', 'pre'), ('skipper', 'post', 'ValueError')]
+
+
+def test_next_step_handlers_do_not_skip_messages(telegram_bot, user):
+    chats = [types.Chat(id=chat_id, type='private') for chat_id in (11, 12, 13)]
+    messages = [types.Message(1, user, None, chat, 'text', {'text': 'msg'}, "") for chat in chats]
+    telegram_bot.register_next_step_handler_by_chat_id(11, next_handler)
+    telegram_bot.register_next_step_handler_by_chat_id(12, next_handler)
+    telegram_bot.process_new_messages(list(messages))
+    assert [message.text for message in messages] == ['entered next_handler', 'entered next_handler', 'msg']
+
+
+def test_state_handlers(telegram_bot, user, private_chat, message):
+    @telegram_bot.message_handler(commands=['start'])
+    def start(msg):
+        msg.text = 'entered start'
+        telegram_bot.set_state(msg.chat.id, msg.from_user.id, 'ask_name')
+
+    @telegram_bot.state_handler('ask_name', regexp='^[a-z]+$')
+    def ask_name(msg):
+        telegram_bot.state_storage.set_data(msg.chat.id, msg.from_user.id, {'name': msg.text})
+        telegram_bot.delete_state(msg.chat.id, msg.from_user.id)
+        msg.text = 'entered ask_name'
+
+    telegram_bot.process_new_messages([message])
+    assert message.text == 'entered start'
+    assert telegram_bot.get_state(private_chat.id, user.id) == 'ask_name'
+
+    invalid = types.Message(2, user, None, private_chat, 'text', {'text': 'N0 name'}, "")
+    name = types.Message(3, user, None, private_chat, 'text', {'text': 'bob'}, "")
+    telegram_bot.process_new_messages([invalid, name])
+    assert invalid.text == 'N0 name'
+    assert name.text == 'entered ask_name'
+    assert telegram_bot.get_state(private_chat.id, user.id) is None
+    assert telegram_bot.state_storage.get_data(private_chat.id, user.id) == {}
+
+
+class FakeRedis(object):
+    # The hash commands RedisStateStorage uses; values come back as bytes like from a Redis server
+    def __init__(self, *args):
+        self.hashes = {}
+
+    def hset(self, key, field, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+
+def test_redis_state_storage(monkeypatch, telegram_bot, user, private_chat, message):
+    monkeypatch.setitem(sys.modules, 'redis', type(sys)('redis'))
+    monkeypatch.setattr(sys.modules['redis'], 'Redis', FakeRedis, raising=False)
+    from telebot.handler_backends import RedisStateStorage
+    from telebot import codec
+
+    @telegram_bot.state_handler(2)
+    def second_step(msg):
+        msg.text = 'entered second_step'
+
+    for serializer in (pickle, codec):
+        storage = telegram_bot.state_storage = RedisStateStorage(serializer=serializer)
+        assert storage.get_state(private_chat.id, user.id) is None
+        assert storage.get_data(private_chat.id, user.id) == {}
+        storage.set_state(private_chat.id, user.id, 2)
+        storage.set_data(private_chat.id, user.id, {'user': user})
+        assert storage.get_state(private_chat.id, user.id) == 2
+        assert storage.get_data(private_chat.id, user.id)['user'].first_name == 'Some User'
+        telegram_bot.process_new_messages([message])
+        assert message.text == 'entered second_step'
+        storage.delete_state(private_chat.id, user.id)
+        assert storage.get_state(private_chat.id, user.id) is None
+        message.text = '/start'
+
+
+def test_class_middleware_default_hooks_and_next_step(telegram_bot, user):
+    calls = []
+
+    class PreOnlyMiddleware(BaseMiddleware):
+        def pre_process(self, message, data):
+            calls.append(('pre', message.text))
+
+    telegram_bot.setup_middleware(PreOnlyMiddleware())
+
+    def step(message):
+        calls.append(('step', message.text))
+
+    chat = types.Chat(id=11, type='private')
+    telegram_bot.register_next_step_handler_by_chat_id(11, step)
+    telegram_bot.process_new_messages([types.Message(1, user, None, chat, 'text', {'text': 'msg'}, "")])
+    assert calls == [('pre', 'msg'), ('step', 'msg')]
+    assert telegram_bot._middleware_wrappers == {}
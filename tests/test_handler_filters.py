@@ -0,0 +1,90 @@
+import sys
+
+sys.path.append('../')
+
+import re
+
+import pytest
+
+import telebot
+from telebot import types
+from telebot import handler_filters
+
+
+@pytest.fixture()
+def telegram_bot():
+    return telebot.TeleBot('', threaded=False)
+
+
+def create_text_message(text, chat_type='private'):
+    params = {'text': text}
+    chat = types.Chat(id=11, type=chat_type)
+    user = types.User(id=10, is_bot=False, first_name='Some User')
+    return types.Message(1, user, None, chat, 'text', params, "")
+
+
+def test_compile_filters_cheapest_first():
+    compiled = handler_filters.compile_filters(
+        {'commands': ['start'], 'regexp': 'a', 'func': lambda m: True, 'content_types': ['text']})
+    assert [type(f) for f in compiled] == [
+        handler_filters.ContentTypesFilter, handler_filters.CommandsFilter,
+        handler_filters.RegexpFilter, handler_filters.FuncFilter]
+
+
+def test_compile_filters_skips_none_values():
+    compiled = handler_filters.compile_filters({'commands': None, 'regexp': None, 'content_types': ['text']})
+    assert len(compiled) == 1
+    assert isinstance(compiled[0].value, frozenset)
+
+
+def test_func_not_called_for_rejected_content_type():
+    def func(message):
+        raise AssertionError('func must not run for a non-matching content type')
+
+    compiled = handler_filters.compile_filters({'func': func, 'content_types': ['document']})
+    assert not handler_filters.check_filters(compiled, create_text_message('hello'))
+
+
+def test_commands_are_normalized():
+    commands_filter = handler_filters.CommandsFilter(['/start', 'help'])
+    assert commands_filter.check(create_text_message('/start'))
+    assert commands_filter.check(create_text_message('/help@SomeBot now'))
+    assert not commands_filter.check(create_text_message('start'))
+
+
+def test_regexp_filter_accepts_compiled_pattern():
+    assert handler_filters.RegexpFilter('HELLO').check(create_text_message('hello world'))
+    assert handler_filters.RegexpFilter(re.compile('^world')).check(create_text_message('world'))
+    assert not handler_filters.RegexpFilter(re.compile('^world')).check(create_text_message('hello world'))
+
+
+def test_unknown_filter_never_matches(telegram_bot):
+    msg = create_text_message('hello')
+
+    @telegram_bot.message_handler(unknown_filter=True)
+    def handler(message):
+        message.text = 'got'
+
+    telegram_bot.process_new_messages([msg])
+    assert msg.text == 'hello'
+
+
+def test_custom_filter(telegram_bot):
+    class ChatTypeFilter(handler_filters.HandlerFilter):
+        key = 'chat_types'
+
+        def check(self, message):
+            return message.chat.type in self.value
+
+    private_msg = create_text_message('hello')
+    group_msg = create_text_message('hello', chat_type='group')
+
+    @telegram_bot.message_handler(chat_types=['group'])
+    def handler(message):
+        message.text = 'got'
+
+    telegram_bot.add_custom_filter(ChatTypeFilter)
+
+    telegram_bot.process_new_messages([private_msg, group_msg])
+    assert private_msg.text == 'hello'
+    assert group_msg.text == 'got'
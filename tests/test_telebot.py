@@ -572,3 +572,190 @@ class TestTeleBot:
         #tb = telebot.TeleBot(TOKEN)
         #permissions = types.ChatPermissions(can_send_messages=True, can_send_polls=False)
         #msg = tb.set_chat_permissions(CHAT_ID, permissions)
+
+
+@pytest.fixture()
+def telegram_bot():
+    return telebot.TeleBot('', threaded=False)
+
+
+def create_text_message(text, chat_type='private'):
+    params = {'text': text}
+    chat = types.Chat(id=11, type=chat_type)
+    user = types.User(id=10, is_bot=False, first_name='Some User')
+    return types.Message(1, user, None, chat, 'text', params, "")
+
+
+def test_polling_with_worker_pool_without_limits(monkeypatch):
+    class MinimalPool(object):
+        def put(self, func, *args, **kwargs):
+            func(*args, **kwargs)
+
+    bot = telebot.TeleBot('', worker_pool=MinimalPool())
+    requested = []
+    monkeypatch.setattr(bot, 'get_updates', lambda **kwargs: requested.append(kwargs['limit']) or [])
+    bot._TeleBot__retrieve_updates(timeout=0)
+    assert requested == [None]
+
+
+def create_album_message(message_id, media_group_id):
+    chat = types.Chat(id=11, type='private')
+    user = types.User(id=10, is_bot=False, first_name='Some User')
+    params = {'photo': [], 'media_group_id': media_group_id}
+    return types.Message(message_id, user, None, chat, 'photo', params, "")
+
+
+def test_media_group_handler_receives_album(telegram_bot):
+    albums = []
+    single = []
+    telegram_bot.media_group_debounce = 0.05
+
+    @telegram_bot.media_group_handler()
+    def album_handler(messages):
+        albums.append([message.message_id for message in messages])
+
+    @telegram_bot.message_handler(content_types=['photo', 'text'])
+    def message_handler(message):
+        single.append(message.message_id)
+
+    telegram_bot.process_new_messages([create_album_message(2, 'a'), create_album_message(1, 'a')])
+    telegram_bot.process_new_messages([create_album_message(3, 'a'), create_album_message(4, 'b')])
+    telegram_bot.process_new_messages([create_text_message('hello')])
+    assert albums == [] and single == [1]
+    time.sleep(0.3)
+    assert sorted(albums) == [[1, 2, 3], [4]]
+    assert telegram_bot.media_group_collector.pending() == 0
+
+
+def test_media_group_falls_back_to_message_handlers(telegram_bot):
+    single = []
+
+    @telegram_bot.media_group_handler(content_types=['video'])
+    def album_handler(messages):
+        raise AssertionError('photo albums must not reach a video album handler')
+
+    @telegram_bot.message_handler(content_types=['photo'])
+    def message_handler(message):
+        single.append(message.message_id)
+
+    telegram_bot.process_new_messages([create_album_message(1, 'a'), create_album_message(2, 'a')])
+    telegram_bot.media_group_collector.flush()
+    assert single == [1, 2]
+
+
+def test_media_group_errors_and_debounce_changes(telegram_bot):
+    errors = []
+
+    class RecordingExceptionHandler(telebot.ExceptionHandler):
+        def handle(self, exception):
+            errors.append(exception)
+            return True
+
+    telegram_bot.exception_handler = RecordingExceptionHandler()
+
+    @telegram_bot.media_group_handler()
+    def album_handler(messages):
+        raise ValueError(len(messages))
+
+    collector = telegram_bot.media_group_collector
+    telegram_bot.process_new_messages([create_album_message(1, 'a'), create_album_message(2, 'a')])
+    collector.flush()
+    assert [error.args for error in errors] == [(2,)]
+
+    telegram_bot.media_group_debounce = 0.05
+    telegram_bot.process_new_messages([create_album_message(4, 'b')])
+    time.sleep(0.3)
+    assert collector.debounce == 0.05 and collector.pending() == 0
+    assert [error.args for error in errors] == [(2,), (1,)]
+
+
+def test_batch_handler_receives_matching_messages(telegram_bot):
+    batches = []
+    single = []
+
+    @telegram_bot.batch_handler(regexp='^log')
+    def store(messages):
+        batches.append([message.text for message in messages])
+
+    @telegram_bot.message_handler(func=lambda message: True)
+    def handler(message):
+        single.append(message.text)
+
+    telegram_bot.process_new_messages([create_text_message('log 1'), create_text_message('hi'),
+                                       create_text_message('log 2')])
+    telegram_bot.process_new_edited_messages([create_text_message('log 3')])
+    assert batches == [['log 1', 'log 2']]
+    assert single == ['log 1', 'hi', 'log 2']
+
+
+def test_batch_handler_windows(telegram_bot):
+    batches = []
+
+    @telegram_bot.batch_handler(update_types=['message', 'channel_post'], max_size=3, max_delay=0.05)
+    def store(messages):
+        batches.append([message.text for message in messages])
+
+    telegram_bot.process_new_messages([create_text_message(str(i)) for i in range(4)])
+    telegram_bot.process_new_channel_posts([create_text_message('4')])
+    assert batches == [['0', '1', '2']]
+    time.sleep(0.2)
+    assert batches == [['0', '1', '2'], ['3', '4']]
+
+
+def test_batch_handler_timer_errors_reach_exception_handler(telegram_bot):
+    errors = []
+
+    class RecordingExceptionHandler(telebot.ExceptionHandler):
+        def handle(self, exception):
+            errors.append(exception)
+            return True
+
+    telegram_bot.exception_handler = RecordingExceptionHandler()
+
+    @telegram_bot.batch_handler(max_delay=0.05)
+    def store(messages):
+        raise ValueError(len(messages))
+
+    telegram_bot.process_new_messages([create_text_message('1'), create_text_message('2')])
+    time.sleep(0.2)
+    assert [error.args for error in errors] == [(2,)]
+
+
+def test_inline_query_coalescing(telegram_bot):
+    answered = []
+    telegram_bot.enable_inline_query_coalescing()
+
+    @telegram_bot.inline_handler(func=lambda query: True)
+    def answer(query):
+        answered.append(query.query)
+
+    user = types.User(7, False, 'u')
+    other = types.User(8, False, 'v')
+    telegram_bot.process_new_inline_query([
+        types.InlineQuery(1, user, None, 'h', ''), types.InlineQuery(2, other, None, 'x', ''),
+        types.InlineQuery(3, user, None, 'hello', '')])
+    assert answered == ['hello', 'x']
+
+
+def test_inline_query_coalescing_process_pool(telegram_bot):
+    class RecordingPool(object):
+        def __init__(self):
+            self.tasks = []
+
+        def put(self, func, *args, **kwargs):
+            self.tasks.append((func, args))
+
+    telegram_bot.enable_inline_query_coalescing()
+    telegram_bot.process_pool = RecordingPool()
+
+    @telegram_bot.inline_handler(func=lambda query: True)
+    @telegram_bot.run_in_process
+    def answer(query):
+        pass
+
+    user = types.User(7, False, 'u')
+    newer = types.InlineQuery(3, user, None, 'hello', '')
+    telegram_bot.process_new_inline_query([types.InlineQuery(1, user, None, 'h', ''), newer])
+    assert telegram_bot.process_pool.tasks == [(answer, (newer,))]
+    # The query was claimed when it was sent to the pool
+    assert not telegram_bot.inline_query_coalescer.claim(newer)
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
+import json
+import pickle
 import sys
 
+import pytest
+
 sys.path.append('../')
 from telebot import types
+from telebot import util
 
 
 def test_json_user():
@@ -219,3 +224,273 @@ def test_KeyboardButtonPollType():
     json_str = markup.to_json()
     assert 'request_poll' in json_str
     assert 'quiz' in json_str
+
+
+def test_types_use_slots():
+    import inspect
+    for name, cls in inspect.getmembers(types, inspect.isclass):
+        if cls.__module__ != types.__name__ or cls is types.Message:
+            continue
+        assert '__slots__' in cls.__dict__, name
+    user = types.User(1, False, 'name')
+    assert not hasattr(user, '__dict__')
+    # Message keeps a __dict__ for attributes added by middleware
+    msg = types.Message.de_json(r'{"message_id":1,"chat":{"id":1,"type":"private"},"date":1,"text":"HIHI"}')
+    msg.custom_attribute = 1
+    assert 'HIHI' in str(msg)
+
+
+def test_types_have_no_instance_dict():
+    class DictUser(types.User):
+        pass
+
+    objects = [types.User(1, False, 'first', 'last', 'username'), types.Chat(5, 'private'),
+               types.MessageEntity('bold', 0, 4), types.PhotoSize('a', 'b', 90, 60)]
+    for obj in objects:
+        assert not hasattr(obj, '__dict__'), type(obj).__name__
+    assert hasattr(DictUser(1, False, 'first'), '__dict__')
+
+
+def _realistic_update(update_id):
+    user = {'id': 383324787, 'is_bot': False, 'first_name': 'Some', 'last_name': 'User', 'username': 'someuser',
+            'language_code': 'en'}
+    chat = {'id': -1001234567890, 'title': 'Group', 'type': 'supergroup', 'username': 'group'}
+    entities = [{'offset': 0, 'length': 6, 'type': 'bot_command'}, {'offset': 7, 'length': 4, 'type': 'bold'}]
+    photo = [{'file_id': 'AgADBAAD' + str(i), 'file_unique_id': 'AQAD' + str(i), 'file_size': 1000 * i,
+              'width': 90 * i, 'height': 60 * i} for i in range(1, 4)]
+    reply = {'message_id': 10, 'from': user, 'chat': chat, 'date': 1600000000, 'photo': photo, 'caption': 'photo',
+             'caption_entities': entities}
+    return {'update_id': update_id,
+            'message': {'message_id': 11, 'from': user, 'chat': chat, 'date': 1600000001, 'text': '/start text',
+                        'entities': entities, 'reply_to_message': reply}}
+
+
+def test_lazy_parsing(monkeypatch):
+    monkeypatch.setattr(types, 'LAZY_PARSING', True)
+    update = types.Update.de_json(_realistic_update(1))
+    assert isinstance(update._message, types._Raw)
+    msg = update.message
+    assert update.message is msg
+    assert isinstance(msg._reply_to_message, types._Raw)
+    assert msg.text == '/start text' and msg.content_type == 'text'
+    assert msg.from_user.username == 'someuser'
+    assert msg.chat is msg.chat
+    assert msg.reply_to_message.photo[2].width == 270
+    assert msg.reply_to_message.caption_entities[1].type == 'bold'
+    msg.chat = None
+    assert msg.chat is None
+    assert 'someuser' in str(msg)
+
+
+def test_lazy_parsing_defers_work(monkeypatch):
+    updates = [_realistic_update(i) for i in range(10)]
+
+    def parse_text(lazy):
+        monkeypatch.setattr(types, 'LAZY_PARSING', lazy)
+        messages = [types.Update.de_json(update).message for update in updates]
+        assert [message.text for message in messages] == ['/start text'] * 10
+        return messages
+
+    for message in parse_text(False):
+        assert isinstance(message._reply_to_message, types.Message)
+        assert isinstance(message._from_user, types.User)
+    for message in parse_text(True):
+        # Reading the text parses neither the nested message nor the users, chats and entities
+        for name in ('reply_to_message', 'from_user', 'chat', 'entities'):
+            assert isinstance(getattr(message, '_' + name), types._Raw)
+
+
+def test_message_content_type_priority():
+    json_string = {'message_id': 1, 'date': 1, 'chat': {'id': 5, 'type': 'private'}, 'caption': 'gif',
+                   'animation': {'file_id': 'a', 'file_unique_id': 'b', 'width': 1, 'height': 1, 'duration': 1},
+                   'document': {'file_id': 'a', 'file_unique_id': 'b'}, 'unknown_field': 1}
+    msg = types.Message.de_json(json_string)
+    assert msg.content_type == 'animation'
+    assert msg.document.file_id == 'a' and msg.caption == 'gif'
+    assert not hasattr(msg, 'unknown_field')
+
+
+def test_message_contact():
+    json_string = {'message_id': 1, 'date': 1, 'chat': {'id': 5, 'type': 'private'},
+                   'contact': {'phone_number': '+1', 'first_name': 'Some', 'user_id': 7}}
+    msg = types.Message.de_json(json_string)
+    assert msg.content_type == 'contact'
+    assert msg.contact.phone_number == '+1' and msg.contact.user_id == 7
+
+
+def test_message_json_retention(monkeypatch):
+    payload = _realistic_update(1)['message']
+    assert types.Message.de_json(payload).json is payload
+
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', 'bytes')
+    msg = types.Message.de_json(payload)
+    assert isinstance(msg.json, bytes) and b'": ' not in msg.json
+    assert json.loads(msg.json.decode('utf-8')) == payload
+    assert types.Message.de_json(msg.json.decode('utf-8')).text == '/start text'
+    assert msg.reply_to_message.json is None
+
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', 'top_level')
+    msg = types.Message.de_json(payload)
+    assert msg.json is payload and msg.reply_to_message.json is None
+
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', 'drop')
+    msg = types.Message.de_json(payload)
+    assert msg.json is None and msg.reply_to_message.json is None
+
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', 'compact')
+    with pytest.raises(ValueError):
+        types.Message.de_json(payload)
+
+
+def test_interning():
+    types.enable_interning(maxsize=2)
+    try:
+        user = {'id': 1, 'is_bot': False, 'first_name': 'Some'}
+        first = types.Message.de_json({'message_id': 1, 'date': 1, 'from': user, 'chat': {'id': 5, 'type': 'private'}})
+        second = types.Message.de_json({'message_id': 2, 'date': 1, 'from': dict(user),
+                                        'chat': {'id': 5, 'type': 'private'}})
+        assert first.from_user is second.from_user and first.chat is second.chat
+        renamed = types.User.de_json(dict(user, first_name='Other'))
+        assert renamed is not first.from_user and renamed.first_name == 'Other'
+        assert types.get_interned(types.User, 1) is renamed
+        assert types.get_interned(types.Chat, 5) is first.chat
+        types.User.de_json({'id': 2, 'is_bot': False, 'first_name': 'Two'})
+        assert types.get_interned(types.User, 1) is None
+        full_chat = {'id': 6, 'type': 'private', 'permissions': {'can_send_messages': True}}
+        assert types.Chat.de_json(full_chat) is not types.Chat.de_json(full_chat)
+    finally:
+        types.disable_interning()
+    assert types.User.de_json(user) is not types.User.de_json(user)
+
+
+def test_frozen_inline_keyboard_markup():
+    markup = types.InlineKeyboardMarkup.build([[('<', 'page:prev'), {'text': '>', 'callback_data': 'page:next'}],
+                                               [types.InlineKeyboardButton('Google', url='http://www.google.com')]])
+    assert markup.frozen
+    serialized = markup.to_json()
+    assert markup.to_json() is serialized
+    assert json.loads(serialized)['inline_keyboard'][0][1] == {'text': '>', 'callback_data': 'page:next'}
+    with pytest.raises(AttributeError):
+        markup.keyboard[0].append(types.InlineKeyboardButton('x', callback_data='x'))
+    markup.row(types.InlineKeyboardButton('Yahoo', url='http://www.yahoo.com'))
+    assert not markup.frozen
+    assert len(json.loads(markup.to_json())['inline_keyboard']) == 3
+
+
+def test_frozen_inline_keyboard_markup_to_dict(monkeypatch):
+    markup = types.InlineKeyboardMarkup.build([[('<', 'page:prev'), ('>', 'page:next')]])
+    calls = []
+    monkeypatch.setattr(types.InlineKeyboardButton, 'to_dict', lambda button: calls.append(button) or {})
+    first = markup.to_dict()
+    first['inline_keyboard'][0].append({'text': 'x'})
+    result = types.InlineQueryResultArticle('1', 'title', types.InputTextMessageContent('text'), reply_markup=markup)
+    assert result.to_dict()['reply_markup'] == {'inline_keyboard': [[{'text': '<', 'callback_data': 'page:prev'},
+                                                                      {'text': '>', 'callback_data': 'page:next'}]]}
+    assert calls == []
+    markup.row_width = 2
+    assert markup.to_dict() == {'inline_keyboard': [[{}, {}]]} and len(calls) == 2
+
+
+def test_frozen_reply_keyboard_markup():
+    markup = types.ReplyKeyboardMarkup.build([['Search', 'Settings'], ['Help']], resize_keyboard=True)
+    assert json.loads(markup.to_json()) == {'keyboard': [[{'text': 'Search'}, {'text': 'Settings'}],
+                                                         [{'text': 'Help'}]], 'resize_keyboard': True}
+    markup.one_time_keyboard = True
+    assert not markup.frozen
+    assert json.loads(markup.freeze().to_json())['one_time_keyboard']
+
+
+def test_shipping_option_to_json():
+    option = types.ShippingOption('1', 'Post').add_price(types.LabeledPrice('Delivery', 500))
+    assert json.loads(option.to_json()) == {'id': '1', 'title': 'Post',
+                                            'prices': [{'label': 'Delivery', 'amount': 500}]}
+
+
+def test_inline_query_results_to_dict():
+    gif = types.InlineQueryResultMpeg4Gif('1', 'http://a/b.mp4', 'http://a/b.jpg', mpeg4_duration=3)
+    contact = types.InlineQueryResultArticle(
+        '2', 'title', types.InputContactMessageContent('+1', 'Some'))
+    cached = types.InlineQueryResultCachedPhoto('3', 'file_id')
+    assert gif.to_dict()['mpeg4_duration'] == 3
+    assert contact.to_dict()['input_message_content'] == {'phone_number': '+1', 'first_name': 'Some'}
+    assert json.loads(cached.to_json()) == cached.to_dict() == {'type': 'photo', 'id': '3', 'photo_file_id': 'file_id'}
+    assert cached.to_dict() is not cached.payload_dic
+
+
+def _without_none(value):
+    if isinstance(value, dict):
+        return dict((key, _without_none(item)) for key, item in value.items() if item is not None)
+    if isinstance(value, list):
+        return [_without_none(item) for item in value]
+    return value
+
+
+def test_to_dict_round_trip(monkeypatch):
+    user = {'id': 7, 'is_bot': False, 'first_name': 'Some', 'username': 'some'}
+    chat = {'id': 5, 'type': 'private', 'first_name': 'Some'}
+    poll = {'id': '1', 'question': 'q?', 'options': [{'text': 'a', 'voter_count': 1}], 'total_voter_count': 1,
+            'is_closed': False, 'is_anonymous': True, 'type': 'regular', 'allows_multiple_answers': False}
+    message = dict(_realistic_update(1)['message'], forward_from=user, forward_date=1, poll=poll,
+                   reply_markup={'inline_keyboard': [[{'text': 'a', 'callback_data': 'b'}]]})
+    message['entities'] = [{'offset': 0, 'length': 6, 'type': 'text_mention', 'user': user}]
+    payloads = [
+        {'update_id': 1, 'message': message},
+        {'update_id': 2, 'callback_query': {'id': '1', 'from': user, 'chat_instance': 'c', 'data': 'page:2',
+                                            'message': {'message_id': 3, 'date': 1, 'chat': chat, 'text': 'x'}}},
+        {'update_id': 3, 'inline_query': {'id': '2', 'from': user, 'query': 'q', 'offset': '',
+                                          'location': {'longitude': 1.5, 'latitude': 2.5}}},
+        {'update_id': 4, 'poll_answer': {'poll_id': '1', 'user': user, 'option_ids': [0]}},
+    ]
+    for lazy in (False, True):
+        monkeypatch.setattr(types, 'LAZY_PARSING', lazy)
+        for payload in payloads:
+            update = types.Update.de_json(payload)
+            assert _without_none(update.to_dict()) == payload
+            assert _without_none(json.loads(update.to_json())) == payload
+    assert _without_none(types.Message.de_json(message).to_dict()['from']) == message['from']
+
+
+def test_de_json_bytes():
+    payload = json.dumps(_realistic_update(1)).encode('utf-8')
+    for data in (payload, bytearray(payload), memoryview(payload)):
+        assert types.Update.de_json(data).message.reply_to_message.photo[0].width == 90
+    second = payload.replace(b'"update_id": 1', b'"update_id": 2')
+    response = b'{"ok":true,"result":[' + payload + b',' + second + b']}'
+    updates = types.Update.de_json_many(response)
+    assert [update.update_id for update in updates] == [1, 2]
+    assert types.Update.de_json_many([_realistic_update(3)])[0].update_id == 3
+    assert types.Update.de_json_many('[]') == []
+
+
+@pytest.mark.parametrize('retention', ['keep', 'bytes', 'drop', 'top_level'])
+def test_message_de_json_buffers(monkeypatch, retention):
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', retention)
+    payload = json.dumps(_realistic_update(1)['message']).encode('utf-8')
+    for data in (payload, bytearray(payload), memoryview(bytearray(payload))):
+        msg = types.Message.de_json(data)
+        assert msg.text == '/start text' and msg.reply_to_message.message_id == 10
+        if retention == 'drop':
+            assert msg.json is None
+        else:
+            assert msg.json == payload and isinstance(msg.json, bytes)
+        if not isinstance(data, bytes):
+            # The caller reuses its buffer
+            data[:] = b' ' * len(data)
+        assert msg.json is None or msg.json == payload
+        packed = pickle.loads(pickle.dumps(util.pack_task_argument(msg)))
+        assert util.unpack_task_argument(packed).text == '/start text'
+
+
+def test_de_json_bytes_str_only_parser(monkeypatch):
+    class StrOnlyJson(object):
+        # Like the json module of Python 3.5
+        @staticmethod
+        def loads(data):
+            if not isinstance(data, str):
+                raise TypeError('the JSON object must be str, not {0!r}'.format(type(data).__name__))
+            return json.loads(data)
+
+    monkeypatch.setattr(types, 'json', StrOnlyJson)
+    payload = json.dumps(_realistic_update(1)).encode('utf-8')
+    for data in (payload, bytearray(payload), memoryview(payload)):
+        assert types.Update.de_json(data).update_id == 1
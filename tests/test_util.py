@@ -0,0 +1,448 @@
+import sys
+
+sys.path.append('../')
+
+import gc
+import json
+import os
+import threading
+import time
+
+from telebot import types
+from telebot import util
+
+
+def create_text_message(text, chat_id=11):
+    params = {'text': text}
+    chat = types.Chat(id=chat_id, type='private')
+    user = types.User(id=10, is_bot=False, first_name='Some User')
+    return types.Message(1, user, None, chat, 'text', params, "")
+
+
+def test_shard_key():
+    msg = create_text_message('hi', chat_id=42)
+    assert util.shard_key(msg) == 42
+    call = types.CallbackQuery(1, types.User(7, False, 'u'), 'data', 'instance', message=msg)
+    assert util.shard_key(call) == 42
+    query = types.InlineQuery(1, types.User(7, False, 'u'), None, 'query', '')
+    assert util.shard_key(query) == 7
+    assert util.shard_key([msg]) is None
+
+
+def test_sharded_thread_pool_keeps_chat_order():
+    pool = util.ShardedThreadPool(num_threads=4)
+    done = []
+    finished = threading.Event()
+
+    def task(message, delay):
+        time.sleep(delay)
+        done.append(message.text)
+        if len(done) == 5:
+            finished.set()
+
+    for i in range(5):
+        pool.put(task, create_text_message(str(i)), 0.05 * (5 - i))
+    assert finished.wait(3)
+    assert done == ['0', '1', '2', '3', '4']
+    pool.close()
+
+
+def test_sharded_thread_pool_runs_chats_in_parallel():
+    pool = util.ShardedThreadPool(num_threads=2)
+    both_running = threading.Barrier(2, timeout=2)
+    results = []
+
+    def task(message):
+        both_running.wait()
+        results.append(message.chat.id)
+
+    pool.put(task, create_text_message('a', chat_id=1))
+    pool.put(task, create_text_message('b', chat_id=2))
+    for _ in range(30):
+        if len(results) == 2:
+            break
+        time.sleep(0.1)
+    assert sorted(results) == [1, 2]
+    pool.close()
+
+
+def test_sharded_thread_pool_rebalances_idle_keys():
+    pool = util.ShardedThreadPool(num_threads=2, rebalance_threshold=2)
+    release = threading.Event()
+
+    # chat 2 hashes to lane 0, keep that lane busy
+    for _ in range(3):
+        pool.put(lambda message: release.wait(2), create_text_message('busy', chat_id=2))
+    pool.put(lambda message: release.wait(2), create_text_message('moved', chat_id=4))
+    assert pool.lane_of(2) == 0
+    assert pool.lane_of(4) == 1
+    release.set()
+    pool.close()
+
+
+def test_update_type_of():
+    msg = create_text_message('hi')
+    assert util.update_type_of(msg) == 'message'
+    msg.edit_date = 1
+    assert util.update_type_of(msg) == 'edited_message'
+    query = types.InlineQuery(1, types.User(7, False, 'u'), None, 'query', '')
+    assert util.update_type_of(query) == 'inline_query'
+    assert util.update_type_of([msg]) is None
+
+    class CallbackQuery(object):
+        pass
+
+    assert util.update_type_of(CallbackQuery()) is None
+
+
+def test_priority_task_queue_orders_by_priority():
+    queue = util.PriorityTaskQueue(starvation_timeout=10)
+    queue.put((util.PRIORITY_NORMAL, 'message 1'))
+    queue.put((util.PRIORITY_NORMAL, 'message 2'))
+    queue.put((util.PRIORITY_HIGH, 'callback'))
+    assert [queue.get(), queue.get(), queue.get()] == ['callback', 'message 1', 'message 2']
+
+
+def test_priority_task_queue_starvation_protection():
+    queue = util.PriorityTaskQueue(starvation_timeout=0.05)
+    queue.put((util.PRIORITY_LOW, 'bulk'))
+    time.sleep(0.1)
+    queue.put((util.PRIORITY_HIGH, 'callback'))
+    assert queue.get() == 'bulk'
+    assert queue.get() == 'callback'
+
+
+def test_priority_thread_pool_priority_of():
+    def handler(obj):
+        pass
+
+    pool = util.PriorityThreadPool(num_threads=1, priorities={'message': util.PRIORITY_LOW})
+    call = types.CallbackQuery(1, types.User(7, False, 'u'), 'data', 'instance')
+    assert pool.priority_of(handler, (call,)) == util.PRIORITY_HIGH
+    assert pool.priority_of(handler, (create_text_message('hi'),)) == util.PRIORITY_LOW
+    pool.set_handler_priority(handler, util.PRIORITY_HIGH)
+    assert pool.priority_of(handler, (create_text_message('hi'),)) == util.PRIORITY_HIGH
+    pool.close()
+
+
+def test_thread_pool_limits_pending_tasks():
+    pool = util.ThreadPool(num_threads=1, max_tasks=2)
+    release = threading.Event()
+    assert pool.free_slots() == 2
+    pool.put(lambda message: release.wait(2), create_text_message('a'))
+    pool.put(lambda message: release.wait(2), create_text_message('b'))
+    assert pool.free_slots() == 0
+    assert not pool.wait_for_capacity(timeout=0.05)
+    release.set()
+    assert pool.wait_for_capacity(timeout=2)
+    pool.close()
+
+
+def test_thread_pool_limits_pending_bytes():
+    pool = util.ShardedThreadPool(num_threads=1, max_bytes=1)
+    release = threading.Event()
+    pool.put(lambda message: release.wait(2), create_text_message('a'))
+    assert pool.free_slots() is None
+    assert pool.limiter.pending_bytes > 0
+    assert not pool.wait_for_capacity(timeout=0.05)
+    release.set()
+    assert pool.wait_for_capacity(timeout=2)
+    assert pool.limiter.pending_bytes == 0
+    pool.close()
+
+
+def test_approximate_size_without_size_of(monkeypatch):
+    # PyPy's getsizeof raises TypeError unless it is given a default
+    def getsizeof(obj, default=None):
+        if default is None:
+            raise TypeError("getsizeof(...) not implemented on PyPy")
+        return default
+
+    monkeypatch.setattr(util.sys, 'getsizeof', getsizeof)
+    assert util.approximate_size(create_text_message('hi')) > 0
+
+
+def test_unbounded_thread_pool_has_capacity():
+    pool = util.PriorityThreadPool(num_threads=1)
+    assert pool.wait_for_capacity(timeout=0)
+    assert pool.free_slots() is None
+    pool.close()
+
+
+def test_elastic_thread_pool_scales_up_and_down():
+    pool = util.ElasticThreadPool(min_threads=1, max_threads=3, wait_threshold=0.05, keep_alive=0.2,
+                                  scale_interval=0.02)
+    release = threading.Event()
+    for _ in range(3):
+        pool.put(release.wait, 2)
+    for _ in range(50):
+        if pool.stats()['size'] == 3:
+            break
+        time.sleep(0.05)
+    assert pool.stats()['size'] == 3
+    release.set()
+    for _ in range(50):
+        if pool.stats()['size'] == 1:
+            break
+        time.sleep(0.05)
+    stats = pool.stats()
+    assert stats['size'] == 1
+    assert stats['scale_ups'] == 2 and stats['scale_downs'] == 2
+    assert stats['max_wait'] > 0.05
+    assert [event[1] for event in stats['events']] == ['up', 'up', 'down', 'down']
+    pool.close()
+
+
+def _process_task(message, suffix=''):
+    return os.getpid(), message.text + suffix
+
+
+def test_pack_task_argument_uses_raw_json():
+    msg = types.Message.de_json({'message_id': 1, 'date': 1, 'text': 'hi', 'chat': {'id': 5, 'type': 'private'}})
+    cls, data = util.pack_task_argument(msg)
+    assert cls is types.Message and data.startswith('{')
+    assert util.unpack_task_argument((cls, data)).text == 'hi'
+    assert util.pack_task_argument([msg]) == (None, [msg])
+
+
+def test_process_pool_runs_task_in_child():
+    pool = util.ProcessPool(num_processes=1)
+    msg = types.Message.de_json({'message_id': 1, 'date': 1, 'text': 'hi', 'chat': {'id': 5, 'type': 'private'}})
+    pid, text = pool.put(_process_task, msg, suffix='!').get(10)
+    assert pid != os.getpid()
+    assert text == 'hi!'
+    pool.close()
+
+
+def _failing_process_task(message):
+    raise ValueError(message.text)
+
+
+def test_process_pool_exception_callback():
+    errors = []
+    pool = util.ProcessPool(num_processes=1, exception_callback=errors.append)
+    msg = types.Message.de_json({'message_id': 1, 'date': 1, 'text': 'hi', 'chat': {'id': 5, 'type': 'private'}})
+    pool.put(_failing_process_task, msg).wait(10)
+    pool.close()
+    assert isinstance(errors[0], ValueError) and errors[0].args == ('hi',)
+
+
+def test_watchdog_flags_and_cancels_slow_handler():
+    overruns = []
+    watchdog = util.Watchdog(default_deadline=0.05, interval=0.02,
+                             on_overrun=lambda handler, elapsed, stack: overruns.append((handler, stack)))
+
+    def slow_handler(message):
+        for _ in range(100):
+            util.check_cancelled()
+            time.sleep(0.01)
+        message.text = 'finished'
+
+    def fast_handler(message):
+        assert not util.cancelled()
+
+    msg = create_text_message('hi')
+    wrapper = watchdog.wrap(slow_handler)
+    assert wrapper.__wrapped__ is slow_handler
+    assert watchdog.wrap(slow_handler) is wrapper
+    wrapper(msg)
+    watchdog.wrap(fast_handler)(msg)
+    watchdog.close()
+
+    assert msg.text == 'hi'
+    assert overruns[0][0] is slow_handler
+    assert 'slow_handler' in overruns[0][1]
+    stats = watchdog.stats()
+    slow_stats = [value for name, value in stats.items() if name.endswith('slow_handler')][0]
+    assert slow_stats['calls'] == 1 and slow_stats['overruns'] == 1
+    assert stats['running'] == []
+
+
+def test_watchdog_handler_deadline():
+    watchdog = util.Watchdog(default_deadline=0.01, interval=0.02)
+
+    def handler(message):
+        time.sleep(0.1)
+        assert not util.cancelled()
+
+    watchdog.set_deadline(handler, None)
+    watchdog.wrap(handler)(create_text_message('hi'))
+    watchdog.close()
+
+
+def test_watchdog_nested_calls_and_same_named_handlers():
+    watchdog = util.Watchdog(interval=10)
+
+    def make_handler():
+        def handler(message):
+            message.text = len(watchdog.stats()['running'])
+        return handler
+
+    first, second = make_handler(), make_handler()
+
+    def outer(message):
+        watchdog.wrap(first)(message)
+        assert message.text == 2
+        assert watchdog.stats()['running'][0][0].endswith('outer')
+
+    watchdog.wrap(outer)(create_text_message('hi'))
+    watchdog.wrap(second)(create_text_message('hi'))
+    watchdog.close()
+
+    stats = watchdog.stats()
+    assert stats['running'] == []
+    assert len([name for name in stats if '.handler#' in name]) == 2
+    watchdog._wrappers.clear()
+    del first
+    gc.collect()
+    assert len([name for name in watchdog.stats() if '.handler#' in name]) <= 1
+
+
+def create_album_message(message_id, media_group_id):
+    params = {'photo': [], 'media_group_id': media_group_id}
+    return types.Message(message_id, None, None, types.Chat(id=11, type='private'), 'photo', params, "")
+
+
+def test_media_group_collector_one_timer_per_album():
+    albums = []
+    collector = util.MediaGroupCollector(albums.append, debounce=0.2)
+    single = collector.collect([create_album_message(2, 'a'), create_text_message('hi')])
+    assert [message.text for message in single] == ['hi']
+    timer = collector._timers['a']
+    time.sleep(0.1)
+    collector.collect([create_album_message(1, 'a')])
+    assert collector._timers['a'] is timer
+    time.sleep(0.15)
+    # The timer fired too early for message 1 and was rescheduled
+    assert albums == [] and collector.pending() == 1
+    time.sleep(0.3)
+    assert [[message.message_id for message in album] for album in albums] == [[1, 2]]
+    assert collector._timers == {}
+
+
+def test_media_group_collector_reports_callback_errors():
+    errors = []
+
+    def callback(album):
+        raise ValueError(len(album))
+
+    collector = util.MediaGroupCollector(callback, debounce=10, exception_callback=errors.append)
+    collector.collect([create_album_message(1, 'a'), create_album_message(2, 'a')])
+    collector.flush()
+    assert [error.args for error in errors] == [(2,)]
+
+
+def test_batch_collector_size_and_delay():
+    batches = []
+    collector = util.BatchCollector(batches.append, max_size=2, max_delay=0.05)
+    collector.add([1, 2, 3])
+    assert batches == [[1, 2]]
+    time.sleep(0.2)
+    assert batches == [[1, 2], [3]]
+    collector.add([4])
+    collector.flush()
+    assert batches == [[1, 2], [3], [4]]
+
+
+def test_batch_collector_reports_timer_errors():
+    errors = []
+
+    def callback(batch):
+        raise ValueError(batch)
+
+    collector = util.BatchCollector(callback, max_delay=0.05, exception_callback=errors.append)
+    collector.add([1, 2])
+    time.sleep(0.2)
+    assert [error.args for error in errors] == [([1, 2],)]
+
+
+def test_coalescer_drops_superseded_items():
+    dispatched = []
+    coalescer = util.Coalescer(dispatched.append, lambda item: item[0])
+    coalescer.add([('user1', 'a'), ('user2', 'x'), ('user1', 'ab')])
+    assert dispatched == [('user1', 'ab'), ('user2', 'x')]
+    assert coalescer.claim(dispatched[0])
+    older, newer = ('user1', 'abc'), ('user1', 'abcd')
+    coalescer.add([older])
+    coalescer.add([newer])
+    assert not coalescer.claim(older)
+    assert coalescer.claim(newer)
+    assert not coalescer.claim(newer)
+    assert coalescer.dropped == 2
+
+
+def test_coalescer_debounce():
+    dispatched = []
+    coalescer = util.Coalescer(dispatched.append, lambda item: item[0], debounce=0.05)
+    coalescer.add([('user1', 'a')])
+    coalescer.add([('user1', 'ab')])
+    assert dispatched == []
+    time.sleep(0.2)
+    assert dispatched == [('user1', 'ab')]
+    coalescer.close()
+
+
+def test_coalescer_debounce_uses_one_thread_and_reports_errors():
+    errors = []
+
+    def callback(item):
+        raise ValueError(item)
+
+    coalescer = util.Coalescer(callback, lambda item: item[0], debounce=0.05, exception_callback=errors.append)
+    threads = threading.active_count()
+    for i in range(20):
+        coalescer.add([('user1', 'a' * i), ('user2', 'b' * i)])
+    assert threading.active_count() == threads + 1
+    time.sleep(0.3)
+    coalescer.close()
+    assert sorted(error.args[0] for error in errors) == [('user1', 'a' * 19), ('user2', 'b' * 19)]
+    assert threading.active_count() == threads
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = util.LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_ttl():
+    cache = util.LRUCache(ttl=0.05)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.1)
+    assert cache.get('a', 'expired') == 'expired'
+
+
+def test_inline_results_cache_pages():
+    cache = util.InlineResultsCache(page_size=2)
+    results = [types.InlineQueryResultArticle(str(i), 'title', types.InputTextMessageContent('text'))
+               for i in range(5)]
+    serialized = cache.set('query', results)
+    assert cache.get('query') is serialized
+    assert cache.get('query', user_id=7) is None
+    page, next_offset = cache.page(serialized, '')
+    assert next_offset == '2'
+    assert [result['id'] for result in json.loads(page)] == ['0', '1']
+    page, next_offset = cache.page(serialized, '4')
+    assert next_offset == ''
+    assert [result['id'] for result in json.loads(page)] == ['4']
+
+
+def test_pack_task_argument_bytes_json(monkeypatch):
+    monkeypatch.setattr(types, 'MESSAGE_JSON_RETENTION', 'bytes')
+    msg = types.Message.de_json({'message_id': 1, 'date': 1, 'text': 'hi', 'chat': {'id': 5, 'type': 'private'}})
+    assert util.unpack_task_argument(util.pack_task_argument(msg)).text == 'hi'
+
+
+def test_pack_task_argument_without_raw_json():
+    msg = types.Message.de_json({'message_id': 1, 'date': 1, 'text': 'hi', 'chat': {'id': 5, 'type': 'private'}})
+    call = types.CallbackQuery('1', types.User(7, False, 'u'), 'data', 'instance', message=msg)
+    cls, data = util.pack_task_argument(call)
+    assert cls is types.CallbackQuery
+    unpacked = util.unpack_task_argument((cls, data))
+    assert unpacked.message.text == 'hi' and unpacked.from_user.id == 7